@@ -0,0 +1,222 @@
+import asyncio
+import itertools
+import json
+import time
+from datetime import datetime, timezone
+
+import websockets
+
+_ids = itertools.count(1)
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+# Fake Twitch EventSub WebSocket server (and the Helix endpoint subscriptions are made on)
+#
+# Speaks enough of the protocol for eventsub.py: session_welcome on connect,
+# session_keepalive every keepalive seconds, notifications for the subscribed types and
+# session_reconnect pointing at itself (the new socket gets the same session). Takes the
+# same traces as FakePubSubServer (see traces.py), translated to EventSub notifications,
+# and replays them once the first subscription is made:
+#
+#   {"at": 0.25, "topic": "channel-subscribe-events-v1", "message": {...}}
+#   {"at": 3.0, "reconnect": true}
+#
+# Gift recipients aren't named by EventSub, so gift events can't be matched up by id.
+# A websocket ping is sent every probe seconds and its round trip recorded, which
+# measures how long the client's event loop is stalled.
+class FakeEventSubServer:
+    def __init__(self, trace, channel_id = '1234', host = '127.0.0.1', port = 0, speed = 1.0, probe = 0.05, keepalive = 10):
+        self.trace         = trace
+        self.channel_id    = channel_id
+        self.host          = host
+        self.port          = port
+        self.speed         = speed
+        self.probe         = probe
+        self.keepalive     = keepalive
+        self.session       = f'session{next(_ids)}'
+        self.sent          = {}      # event id -> monotonic send time
+        self.pings         = []      # websocket ping round trips (seconds)
+        self.subscriptions = []      # subscription requests received by the Helix endpoint
+        self.listened      = None    # monotonic time of the first subscription
+        self.done          = asyncio.Event()
+        self._server       = None
+        self._helix        = None
+        self._replay       = None
+        self._clients      = set()
+        self._hypelevel    = 1
+
+    # Same name as FakePubSubServer's LISTEN count, for the load test report
+    @property
+    def listens(self):
+        return len(self.subscriptions)
+
+    @property
+    def uri(self):
+        return f'ws://{self.host}:{self.port}'
+
+    @property
+    def helixuri(self):
+        return f'http://{self.host}:{self.helixport}/helix'
+
+    async def start(self):
+        self._server = await websockets.serve(self._client, self.host, self.port, ping_interval=None)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._helix = await asyncio.start_server(self._http, self.host, 0)
+        self.helixport = self._helix.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._replay is not None:
+            self._replay.cancel()
+        self._server.close()
+        self._helix.close()
+        await self._server.wait_closed()
+        await self._helix.wait_closed()
+
+    def _frame(self, mtype, payload, **metadata):
+        metadata.update({'message_id': metadata.get('message_id') or f'msg{next(_ids)}', 'message_type': mtype, 'message_timestamp': _now()})
+        return json.dumps({'metadata': metadata, 'payload': payload})
+
+    async def _client(self, websocket, path = None):
+        probe = asyncio.ensure_future(self._probe(websocket))
+        keepalive = asyncio.ensure_future(self._keepalive(websocket))
+        try:
+            await websocket.send(self._frame('session_welcome', {'session': {
+                'id': self.session, 'status': 'connected', 'keepalive_timeout_seconds': self.keepalive, 'reconnect_url': None}}))
+            self._clients.add(websocket)
+            async for frame in websocket:
+                pass
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            probe.cancel()
+            keepalive.cancel()
+            self._clients.discard(websocket)
+
+    async def _keepalive(self, websocket):
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            await websocket.send(self._frame('session_keepalive', {}))
+
+    # Helix: POST /helix/eventsub/subscriptions only
+    async def _http(self, reader, writer):
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                subscription = json.loads(body)
+                self.subscriptions.append(subscription)
+                if self.listened is None:
+                    self.listened = time.monotonic()
+                if self._replay is None:
+                    self._replay = asyncio.ensure_future(self._play())
+
+                resp = json.dumps({'data': [dict(subscription, id=f'sub{next(_ids)}', status='enabled', cost=0)],
+                                   'total': len(self.subscriptions), 'total_cost': 0, 'max_total_cost': 10}).encode()
+                writer.write(b'HTTP/1.1 202 Accepted\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: %d\r\n\r\n%s' % (len(resp), resp))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _play(self):
+        start = time.monotonic()
+        for event in self.trace:
+            delay = start + event['at'] / self.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if event.get('reconnect'):
+                await self._broadcast(self._frame('session_reconnect', {'session': {
+                    'id': self.session, 'status': 'reconnecting', 'keepalive_timeout_seconds': None, 'reconnect_url': self.uri}}))
+                continue
+
+            notification = self._translate(event['topic'], event['message'])
+            if notification is None:
+                continue
+            stype, body, msgid = notification
+            frame = self._frame('notification', {
+                'subscription': {'id': f'sub-{stype}', 'type': stype, 'version': '1', 'status': 'enabled',
+                                 'condition': {'broadcaster_user_id': self.channel_id}},
+                'event': dict(body, broadcaster_user_id=self.channel_id),
+            }, message_id=msgid, subscription_type=stype)
+            if 'id' in event:
+                self.sent[event['id']] = time.monotonic()
+            await self._broadcast(frame)
+        self.done.set()
+
+    # PubSub trace message -> (subscription type, event, message id)
+    def _translate(self, topic, message):
+        if topic == 'channel-bits-events-v2':
+            data = message['data']
+            return 'channel.cheer', {
+                'is_anonymous': not data['user_name'], 'user_id': None, 'user_login': data['user_name'],
+                'user_name': data['user_name'], 'bits': data['bits_used'], 'message': data['chat_message'],
+            }, message.get('message_id')
+
+        if topic == 'channel-subscribe-events-v1':
+            if message['context'] in ('subgift', 'anonsubgift'):
+                anonymous = message['context'] == 'anonsubgift'
+                return 'channel.subscription.gift', {
+                    'user_id': None, 'user_login': None if anonymous else message['display_name'],
+                    'user_name': None if anonymous else message['display_name'], 'total': 1,
+                    'tier': message['sub_plan'], 'cumulative_total': None, 'is_anonymous': anonymous,
+                }, None
+            return 'channel.subscribe', {
+                'user_id': None, 'user_login': message['display_name'], 'user_name': message['display_name'],
+                'tier': message['sub_plan'], 'is_gift': False,
+            }, None
+
+        if topic == 'channel-points-channel-v1':
+            redemption = message['data']['redemption']
+            user = redemption['user']['display_name']
+            return 'channel.channel_points_custom_reward_redemption.add', {
+                'id': redemption['id'], 'user_id': None, 'user_login': user, 'user_name': user,
+                'user_input': redemption.get('user_input', ''), 'status': 'unfulfilled',
+                'reward': {'id': 'reward', 'title': redemption['reward']['title'], 'cost': 0, 'prompt': ''},
+                'redeemed_at': message['data']['timestamp'],
+            }, None
+
+        if topic == 'hype-train-events-v1':
+            htype = message['type']
+            if htype == 'hype-train-end':
+                return 'channel.hype_train.end', {'id': 'train', 'level': self._hypelevel, 'total': 0,
+                                                  'top_contributions': [], 'ended_at': _now(), 'cooldown_ends_at': _now()}, None
+            progress = message['data']['progress']
+            self._hypelevel = progress['level']['value']
+            stype = 'channel.hype_train.begin' if htype == 'hype-train-start' else 'channel.hype_train.progress'
+            return stype, {'id': 'train', 'level': self._hypelevel, 'progress': progress['value'], 'goal': progress['goal'],
+                           'total': progress['total'], 'top_contributions': [], 'last_contribution': None,
+                           'started_at': _now(), 'expires_at': None}, None
+
+        return None
+
+    async def _broadcast(self, frame):
+        for websocket in list(self._clients):
+            try:
+                await websocket.send(frame)
+            except websockets.exceptions.ConnectionClosed:
+                pass
+
+    async def _probe(self, websocket):
+        while True:
+            await asyncio.sleep(self.probe)
+            try:
+                start = time.monotonic()
+                await asyncio.wait_for(await websocket.ping(), timeout=30)
+                self.pings.append(time.monotonic() - start)
+            except (websockets.exceptions.ConnectionClosed, asyncio.TimeoutError):
+                return
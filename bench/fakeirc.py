@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+# Fake Twitch IRC endpoint for ChatBot
+# Answers the login/CAP/JOIN/PING handshake well enough for a bot to sit in a channel,
+# and records every PRIVMSG it sends.
+class FakeIrcServer:
+    def __init__(self, host = '127.0.0.1', port = 0):
+        self.host     = host
+        self.port     = port
+        self.messages = []    # (monotonic time, channel, text)
+        self._server  = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _client(self, reader, writer):
+        nick = 'bot'
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode('utf8', errors='replace').rstrip('\r\n')
+                cmd, _, rest = line.partition(' ')
+
+                if cmd == 'NICK':
+                    nick = rest.strip()
+                    self._send(writer, f':tmi.twitch.tv 001 {nick} :Welcome, GLHF!')
+                    self._send(writer, f':tmi.twitch.tv 376 {nick} :>')
+                elif cmd == 'CAP':
+                    self._send(writer, f':tmi.twitch.tv CAP * ACK :{rest.partition(":")[2]}')
+                elif cmd == 'JOIN':
+                    for channel in rest.split(','):
+                        self._send(writer, f':{nick}!{nick}@{nick}.tmi.twitch.tv JOIN {channel}')
+                        self._send(writer, f':{nick}.tmi.twitch.tv 366 {nick} {channel} :End of /NAMES list')
+                elif cmd == 'PING':
+                    self._send(writer, f'PONG {rest}')
+                elif cmd == 'PRIVMSG':
+                    channel, _, text = rest.partition(' :')
+                    self.messages.append((time.monotonic(), channel, text))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _send(self, writer, line):
+        writer.write((line + '\r\n').encode('utf8'))
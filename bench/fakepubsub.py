@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+
+import websockets
+
+# Fake Twitch PubSub server
+#
+# Speaks enough of the protocol for pubsub.py: LISTEN -> RESPONSE, PING -> PONG,
+# MESSAGE frames for listened topics and RECONNECT. Once a client has LISTENed, the
+# trace is replayed to it. A trace is a list of dicts:
+#
+#   {"at": 0.25, "topic": "channel-subscribe-events-v1", "message": {...}}
+#   {"at": 3.0, "reconnect": true}
+#
+# 'at' is seconds from the start of the replay (divided by speed), the channel id is
+# appended to the topic. A websocket ping is sent every probe seconds and its round
+# trip recorded, which measures how long the client's event loop is stalled.
+class FakePubSubServer:
+    def __init__(self, trace, channel_id = '1234', host = '127.0.0.1', port = 0, speed = 1.0, probe = 0.05):
+        self.trace      = trace
+        self.channel_id = channel_id
+        self.host       = host
+        self.port       = port
+        self.speed      = speed
+        self.probe      = probe
+        self.sent       = {}      # event id -> monotonic send time
+        self.pings      = []      # websocket ping round trips (seconds)
+        self.listens    = 0
+        self.listened   = None    # monotonic time of the first LISTEN
+        self.done       = asyncio.Event()
+        self._server    = None
+        self._replay    = None
+        self._clients   = set()
+
+    @property
+    def uri(self):
+        return f'ws://{self.host}:{self.port}'
+
+    async def start(self):
+        self._server = await websockets.serve(self._client, self.host, self.port, ping_interval=None)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._replay is not None:
+            self._replay.cancel()
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _client(self, websocket, path = None):
+        probe = asyncio.ensure_future(self._probe(websocket))
+        try:
+            async for frame in websocket:
+                request = json.loads(frame)
+                if request['type'] == 'PING':
+                    await websocket.send('{"type": "PONG"}')
+                elif request['type'] == 'LISTEN':
+                    self.listens += 1
+                    if self.listened is None:
+                        self.listened = time.monotonic()
+                    response = {'type': 'RESPONSE', 'error': ''}
+                    if 'nonce' in request:
+                        response['nonce'] = request['nonce']
+                    await websocket.send(json.dumps(response))
+                    # A reconnecting client picks the replay up where it left off
+                    if self._replay is None:
+                        self._replay = asyncio.ensure_future(self._play())
+                    self._clients.add(websocket)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            probe.cancel()
+            self._clients.discard(websocket)
+
+    async def _play(self):
+        start = time.monotonic()
+        for event in self.trace:
+            delay = start + event['at'] / self.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if event.get('reconnect'):
+                await self._broadcast('{"type": "RECONNECT"}')
+                continue
+
+            frame = json.dumps({
+                'type': 'MESSAGE',
+                'data': {
+                    'topic': f'{event["topic"]}.{self.channel_id}',
+                    'message': json.dumps(event['message']),
+                },
+            })
+            if 'id' in event:
+                self.sent[event['id']] = time.monotonic()
+            await self._broadcast(frame)
+        self.done.set()
+
+    async def _broadcast(self, frame):
+        for websocket in list(self._clients):
+            try:
+                await websocket.send(frame)
+            except websockets.exceptions.ConnectionClosed:
+                pass
+
+    async def _probe(self, websocket):
+        while True:
+            await asyncio.sleep(self.probe)
+            try:
+                start = time.monotonic()
+                await asyncio.wait_for(await websocket.ping(), timeout=30)
+                self.pings.append(time.monotonic() - start)
+            except (websockets.exceptions.ConnectionClosed, asyncio.TimeoutError):
+                return
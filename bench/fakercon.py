@@ -0,0 +1,67 @@
+import asyncio
+import re
+import struct
+import time
+
+# Fake Minecraft RCON server
+# Accepts any number of connections, checks the password and records every command
+# with its arrival time. 'delay' simulates a slow server (seconds per command).
+class FakeRconServer:
+    def __init__(self, password = 'bench', host = '127.0.0.1', port = 0, delay = 0):
+        self.password = password
+        self.host     = host
+        self.port     = port
+        self.delay    = delay
+        self.commands = []    # (monotonic time, command)
+        self.logins   = 0
+        self.loggedin = None  # monotonic time of the first login
+        self._server  = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    # Map event id -> first command time for commands mentioning a bench user (eg. bench00042)
+    def firstSeen(self, pattern = re.compile(r'bench\d+')):
+        seen = {}
+        for at, cmd in self.commands:
+            for name in pattern.findall(cmd):
+                seen.setdefault(name, at)
+        return seen
+
+    async def _client(self, reader, writer):
+        authed = False
+        try:
+            while True:
+                (length,) = struct.unpack('<i', await reader.readexactly(4))
+                packet = await reader.readexactly(length)
+                rid, ptype = struct.unpack('<ii', packet[:8])
+                body = packet[8:-2].decode('utf8', errors='replace')
+
+                if ptype == 3:
+                    authed = body == self.password
+                    self.logins += 1
+                    if self.loggedin is None:
+                        self.loggedin = time.monotonic()
+                    self._reply(writer, rid if authed else -1, '')
+                elif not authed:
+                    self._reply(writer, -1, '')
+                else:
+                    self.commands.append((time.monotonic(), body))
+                    if self.delay:
+                        await asyncio.sleep(self.delay)
+                    self._reply(writer, rid, '')
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _reply(self, writer, rid, body):
+        payload = struct.pack('<ii', rid, 0) + body.encode('utf8') + b'\x00\x00'
+        writer.write(struct.pack('<i', len(payload)) + payload)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Replay/load test harness for pubsub.py
+#
+# Starts a fake PubSub (or EventSub) server, a fake RCON server and a fake IRC endpoint, runs the bot
+# against them with a generated config (via PUBSUB_CONFIG) and replays a synthetic or
+# recorded event trace. Reports event -> first RCON command latency, throughput and how
+# long the bot's event loop was stalled (websocket ping round trips).
+#
+#   python bench/loadtest.py --scenario giftbomb
+#   python bench/loadtest.py --trace mytrace.jsonl --speed 2 --rcon-delay 0.005
+#   python bench/loadtest.py --scenario mixed --no-bot   # run the fakes only
+#   python bench/loadtest.py --scenario mixed --transport eventsub
+#
+# The fake IRC endpoint only sees ChatBot traffic if the bot framework's IRC server is
+# pointed at it (its port is printed on startup).
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import sys
+import tempfile
+import time
+
+from fakepubsub import FakePubSubServer
+from fakeeventsub import FakeEventSubServer
+from fakercon import FakeRconServer
+from fakeirc import FakeIrcServer
+import traces
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[idx]
+
+def summary(values, scale = 1000):
+    return ' '.join(f'p{p}={percentile(values, p) * scale:.1f}' for p in (50, 90, 99)) + \
+           f' max={max(values) * scale if values else float("nan"):.1f}'
+
+def writeConfig(args, pubsub, rcon):
+    config = {}
+    if args.base_config and os.path.exists(args.base_config):
+        with open(args.base_config, 'r') as f:
+            config = json.load(f)
+    config.update({
+        'channel_id': pubsub.channel_id,
+        'auth_token': config.get('auth_token', 'bench'),
+        'pubsuburi': pubsub.uri,
+        'rconhost': rcon.host,
+        'rconport': rcon.port,
+        'rconpass': rcon.password,
+    })
+    if isinstance(pubsub, FakeEventSubServer):
+        config.update({
+            'transport': 'eventsub',
+            'eventsuburi': pubsub.uri,
+            'helixuri': pubsub.helixuri,
+            'client_id': config.get('client_id', 'bench'),
+        })
+    config.setdefault('mcver', '1.16')
+    config.setdefault('mcmodes', ['vanilla', 'mobs'])
+    # Don't dedupe against or replay events from previous runs
+    config.setdefault('journal', ':memory:')
+    fd, path = tempfile.mkstemp(prefix='pubsub-bench-', suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(config, f, indent=2)
+    return path
+
+def report(args, trace, pubsub, rcon, irc, elapsed):
+    events = [e for e in trace if 'topic' in e]
+    seen = rcon.firstSeen()
+    latencies = [seen[eid] - sent for eid, sent in pubsub.sent.items() if eid in seen]
+    unmatched = sum(1 for eid in pubsub.sent if eid not in seen)
+    cmds = len(rcon.commands)
+    span = (rcon.commands[-1][0] - rcon.commands[0][0]) if cmds > 1 else 0
+
+    lines = [
+        f'Scenario:        {args.trace or args.scenario} (speed x{args.speed})',
+        f'Events sent:     {len(pubsub.sent)}/{len(events)} in {elapsed:.2f}s, LISTENs/subscriptions: {pubsub.listens}',
+        f'RCON commands:   {cmds} over {span:.2f}s ({cmds / span if span else 0:.1f}/s), logins: {rcon.logins}',
+        f'Event->RCON ms:  {summary(latencies)} (matched {len(latencies)}, unmatched {unmatched})',
+        f'Loop stall ms:   {summary(pubsub.pings)} (ws ping round trips, {len(pubsub.pings)} samples)',
+        f'Chat lines:      {len(irc.messages)}',
+    ]
+    print('\n'.join(lines))
+    if args.out:
+        with open(args.out, 'a') as f:
+            f.write('\n'.join(lines) + '\n\n')
+
+async def run(args):
+    trace = traces.loadTrace(args.trace) if args.trace else traces.SCENARIOS[args.scenario]()
+
+    server = FakeEventSubServer if args.transport == 'eventsub' else FakePubSubServer
+    pubsub = await server(trace, speed=args.speed).start()
+    rcon   = await FakeRconServer(delay=args.rcon_delay).start()
+    irc    = await FakeIrcServer().start()
+    print(f'Fake {args.transport} {pubsub.uri}, RCON 127.0.0.1:{rcon.port} (password {rcon.password}), IRC 127.0.0.1:{irc.port}')
+
+    bot = None
+    config = None
+    if not args.no_bot:
+        config = writeConfig(args, pubsub, rcon)
+        env = dict(os.environ, PUBSUB_CONFIG=config)
+        botlog = open(args.bot_log, 'w') if args.bot_log else asyncio.subprocess.DEVNULL
+        bot = await asyncio.create_subprocess_exec(*shlex.split(args.bot), cwd=args.bot_dir, env=env,
+                                                   stdout=botlog, stderr=botlog)
+
+    try:
+        start = time.monotonic()
+        await asyncio.wait_for(pubsub.done.wait(), timeout=args.timeout)
+        elapsed = time.monotonic() - start
+        await asyncio.sleep(args.settle)
+        report(args, trace, pubsub, rcon, irc, elapsed)
+    finally:
+        if bot is not None and bot.returncode is None:
+            bot.terminate()
+            await bot.wait()
+        if config:
+            os.unlink(config)
+        await pubsub.stop()
+        await rcon.stop()
+        await irc.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay/load test for pubsub.py')
+    parser.add_argument('--scenario', default='giftbomb', choices=sorted(traces.SCENARIOS))
+    parser.add_argument('--trace', help='replay a JSON lines trace file instead of a scenario')
+    parser.add_argument('--transport', default='pubsub', choices=('pubsub', 'eventsub'), help='protocol the fake Twitch server speaks')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed multiplier')
+    parser.add_argument('--rcon-delay', type=float, default=0, help='fake RCON seconds per command')
+    parser.add_argument('--bot', default=f'{sys.executable} pubsub.py', help='command to start the bot')
+    parser.add_argument('--bot-dir', default=ROOT, help='working directory for the bot')
+    parser.add_argument('--bot-log', help='write the bot output here')
+    parser.add_argument('--base-config', default=os.path.join(ROOT, 'configs', 'pubsub.json'))
+    parser.add_argument('--no-bot', action='store_true', help="only run the fakes, don't start the bot")
+    parser.add_argument('--settle', type=float, default=5, help='seconds to wait after the replay ends')
+    parser.add_argument('--timeout', type=float, default=600, help='give up if the replay has not finished')
+    parser.add_argument('--out', help='append the report to this file')
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
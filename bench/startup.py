@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Startup benchmark for pubsub.py
+#
+# Launches the bot against the fake PubSub and RCON servers --runs times and reports how
+# long it takes from launch to importing the pubsub module, to the first PubSub LISTEN,
+# to the first RCON login and to the first event handled (the RCON command caused by a
+# channel points redemption the fake server sends as soon as the bot listens).
+#
+#   python bench/startup.py --runs 10
+import argparse
+import asyncio
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+from fakepubsub import FakePubSubServer
+from fakercon import FakeRconServer
+from loadtest import ROOT, writeConfig, summary
+import traces
+
+IMPORT_CHECK = 'import time; start = time.perf_counter(); import pubsub; print(time.perf_counter() - start)'
+
+def importTime(args):
+    out = subprocess.run([sys.executable, '-c', IMPORT_CHECK], cwd=args.bot_dir, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip())
+
+async def launch(args):
+    pubsub = await FakePubSubServer([traces.points(0, 'Hype Mode')]).start()
+    rcon   = await FakeRconServer().start()
+    config = writeConfig(args, pubsub, rcon)
+    env = dict(os.environ, PUBSUB_CONFIG=config)
+
+    start = time.monotonic()
+    bot = await asyncio.create_subprocess_exec(*shlex.split(args.bot), cwd=args.bot_dir, env=env,
+                                               stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    try:
+        deadline = start + args.timeout
+        while not rcon.firstSeen() and time.monotonic() < deadline and bot.returncode is None:
+            await asyncio.sleep(0.005)
+        handled = min(rcon.firstSeen().values(), default=None)
+        return {
+            'listen': pubsub.listened and pubsub.listened - start,
+            'rcon':   rcon.loggedin and rcon.loggedin - start,
+            'event':  handled and handled - start,
+        }
+    finally:
+        if bot.returncode is None:
+            bot.terminate()
+            await bot.wait()
+        os.unlink(config)
+        await pubsub.stop()
+        await rcon.stop()
+
+async def run(args):
+    imports = [importTime(args) for _ in range(args.runs)]
+    results = [await launch(args) for _ in range(args.runs)]
+
+    print(f'Runs:              {args.runs}')
+    print(f'Import pubsub ms:  {summary(imports)}')
+    for key, label in (('listen', 'First LISTEN ms:   '), ('rcon', 'First RCON login ms:'), ('event', 'First event ms:    ')):
+        values = [r[key] for r in results if r[key] is not None]
+        print(f'{label} {summary(values)} ({args.runs - len(values)} missing)')
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time benchmark for pubsub.py')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--bot', default=f'{sys.executable} pubsub.py', help='command to start the bot')
+    parser.add_argument('--bot-dir', default=ROOT, help='working directory for the bot')
+    parser.add_argument('--base-config', default=os.path.join(ROOT, 'configs', 'pubsub.json'))
+    parser.add_argument('--timeout', type=float, default=30, help='give up on a launch after this many seconds')
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import itertools
+import json
+from datetime import datetime, timezone
+
+# Synthetic PubSub event traces for the fake PubSub server
+# Every event gets a unique bench user name (bench00001, ...) that ends up in the
+# RCON commands it causes, which is how latency is matched up end to end.
+
+_ids = itertools.count(1)
+
+def _user():
+    return f'bench{next(_ids):05d}'
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+def cheer(at, bits, user = None):
+    user = user or _user()
+    return {'at': at, 'id': user, 'topic': 'channel-bits-events-v2', 'message': {
+        'message_id': f'{user}-cheer',
+        'data': {
+            'context': 'cheer',
+            'bits_used': bits,
+            'chat_message': f'Cheer{bits}',
+            'user_name': user,
+            'time': _now(),
+        },
+    }}
+
+def sub(at, context = 'sub', gifter = None, user = None):
+    user = user or _user()
+    message = {
+        'time': _now(),
+        'sub_plan': '1000',
+        'months': 1,
+        'context': context,
+        'sub_message': {'message': ''},
+        'display_name': gifter if gifter else user,
+    }
+    if context in ('subgift', 'anonsubgift'):
+        message['recipient_display_name'] = user
+    return {'at': at, 'id': user, 'topic': 'channel-subscribe-events-v1', 'message': message}
+
+def points(at, title, user = None):
+    user = user or _user()
+    return {'at': at, 'id': user, 'topic': 'channel-points-channel-v1', 'message': {
+        'type': 'reward-redeemed',
+        'data': {
+            'timestamp': _now(),
+            'redemption': {
+                'id': f'{user}-points',
+                'user': {'display_name': user},
+                'reward': {'title': title, 'default_image': {}, 'is_user_input_required': False},
+            },
+        },
+    }}
+
+def hype(at, htype, level = 1, value = 0, goal = 2000, total = 0):
+    data = {'progress': {'level': {'value': level}, 'value': value, 'goal': goal, 'total': total}}
+    if htype == 'hype-train-end':
+        data = {'ending_reason': 'COMPLETED'}
+    return {'at': at, 'topic': 'hype-train-events-v1', 'message': {'type': htype, 'data': data}}
+
+# A gift sub bomb: count gifts from one gifter, rate gifts per second
+def giftBomb(count = 200, rate = 50, start = 0, gifter = 'benchgifter'):
+    return [sub(start + i / rate, 'subgift', gifter) for i in range(count)]
+
+def cheerStorm(count = 100, bits = 100, rate = 10, start = 0):
+    return [cheer(start + i / rate, bits) for i in range(count)]
+
+def pointsStorm(count = 100, title = 'Spawn something bad', rate = 10, start = 0):
+    return [points(start + i / rate, title) for i in range(count)]
+
+# A full five level hype train with progress updates every 1/rate seconds
+def hypeTrain(levels = 5, steps = 10, rate = 5, start = 0):
+    trace = [hype(start, 'hype-train-start')]
+    at = start
+    for level in range(1, levels + 1):
+        goal = 2000 + 1000 * (level - 1)
+        for step in range(1, steps + 1):
+            at += 1 / rate
+            trace.append(hype(at, 'hype-train-progression', level, goal * step // steps, goal))
+        at += 1 / rate
+        trace.append(hype(at, 'hype-train-level-up', level + 1, 0, goal + 1000))
+    trace.append(hype(at + 1 / rate, 'hype-train-end'))
+    return trace
+
+def reconnect(at):
+    return {'at': at, 'reconnect': True}
+
+SCENARIOS = {
+    'giftbomb': lambda: giftBomb(),
+    'cheers': lambda: cheerStorm(),
+    'points': lambda: pointsStorm(),
+    'hypetrain': lambda: hypeTrain(),
+    'mixed': lambda: sorted(giftBomb(100, 50) + cheerStorm(50, 500, 10) + pointsStorm(50, 'Hype Mode', 10)
+                            + hypeTrain(start=1) + [reconnect(3)], key=lambda e: e['at']),
+}
+
+# Traces can also be saved/loaded as JSON lines (one event per line)
+def loadTrace(path):
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def saveTrace(trace, path):
+    with open(path, 'w') as f:
+        for event in trace:
+            f.write(json.dumps(event) + '\n')
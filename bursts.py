@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+class _Burst:
+    __slots__ = ('items', 'started', 'flush', 'timer')
+
+    def __init__(self, flush):
+        self.items   = []
+        self.started = time.monotonic()
+        self.flush   = flush
+        self.timer   = None
+
+# Collects bursts of related events (eg. a gift sub bomb from one gifter) into one batch
+#
+# Items added under the same key are held until no more have arrived for window seconds,
+# maxwait seconds have passed since the first one or maxitems are waiting, then handed to
+# the flush callback given with the first item as one list.
+#
+# Nothing is flushed on exit: pubsub.py journals every item before adding it, so the gifts
+# of a burst still waiting when the process stops are replayed (one at a time) on the next
+# start with the rest of the unfinished events.
+class BurstAggregator:
+    def __init__(self, window = 1.0, maxwait = 5.0, maxitems = 100):
+        self.window   = window
+        self.maxwait  = maxwait
+        self.maxitems = maxitems
+        self._bursts  = {}
+
+    def __len__(self):
+        return len(self._bursts)
+
+    def add(self, key, item, flush):
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = self._bursts[key] = _Burst(flush)
+        burst.items.append(item)
+
+        if len(burst.items) >= self.maxitems:
+            self._flush(key)
+            return
+
+        if burst.timer is not None:
+            burst.timer.cancel()
+        delay = min(self.window, burst.started + self.maxwait - time.monotonic())
+        burst.timer = asyncio.get_running_loop().call_later(max(0, delay), self._flush, key)
+
+    def _flush(self, key):
+        burst = self._bursts.pop(key, None)
+        if burst is None:
+            return
+        if burst.timer is not None:
+            burst.timer.cancel()
+        burst.flush(burst.items)
@@ -0,0 +1,99 @@
+import logging
+
+from rcon import RconPool
+from cmdqueue import CommandQueue
+from rewards import RewardRegistry
+from mccommands import CommandBuilder, PLAYER
+from mobs import MobSampler
+from hypetrain import HypeTrain
+from fanout import RconTarget, CircuitBreaker
+from throttle import loadThrottles
+
+logger = logging.getLogger(__name__)
+
+# Twitch PubSub limits
+TOPICS_PER_CONNECTION = 50
+MAX_CONNECTIONS       = 10
+
+# Per channel settings that can be given at the top level of the config as defaults
+_CHANNEL_KEYS = ('client_id', 'mcver', 'mcmodes', 'player', 'rconhost', 'rconport', 'rconpass', 'rconpool',
+                 'rconrate', 'rconqueue', 'summoncap', 'rcontimeout', 'rewards', 'targets', 'throttle')
+
+# Everything a handler needs to act for one broadcaster
+#
+# pubsub.py serves one channel per entry in the config's "channels" list (or a single
+# channel from the top level keys, as before). Each channel has its own player name,
+# command builder, reward registry and RCON targets, but anything that can be shared
+# is: channels on the same RCON server share one connection pool and command queue,
+# channels with the same game modes share a mob sampler, and they all share the one
+# event loop, dispatcher, IRC connection and PubSub sockets.
+class ChannelContext:
+    def __init__(self, settings, targets, mobsampler):
+        self.channel_id   = str(settings['channel_id'])
+        self.auth_token   = settings['auth_token']
+        self.client_id    = settings.get('client_id')    # needed for EventSub subscriptions
+        self.player       = settings.get('player', 'ArtfulMelody')
+        self.chat         = settings.get('chat', self.player).lower()
+        self.mcver        = settings['mcver']
+        self.mcmodes      = settings['mcmodes']
+        self.targets      = targets
+        self.mobsampler   = mobsampler
+        self.mc           = CommandBuilder(self.mcver, self.mcmodes, PLAYER)
+        self.rewards      = RewardRegistry(settings.get('rewards', 'configs/rewards.json'), compile=self.mc.compileReward)
+        self.rewards.load()
+
+        self.hypetrain = HypeTrain()
+        self.polls     = {}    # poll id -> PollTally for running polls
+        self.throttles = loadThrottles(settings.get('throttle'))    # scope -> per-user Throttle
+
+    # Scale a mob count down by the load of the channel's busiest RCON server (at least one)
+    def mobs(self, count):
+        scale = min((target.queue.mobscale for target in self.targets), default=1.0)
+        return max(1, int(count * scale)) if count else count
+
+    def __repr__(self):
+        return f'<Channel {self.chat} ({self.channel_id})>'
+
+# Build the channel contexts from the config, sharing pools/queues/samplers between them
+def loadChannels(config):
+    defaults = {k: config[k] for k in _CHANNEL_KEYS if k in config}
+    entries = config.get('channels') or [config]
+
+    queues   = {}
+    samplers = {}
+    channels = []
+    for entry in entries:
+        settings = dict(defaults, **entry)
+
+        # RCON targets: a "targets" list (each with its own rconhost/rconport/rconpass, player,
+        # rcontimeout...) or the channel's own rcon settings as a single target
+        targets = []
+        for tsettings in settings.get('targets') or [{}]:
+            tsettings = dict(settings, **tsettings)
+            server = (tsettings.get('rconhost', '127.0.0.1'), tsettings['rconport'])
+            if server not in queues:
+                pool = RconPool(server[0], server[1], tsettings['rconpass'], size=tsettings.get('rconpool', 2))
+                queues[server] = CommandQueue(pool, rate=tsettings.get('rconrate', 30), maxdepth=tsettings.get('rconqueue', 500),
+                                              summoncap=tsettings.get('summoncap', 3))
+            name = tsettings.get('name', f'{server[0]}:{server[1]}')
+            targets.append(RconTarget(name, queues[server], tsettings.get('player', 'ArtfulMelody'),
+                                      timeout=tsettings.get('rcontimeout', 10), breaker=CircuitBreaker()))
+
+        profile = tuple(settings['mcmodes'])
+        if profile not in samplers:
+            samplers[profile] = MobSampler(settings['mcmodes'])
+
+        channels.append(ChannelContext(settings, targets, samplers[profile]))
+
+    logger.info(f'Loaded {len(channels)} channel(s), {len(queues)} RCON server(s)')
+    return channels
+
+# Split channels into groups for separate PubSub/EventSub connections (max 50 topics or 300 subscriptions each)
+# A channel's topics always stay on the same connection.
+def shardChannels(channels, topics_per_channel, limit = TOPICS_PER_CONNECTION):
+    per_conn = max(1, limit // max(1, topics_per_channel))
+    shards = [channels[i:i + per_conn] for i in range(0, len(channels), per_conn)]
+    if len(shards) > MAX_CONNECTIONS:
+        logger.info(f'WARNING: {len(shards)} PubSub connections needed, Twitch recommends no more than '
+                    f'{MAX_CONNECTIONS} per IP (consider the supervisor/worker mode)')
+    return shards
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Twitch chat limits: messages per 30 seconds
+CHAT_LIMIT     = 20
+CHAT_LIMIT_MOD = 100
+CHAT_PERIOD    = 30
+CHAT_MAXLEN    = 500
+
+# Ordered, rate limited outbound chat queue
+#
+# Messages are sent one at a time in the order they were queued, at most limit in any
+# period seconds so a burst (hype train end, tied poll results...) can't get the bot
+# globally muted. The send times of the last limit messages are kept, and once they are
+# all within the period the next one waits until the oldest is period seconds old. While
+# it is waiting, adjacent '/me' lines to the same channel are merged into one message (up
+# to mergelen chars) so the backlog clears with fewer messages. While there is headroom
+# lines go out as-is.
+class ChatQueue:
+    def __init__(self, send, limit = CHAT_LIMIT, period = CHAT_PERIOD, mergelen = 300, separator = ' | '):
+        self.send      = send
+        self.limit     = limit
+        self.period    = period
+        self.mergelen  = min(mergelen, CHAT_MAXLEN)
+        self.separator = separator
+        self.sent      = 0
+        self.merged    = 0
+        self._queue    = deque()
+        self._times    = deque(maxlen=limit)    # when the last limit messages were sent
+        self._wakeup   = None
+        self._task     = None
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def put(self, channel, msg):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._drain())
+        self._queue.append((channel, msg))
+        self._wakeup.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # Seconds until another message may be sent (0: now)
+    def _wait(self, now):
+        if len(self._times) < self.limit:
+            return 0
+        return max(0, self._times[0] + self.period - now)
+
+    def _next(self, now):
+        channel, msg = self._queue.popleft()
+        if not self._wait(now) or not msg.startswith('/me '):
+            return channel, msg
+
+        # At the limit: fold following short /me lines into this one
+        while self._queue:
+            nchannel, nmsg = self._queue[0]
+            if nchannel != channel or not nmsg.startswith('/me '):
+                break
+            combined = msg + self.separator + nmsg[4:]
+            if len(combined) > self.mergelen:
+                break
+            self._queue.popleft()
+            msg = combined
+            self.merged += 1
+        return channel, msg
+
+    async def _drain(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            channel, msg = self._next(time.monotonic())
+            # (in a loop as asyncio can wake a timer up to a clock tick early)
+            wait = self._wait(time.monotonic())
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self._wait(time.monotonic())
+            self._times.append(time.monotonic())
+
+            try:
+                await self.send(channel, msg)
+                self.sent += 1
+            except Exception as ex:
+                logger.info(f'Unable to send chat message to #{channel}: {ex}')
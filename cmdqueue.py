@@ -0,0 +1,170 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Command categories, lower values are sent first
+PRIO_TITLE  = 0
+PRIO_EFFECT = 1
+PRIO_OTHER  = 2
+PRIO_SUMMON = 3
+
+# The command itself or one run by execute, which 1.12 writes with a leading slash
+# ("execute <p> ~ ~ ~ /summon ..." vs "execute at <p> run summon ...")
+_SUMMON = re.compile(r'(?:^|\s)/?summon\s')
+_EFFECT = re.compile(r'(?:^|\s)/?(?:playsound|particle)\s')
+
+def isSummon(cmd):
+    return _SUMMON.search(cmd) is not None
+
+def commandPriority(cmd):
+    if cmd.startswith('title '):
+        return PRIO_TITLE
+    if isSummon(cmd):
+        return PRIO_SUMMON
+    if cmd.startswith('effect ') or _EFFECT.search(cmd):
+        return PRIO_EFFECT
+    return PRIO_OTHER
+
+def isMergeable(cmd):
+    return cmd.startswith('effect ') or isSummon(cmd)
+
+# Central queue in front of the RCON sender
+# Every command from every event goes through here so the server sees a steady
+# commands-per-second budget no matter how many events arrive at once. When the
+# queue is full, identical effect/summon commands are merged into the pending copy
+# (effects don't stack, summons are capped at summoncap per merged command), and
+# failing that the lowest priority command is dropped. rate and mobscale are turned down
+# while the server is lagging by its PacingController (see pacing.py).
+class CommandQueue:
+    def __init__(self, pool, rate = 30, maxdepth = 500, summoncap = 3):
+        self.pool      = pool
+        self.rate      = rate
+        self.maxdepth  = maxdepth
+        self.summoncap = summoncap
+        self.mobscale  = 1.0    # summon count multiplier, < 1 while the server is lagging
+        self.depth     = 0
+        self.sent      = 0
+        self.failed    = 0
+        self.dropped   = 0
+        self.merged    = 0
+        self._heap     = []
+        self._pending  = {}
+        self._seq      = itertools.count()
+        self._wakeup   = None
+        self._task     = None
+
+    # Queue a list of commands, returns a future per command which resolves to
+    # the server response (or None if the command was dropped). timeout bounds each
+    # command once it is being sent, time spent waiting in the queue doesn't count.
+    def submit(self, cmds, timeout = None):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._drain())
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for cmd in cmds:
+            future = loop.create_future()
+            futures.append(future)
+            self._push(cmd, future, timeout)
+        self._wakeup.set()
+        return futures
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _push(self, cmd, future, timeout = None):
+        if self.depth >= self.maxdepth:
+            # Overflow: fold into an identical pending command if we can
+            entry = self._pending.get(cmd)
+            if entry is not None:
+                entry[3] += 1
+                entry[4].append(future)
+                self.merged += 1
+                return
+
+            # Otherwise make room by dropping the lowest priority pending command
+            prio = commandPriority(cmd)
+            victim = max((e for e in self._heap if e[5]), key=lambda e: (e[0], e[1]), default=None)
+            if victim is None or victim[0] <= prio:
+                self.dropped += 1
+                future.set_result(None)
+                return
+            self._discard(victim)
+            self.dropped += 1
+            for f in victim[4]:
+                if not f.done():
+                    f.set_result(None)
+
+        # [priority, sequence, command, count, futures, alive, timeout]
+        entry = [commandPriority(cmd), next(self._seq), cmd, 1, [future], True, timeout]
+        heapq.heappush(self._heap, entry)
+        if isMergeable(cmd):
+            self._pending.setdefault(cmd, entry)
+        self.depth += 1
+
+    def _discard(self, entry):
+        entry[5] = False
+        self.depth -= 1
+        if self._pending.get(entry[2]) is entry:
+            del self._pending[entry[2]]
+
+    def _pop(self):
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if entry[5]:
+                self._discard(entry)
+                return entry
+        return None
+
+    async def _drain(self):
+        nextsend = time.monotonic()
+        while True:
+            entry = self._pop()
+            if entry is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            cmd, count, futures, timeout = entry[2], entry[3], entry[4], entry[6]
+            if all(future.cancelled() for future in futures):
+                # Everyone waiting on it gave up (eg. cancelled on shutdown), don't send it late
+                continue
+            repeat = 1
+            if count > 1:
+                logger.info(f'RCON queue merged {count}x {cmd}')
+                if isSummon(cmd):
+                    repeat = min(count, max(1, int(self.summoncap * self.mobscale)))
+
+            resp = None
+            error = None
+            for _ in range(repeat):
+                # Pace to the commands-per-second budget
+                now = time.monotonic()
+                if nextsend > now:
+                    await asyncio.sleep(nextsend - now)
+                nextsend = max(nextsend, now) + 1 / self.rate
+
+                try:
+                    resp = await asyncio.wait_for(self.pool.command(cmd), timeout)
+                    self.sent += 1
+                except Exception as ex:
+                    self.failed += 1
+                    error = ex
+                    break
+
+            for future in futures:
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(resp)
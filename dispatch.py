@@ -0,0 +1,65 @@
+import asyncio
+import itertools
+import logging
+import time
+import traceback
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+handler_wait = Histogram('handler_queue_seconds', 'Time events wait for a dispatcher worker', ['handler'])
+handler_time = Histogram('handler_seconds', 'Time spent running each event handler', ['handler'])
+handler_errors = Counter('handler_errors_total', 'Event handlers that raised', ['handler'])
+
+# Runs event handlers on a pool of worker coroutines so the PubSub receive loop
+# only ever has to decode and enqueue. Events that share a key (eg. hype train
+# updates) always land on the same worker so they are handled in order, anything
+# without a key is spread round robin.
+class EventDispatcher:
+    def __init__(self, workers = 4):
+        self.workers  = workers
+        self._queues  = []
+        self._tasks   = []
+        self._rr      = itertools.cycle(range(workers))
+
+    def start(self):
+        for i in range(self.workers):
+            queue = asyncio.Queue()
+            self._queues.append(queue)
+            self._tasks.append(asyncio.ensure_future(self._worker(i, queue)))
+
+    def submit(self, handler, *args, key = None):
+        if not self._queues:
+            self.start()
+        if key is None:
+            idx = next(self._rr)
+        else:
+            idx = hash(key) % self.workers
+        self._queues[idx].put_nowait((handler, args, time.perf_counter()))
+
+    def pending(self):
+        return sum(q.qsize() for q in self._queues)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._queues.clear()
+        self._tasks.clear()
+
+    async def _worker(self, idx, queue):
+        while True:
+            handler, args, queued = await queue.get()
+            name = handler.__name__
+            start = time.perf_counter()
+            handler_wait.labels(name).observe(start - queued)
+            try:
+                await handler(*args)
+            except Exception as ex:
+                handler_errors.labels(name).inc()
+                logger.info(f'Unexpected error handling message: {ex}')
+                logger.info(traceback.format_exc())
+            finally:
+                handler_time.labels(name).observe(time.perf_counter() - start)
+                queue.task_done()
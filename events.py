@@ -0,0 +1,211 @@
+# Typed Twitch events
+#
+# Each PubSub topic's payload is decoded straight into one of these slotted classes by
+# its fromPubSub() (EventSub notifications arrive in the same format, see eventsub.py),
+# so handlers read attributes instead of walking nested dicts, and a payload that is
+# missing a field raises EventError when it is decoded instead of a KeyError somewhere
+# in a handler. Optional fields default to None.
+
+class EventError(ValueError):
+    pass
+
+class Event:
+    __slots__ = ()
+
+    # Decode a payload, fn(payload) does the field lookups
+    @classmethod
+    def _decode(cls, fn, payload):
+        try:
+            return fn(payload)
+        except (KeyError, TypeError, ValueError) as ex:
+            raise EventError(f'Invalid {cls.__name__} payload: {type(ex).__name__} {ex}') from None
+
+    # One event standing for several from the same user (see throttle.py's merge policy)
+    @classmethod
+    def merge(cls, events):
+        return events[0]
+
+    def __repr__(self):
+        return f'<{type(self).__name__} ' + ' '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__) + '>'
+
+class FollowEvent(Event):
+    __slots__ = ('user_id', 'username', 'display_name')
+
+    def __init__(self, user_id, username, display_name = None):
+        self.user_id      = user_id
+        self.username     = username
+        self.display_name = display_name or username
+
+    @classmethod
+    def fromPubSub(cls, message):
+        return cls._decode(lambda m: cls(m['user_id'], m['username'], m.get('display_name')), message)
+
+class BitsEvent(Event):
+    __slots__ = ('message_id', 'context', 'user', 'user_id', 'bits', 'chat_message', 'time')
+
+    def __init__(self, message_id, context, user, user_id, bits, chat_message, time):
+        self.message_id   = message_id
+        self.context      = context
+        self.user         = user or 'Anonymous'
+        self.user_id      = user_id
+        self.bits         = bits
+        self.chat_message = chat_message
+        self.time         = time
+
+    @classmethod
+    def fromPubSub(cls, message):
+        def decode(m):
+            data = m['data']
+            return cls(m.get('message_id'), data['context'], data.get('user_name'), data.get('user_id'),
+                       int(data['bits_used']), data.get('chat_message', ''), data.get('time'))
+        return cls._decode(decode, message)
+
+    # Merged cheers are rewarded for their total bits
+    @classmethod
+    def merge(cls, events):
+        first = events[0]
+        if len(events) == 1:
+            return first
+        return cls(first.message_id, first.context, first.user, first.user_id, sum(event.bits for event in events),
+                   ' '.join(event.chat_message for event in events if event.chat_message), first.time)
+
+# A sub, resub or one gifted sub (user is the gifter, recipient who got it)
+class SubEvent(Event):
+    __slots__ = ('message_id', 'context', 'user', 'user_id', 'recipient', 'recipient_id', 'plan', 'months',
+                 'duration', 'text', 'time')
+
+    def __init__(self, message_id, context, user, user_id, recipient, recipient_id, plan, months, duration, text, time):
+        self.message_id   = message_id
+        self.context      = context
+        self.user         = user
+        self.user_id      = user_id
+        self.recipient    = recipient
+        self.recipient_id = recipient_id
+        self.plan         = plan
+        self.months       = months
+        self.duration     = duration
+        self.text         = text
+        self.time         = time
+
+    @property
+    def gift(self):
+        return self.context in ('subgift', 'anonsubgift')
+
+    @classmethod
+    def fromPubSub(cls, message):
+        def decode(m):
+            text = m.get('sub_message') or {}
+            return cls(m.get('message_id'), m['context'], m.get('display_name'), m.get('user_id'),
+                       m.get('recipient_display_name'), m.get('recipient_id'), m.get('sub_plan'), m.get('months', 1),
+                       m.get('multi_month_duration', 1), text.get('message', ''), m['time'])
+        return cls._decode(decode, message)
+
+class PointsEvent(Event):
+    __slots__ = ('redemption_id', 'reward', 'reward_id', 'user', 'user_id', 'user_input', 'image', 'timestamp')
+
+    def __init__(self, redemption_id, reward, reward_id, user, user_id, user_input, image, timestamp):
+        self.redemption_id = redemption_id
+        self.reward        = reward
+        self.reward_id     = reward_id
+        self.user          = user
+        self.user_id       = user_id
+        self.user_input    = user_input
+        self.image         = image
+        self.timestamp     = timestamp
+
+    @classmethod
+    def fromPubSub(cls, message):
+        def decode(m):
+            data       = m['data']
+            redemption = data['redemption']
+            reward     = redemption['reward']
+            user       = redemption['user']
+            user_input = redemption.get('user_input', '') if reward.get('is_user_input_required') else ''
+            return cls(redemption.get('id'), reward['title'], reward.get('id'), user['display_name'], user.get('id'), user_input,
+                       reward.get('default_image'), data.get('timestamp'))
+        return cls._decode(decode, message)
+
+class RaidEvent(Event):
+    __slots__ = ('type', 'target_id', 'target', 'viewer_count')
+
+    def __init__(self, type, target_id, target, viewer_count):
+        self.type         = type
+        self.target_id    = target_id
+        self.target       = target
+        self.viewer_count = viewer_count
+
+    @classmethod
+    def fromPubSub(cls, message):
+        def decode(m):
+            raid = m.get('raid') or {}
+            return cls(m['type'], raid.get('target_id'), raid.get('target_display_name') or raid.get('target_login'),
+                       raid.get('viewer_count'))
+        return cls._decode(decode, message)
+
+class PollChoice(Event):
+    __slots__ = ('choice_id', 'title', 'votes')
+
+    def __init__(self, choice_id, title, votes):
+        self.choice_id = choice_id
+        self.title     = title
+        self.votes     = votes
+
+class PollEvent(Event):
+    __slots__ = ('type', 'poll_id', 'title', 'choices')
+
+    def __init__(self, type, poll_id, title, choices):
+        self.type    = type
+        self.poll_id = poll_id
+        self.title   = title
+        self.choices = choices
+
+    @classmethod
+    def fromPubSub(cls, message):
+        def decode(m):
+            poll = m['data']['poll']
+            choices = [PollChoice(c['choice_id'], c['title'], int(c['votes']['total'])) for c in poll['choices']]
+            return cls(m['type'], poll['poll_id'], poll['title'], choices)
+        return cls._decode(decode, message)
+
+class HypeProgress(Event):
+    __slots__ = ('level', 'value', 'goal', 'total', 'remaining')
+
+    def __init__(self, level, value, goal, total, remaining = None):
+        self.level     = level
+        self.value     = value
+        self.goal      = goal
+        self.total     = total
+        self.remaining = remaining
+
+    @classmethod
+    def fromPubSub(cls, progress):
+        remaining = progress.get('remaining_seconds')
+        return cls(int(progress['level']['value']), int(progress['value']), int(progress['goal']), int(progress['total']),
+                   None if remaining is None else int(remaining))
+
+# hype-train-* events: progress for start/progression/level up, user for progression and
+# conductor updates, source for conductor updates, reason for the end
+class HypeTrainEvent(Event):
+    __slots__ = ('type', 'progress', 'user', 'source', 'reason')
+
+    def __init__(self, type, progress = None, user = None, source = None, reason = None):
+        self.type     = type
+        self.progress = progress
+        self.user     = user
+        self.source   = source
+        self.reason   = reason
+
+    @classmethod
+    def fromPubSub(cls, message):
+        def decode(m):
+            htype = m['type']
+            data  = m.get('data') or {}
+            if htype in ('hype-train-start', 'hype-train-progression', 'hype-train-level-up'):
+                return cls(htype, HypeProgress.fromPubSub(data['progress']), data.get('user_display_name'))
+            if htype == 'hype-train-conductor-update':
+                user = data['user']
+                return cls(htype, user=user.get('display_name') or user.get('login'), source=data['source'])
+            if htype == 'hype-train-end':
+                return cls(htype, reason=data['ending_reason'])
+            return cls(htype)
+        return cls._decode(decode, message)
@@ -0,0 +1,358 @@
+import asyncio
+import calendar
+import logging
+import time
+from collections import deque
+
+from jsonlib import loads, dumps
+from jokes import HttpClient, HttpError
+from metrics import Counter
+from pubsubclient import Backoff
+from transport import Transport
+
+logger = logging.getLogger(__name__)
+
+eventsub_reconnects = Counter('eventsub_reconnects_total', 'EventSub sessions lost or handed over')
+eventsub_duplicates = Counter('eventsub_duplicates_total', 'Repeated EventSub notifications dropped')
+eventsub_refused    = Counter('eventsub_subscribe_errors_total', 'EventSub subscriptions refused by Helix', ['type'])
+
+class EventSubError(Exception):
+    pass
+
+# One EventSub WebSocket session
+#
+# Twitch sends session_welcome on connect with the session id to create subscriptions for
+# (onWelcome(session_id) is awaited and has 10 seconds to subscribe) and the keepalive
+# timeout: a notification or session_keepalive arrives at least that often, so a socket
+# that stays silent for longer (plus grace seconds) is treated as lost. session_reconnect
+# carries the URL of a new socket that already has this session's subscriptions: it is
+# connected and its welcome awaited while the old socket keeps being read, then the old
+# one is closed. A lost session is reconnected with backoff and subscribes again.
+# Notifications are deduped on their message id (Twitch can redeliver, and both sockets
+# can deliver during a handover) and passed on as onNotification(subscription, event, metadata).
+class EventSubClient:
+    def __init__(self, uri, onWelcome, onNotification, name = 'eventsub', timeout = 10, grace = 5, recent = 1024):
+        self.uri            = uri
+        self.onWelcome      = onWelcome
+        self.onNotification = onNotification
+        self.name           = name
+        self.timeout        = timeout
+        self.grace          = grace
+        self.session        = None
+        self.backoff        = Backoff()
+        self._recent        = deque(maxlen=recent)
+        self._recentset     = set()
+
+    async def run(self):
+        websocket, keepalive = await self._subscribed()
+        while True:
+            reconnect = asyncio.get_running_loop().create_future()    # gets the reconnect URL
+            reader = asyncio.ensure_future(self._serve(websocket, keepalive, reconnect))
+            try:
+                await asyncio.wait({reader, reconnect}, return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:
+                reader.cancel()
+                reconnect.cancel()
+                await websocket.close()
+                raise
+
+            eventsub_reconnects.inc()
+            if reconnect.done():
+                # Keep reading the old socket until the new one has welcomed us
+                logger.info(f'{self.name}: reconnect requested, handing over to a new socket')
+                try:
+                    replacement = await self._welcomed(reconnect.result())
+                except asyncio.CancelledError:
+                    reader.cancel()
+                    await websocket.close()
+                    raise
+                except Exception as ex:
+                    logger.info(f'{self.name}: unable to follow reconnect ({ex}), starting a new session')
+                    replacement = None
+                reader.cancel()
+                await websocket.close()
+                if replacement is None:
+                    replacement = await self._subscribed()
+            else:
+                reconnect.cancel()
+                try:
+                    reader.result()
+                except Exception as ex:
+                    logger.info(f'{self.name}: connection lost: {ex}')
+                replacement = await self._subscribed()
+            websocket, keepalive = replacement
+
+    # A new session with its subscriptions made (with backoff)
+    async def _subscribed(self):
+        while True:
+            websocket = None
+            try:
+                websocket, keepalive = await self._welcomed(self.uri)
+                await self.onWelcome(self.session)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                if websocket is not None:
+                    await websocket.close()
+                delay = self.backoff.next()
+                logger.info(f'{self.name}: unable to start a session ({ex}), retrying in {delay:.1f}s')
+                await asyncio.sleep(delay)
+                continue
+
+            self.backoff.reset()
+            logger.info(f'{self.name}: connected, session {self.session}')
+            return websocket, keepalive
+
+    # Connect and wait for session_welcome, returns (websocket, keepalive timeout)
+    async def _welcomed(self, url):
+        import websockets
+        websocket = await asyncio.wait_for(websockets.connect(url, ping_interval=None), timeout=self.timeout)
+        try:
+            message = loads(await asyncio.wait_for(websocket.recv(), timeout=self.timeout))
+            mtype = message['metadata']['message_type']
+            if mtype != 'session_welcome':
+                raise EventSubError(f'expected session_welcome, got {mtype}')
+        except BaseException:
+            await websocket.close()
+            raise
+        session = message['payload']['session']
+        self.session = session['id']
+        return websocket, session.get('keepalive_timeout_seconds') or 10
+
+    # Read a session's socket until it is lost (raises) or session_reconnect arrives (sets reconnect)
+    async def _serve(self, websocket, keepalive, reconnect):
+        timeout = keepalive + self.grace
+        while True:
+            try:
+                frame = await asyncio.wait_for(websocket.recv(), timeout=timeout)
+            except asyncio.TimeoutError:
+                raise EventSubError(f'no keepalive for {timeout}s')
+            message  = loads(frame)
+            metadata = message['metadata']
+            mtype    = metadata['message_type']
+            if mtype == 'notification':
+                self._received(message['payload'], metadata)
+            elif mtype == 'session_reconnect':
+                if not reconnect.done():
+                    reconnect.set_result(message['payload']['session']['reconnect_url'])
+            elif mtype == 'revocation':
+                subscription = message['payload']['subscription']
+                logger.info(f'{self.name}: subscription {subscription["type"]} revoked ({subscription["status"]})')
+
+    def _received(self, payload, metadata):
+        msgid = metadata['message_id']
+        if msgid in self._recentset:
+            eventsub_duplicates.inc()
+            return
+        if len(self._recent) == self._recent.maxlen:
+            self._recentset.discard(self._recent[0])
+        self._recent.append(msgid)
+        self._recentset.add(msgid)
+        self.onNotification(payload['subscription'], payload['event'], metadata)
+
+# Seconds from now until an RFC3339 timestamp (Twitch sends up to nanosecond precision)
+def _secondsUntil(timestamp):
+    return max(0, calendar.timegm(time.strptime(timestamp[:19], '%Y-%m-%dT%H:%M:%S')) - int(time.time()))
+
+# EventSub events in the PubSub message format of the topic they replace
+# Each takes (event, metadata, state) and returns a list of messages, state is a dict kept
+# per channel for events that need to remember something between notifications.
+
+def _follow(event, metadata, state):
+    return [{'user_id': event['user_id'], 'username': event['user_login'], 'display_name': event['user_name']}]
+
+def _cheer(event, metadata, state):
+    return [{
+        'message_id': metadata['message_id'],
+        'data': {
+            'context': 'cheer',
+            'user_id': event['user_id'],
+            'user_name': None if event['is_anonymous'] else event['user_name'],
+            'bits_used': event['bits'],
+            'chat_message': event['message'],
+            'time': metadata['message_timestamp'],
+        },
+    }]
+
+def _sub(context, event, metadata, months = 1, text = ''):
+    return {
+        'message_id': metadata['message_id'],
+        'user_id': event['user_id'],
+        'user_name': event['user_login'],
+        'display_name': event['user_name'],
+        'context': context,
+        'sub_plan': event['tier'],
+        'months': months,
+        'sub_message': {'message': text},
+        'time': metadata['message_timestamp'],
+    }
+
+def _subscribe(event, metadata, state):
+    # Gifted subs arrive once more as (part of) channel.subscription.gift, with the gifter
+    if event['is_gift']:
+        return []
+    return [_sub('sub', event, metadata)]
+
+def _resub(event, metadata, state):
+    return [_sub('resub', event, metadata, event['cumulative_months'], event['message']['text'])]
+
+def _gift(event, metadata, state):
+    # One message per gift like PubSub, so they go through the gift bomb aggregation. EventSub
+    # doesn't say who received them (that's only in the recipients' channel.subscribe events).
+    context = 'anonsubgift' if event['is_anonymous'] else 'subgift'
+    messages = []
+    for i in range(event['total']):
+        message = _sub(context, event, metadata)
+        message['message_id'] = f'{metadata["message_id"]}.{i}'
+        message['display_name'] = None if event['is_anonymous'] else event['user_name']
+        message['recipient_display_name'] = None
+        message['multi_month_duration'] = 1
+        messages.append(message)
+    return messages
+
+def _redemption(event, metadata, state):
+    reward = event['reward']
+    return [{
+        'type': 'reward-redeemed',
+        'data': {
+            'timestamp': event['redeemed_at'],
+            'redemption': {
+                'id': event['id'],
+                'user': {'id': event['user_id'], 'login': event['user_login'], 'display_name': event['user_name']},
+                'reward': {
+                    'id': reward['id'],
+                    'title': reward['title'],
+                    'cost': reward['cost'],
+                    'prompt': reward['prompt'],
+                    'default_image': None,
+                    'is_user_input_required': bool(event.get('user_input')),
+                },
+                'user_input': event.get('user_input', ''),
+            },
+        },
+    }]
+
+def _raid(event, metadata, state):
+    return [{
+        'type': 'raid_go_v2',
+        'raid': {
+            'target_id': event['to_broadcaster_user_id'],
+            'target_login': event['to_broadcaster_user_login'],
+            'target_display_name': event['to_broadcaster_user_name'],
+            'viewer_count': event['viewers'],
+        },
+    }]
+
+_POLL_ENDS = {'completed': 'POLL_COMPLETE', 'terminated': 'POLL_TERMINATE', 'archived': 'POLL_ARCHIVE'}
+
+def _poll(mtype):
+    def normalize(event, metadata, state):
+        choices = [{'choice_id': choice['id'], 'title': choice['title'], 'votes': {'total': choice.get('votes', 0)}}
+                   for choice in event['choices']]
+        poll = {'poll_id': event['id'], 'title': event['title'], 'choices': choices}
+        return [{'type': mtype or _POLL_ENDS.get(event['status'], 'POLL_ARCHIVE'), 'data': {'poll': poll}}]
+    return normalize
+
+def _progress(event):
+    progress = {'level': {'value': event['level']}, 'value': event['progress'], 'goal': event['goal'], 'total': event['total']}
+    if event.get('expires_at'):
+        progress['remaining_seconds'] = _secondsUntil(event['expires_at'])
+    return progress
+
+def _hypeBegin(event, metadata, state):
+    state['hypelevel'] = event['level']
+    return [{'type': 'hype-train-start', 'data': {'progress': _progress(event)}}]
+
+def _hypeProgress(event, metadata, state):
+    # EventSub has no level up event, a progress event on a higher level is one
+    last = event.get('last_contribution') or {}
+    levelup = event['level'] > state.get('hypelevel', event['level'])
+    state['hypelevel'] = event['level']
+    if levelup:
+        return [{'type': 'hype-train-level-up', 'data': {'progress': _progress(event)}}]
+    return [{'type': 'hype-train-progression', 'data': {'progress': _progress(event), 'user_display_name': last.get('user_name')}}]
+
+def _hypeEnd(event, metadata, state):
+    # No ending reason either: reaching level 5 counts as completed
+    state.pop('hypelevel', None)
+    return [{'type': 'hype-train-end', 'data': {'ending_reason': 'COMPLETED' if event['level'] >= 5 else 'EXPIRE'}}]
+
+# EventSub subscription type -> (version, PubSub topic prefix, condition field naming the channel, normalizer)
+SUBSCRIPTIONS = {
+    'channel.follow':                                      ('2', 'following',                   'broadcaster_user_id',      _follow),
+    'channel.cheer':                                       ('1', 'channel-bits-events-v2',      'broadcaster_user_id',      _cheer),
+    'channel.subscribe':                                   ('1', 'channel-subscribe-events-v1', 'broadcaster_user_id',      _subscribe),
+    'channel.subscription.gift':                           ('1', 'channel-subscribe-events-v1', 'broadcaster_user_id',      _gift),
+    'channel.subscription.message':                        ('1', 'channel-subscribe-events-v1', 'broadcaster_user_id',      _resub),
+    'channel.channel_points_custom_reward_redemption.add': ('1', 'channel-points-channel-v1',   'broadcaster_user_id',      _redemption),
+    'channel.raid':                                        ('1', 'raid',                        'from_broadcaster_user_id', _raid),
+    'channel.poll.begin':                                  ('1', 'polls',                       'broadcaster_user_id',      _poll('POLL_CREATE')),
+    'channel.poll.progress':                               ('1', 'polls',                       'broadcaster_user_id',      _poll('POLL_UPDATE')),
+    'channel.poll.end':                                    ('1', 'polls',                       'broadcaster_user_id',      _poll(None)),
+    'channel.hype_train.begin':                            ('1', 'hype-train-events-v1',        'broadcaster_user_id',      _hypeBegin),
+    'channel.hype_train.progress':                         ('1', 'hype-train-events-v1',        'broadcaster_user_id',      _hypeProgress),
+    'channel.hype_train.end':                              ('1', 'hype-train-events-v1',        'broadcaster_user_id',      _hypeEnd),
+}
+
+# EventSub WebSocket as a transport
+#
+# One socket carries the subscriptions of every channel in the shard (up to 300), each made
+# over Helix with the channel's own token and client id (client_id in the config) whenever a
+# new session starts. Notifications are turned into the PubSub message of the topic they
+# replace (see SUBSCRIPTIONS) so the handlers, journal and ?redo work unchanged.
+# PubSub topics with no EventSub equivalent (community points) are not subscribed to.
+class EventSubTransport(Transport):
+    limit = 300
+
+    def __init__(self, shard, prefixes, onEvent, config):
+        super().__init__(shard, prefixes, onEvent, config)
+        self.types  = [stype for stype, spec in SUBSCRIPTIONS.items() if spec[1] in prefixes]
+        self.helix  = HttpClient(config.get('helixuri', 'https://api.twitch.tv/helix'), timeout=5)
+        self.client = EventSubClient(config.get('eventsuburi', 'wss://eventsub.wss.twitch.tv/ws'), self._subscribe,
+                                     self._notification, name=self.name)
+        self._state = {}    # channel id -> normalizer state
+
+    @classmethod
+    def topics(cls, prefixes):
+        return sum(1 for spec in SUBSCRIPTIONS.values() if spec[1] in prefixes)
+
+    async def run(self):
+        await self.client.run()
+
+    async def _subscribe(self, session):
+        path = self.helix.path.rstrip('/') + '/eventsub/subscriptions'
+        accepted = 0
+        for ctx in self.shard:
+            headers = {
+                'Authorization': 'Bearer ' + ctx.auth_token.replace('oauth:', '', 1),
+                'Client-Id': ctx.client_id,
+                'Content-Type': 'application/json',
+            }
+            for stype in self.types:
+                version, prefix, field, normalize = SUBSCRIPTIONS[stype]
+                condition = {field: ctx.channel_id}
+                if stype == 'channel.follow':
+                    condition['moderator_user_id'] = ctx.channel_id
+                body = dumps({'type': stype, 'version': version, 'condition': condition,
+                              'transport': {'method': 'websocket', 'session_id': session}})
+                try:
+                    status, resp = await self.helix.request('POST', path, body.encode('utf8'), headers)
+                except (OSError, asyncio.TimeoutError, HttpError) as ex:
+                    status, resp = None, str(ex)
+                if status in (202, 409):    # 409: already subscribed
+                    accepted += 1
+                else:
+                    eventsub_refused.labels(stype).inc()
+                    logger.info(f'{self.name}: unable to subscribe #{ctx.chat} to {stype}: {status} {resp!r:.200}')
+        if not accepted:
+            raise EventSubError('no subscriptions accepted')
+
+    def _notification(self, subscription, event, metadata):
+        spec = SUBSCRIPTIONS.get(subscription['type'])
+        if spec is None:
+            logger.info(f'{self.name}: unexpected {subscription["type"]} notification')
+            return
+        version, prefix, field, normalize = spec
+        channel_id = subscription['condition'][field]
+        for message in normalize(event, metadata, self._state.setdefault(channel_id, {})):
+            self.onEvent(channel_id, prefix, dumps(message), message)
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+
+from rcon import RconError
+from mccommands import PLAYER
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+rcon_breaker_opens = Counter('rcon_breaker_opens_total', 'Times an RCON target was taken out of service', ['target'])
+rcon_breaker_skips = Counter('rcon_breaker_skipped_total', 'Commands skipped because their RCON target was out of service', ['target'])
+
+# Per target circuit breaker
+# After `failures` failed batches in a row the target is skipped for `cooldown` seconds,
+# then a single batch is let through to test it (success closes the breaker, failure
+# reopens it); other batches are skipped until that probe has finished.
+class CircuitBreaker:
+    def __init__(self, failures = 3, cooldown = 30):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.count    = 0
+        self.opened   = None
+        self.probing  = False
+
+    @property
+    def open(self):
+        return self.opened is not None and (self.probing or time.monotonic() - self.opened < self.cooldown)
+
+    # Whether a batch may be sent: always while closed, never while open, and once the
+    # cooldown is over only to the caller that becomes the probe (self.probing)
+    def allow(self):
+        if self.opened is None:
+            return True
+        if self.open:
+            return False
+        self.probing = True
+        return True
+
+    def success(self, probe = False):
+        self.count  = 0
+        self.opened = None
+        if probe:
+            self.probing = False
+
+    # Returns True if this failure opened the breaker
+    def failure(self, probe = False):
+        self.count += 1
+        if probe:
+            self.probing = False
+            self.opened  = time.monotonic()
+            return True
+        if self.count >= self.failures and self.opened is None:
+            self.opened = time.monotonic()
+            return True
+        return False
+
+    # The probe was abandoned (eg. cancelled) without a result, let another one through
+    def abandon(self, probe):
+        if probe:
+            self.probing = False
+
+# One Minecraft server a channel's rewards go to
+#
+# Commands are built with the PLAYER placeholder (see CommandBuilder) and mapped to this
+# server's player name on the way out. Each target has its own command queue (shared with
+# other channels using the same server), timeout and circuit breaker, so a slow or dead
+# server only affects its own commands. The timeout is for the RCON exchange of each command
+# and not the wait in the queue, so a backlog neither fails commands nor opens the breaker.
+class RconTarget:
+    def __init__(self, name, queue, player, timeout = 10, breaker = None):
+        self.name    = name
+        self.queue   = queue
+        self.player  = player
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+
+    # Send a batch, returns one result per command: the response, None if the command was
+    # dropped by the queue, or the exception it failed with
+    async def send(self, cmds):
+        cmds = [cmd.replace(PLAYER, self.player) for cmd in cmds]
+        if not cmds:
+            return cmds, []
+
+        if not self.breaker.allow():
+            rcon_breaker_skips.labels(self.name).inc(len(cmds))
+            error = RconError(f'RCON target {self.name} is out of service')
+            return cmds, [error] * len(cmds)
+        probe = self.breaker.probing
+
+        futures = self.queue.submit(cmds, timeout=self.timeout)
+        try:
+            await asyncio.wait(futures)
+        except asyncio.CancelledError:
+            # Abandoned commands are skipped by the queue if they haven't gone out yet
+            for future in futures:
+                future.cancel()
+            self.breaker.abandon(probe)
+            raise
+
+        results = []
+        for future in futures:
+            if isinstance(future.exception(), asyncio.TimeoutError):
+                results.append(RconError(f'Timed out after {self.timeout}s'))
+            elif future.exception() is not None:
+                results.append(future.exception())
+            else:
+                results.append(future.result())
+
+        if any(isinstance(result, Exception) for result in results):
+            if self.breaker.failure(probe):
+                rcon_breaker_opens.labels(self.name).inc()
+                logger.info(f'RCON target {self.name} failing, skipping it for {self.breaker.cooldown}s')
+        else:
+            self.breaker.success(probe)
+        return cmds, results
+
+# Send a batch to every target at once, returns [(target, cmds, results)] in target order
+async def fanout(targets, cmds):
+    sent = await asyncio.gather(*(target.send(cmds) for target in targets))
+    return [(target, tcmds, results) for target, (tcmds, results) in zip(targets, sent)]
@@ -0,0 +1,76 @@
+import time
+from heapq import nlargest
+
+# Hype train state for one channel
+#
+# Updated in place from the hype-train-* events: progress fields are copied from the
+# event's HypeProgress (see events.py), contributions are attributed from the change in
+# the train's total, so each update is constant time. snapshot()/restore() give a small
+# dict that is persisted after every update (see EventJournal.saveState), so a restart
+# or PubSub reconnect mid train still ends it with the right level.
+class HypeTrain:
+    __slots__ = ('active', 'level', 'value', 'goal', 'total', 'perc', 'started', 'expires',
+                 'conductors', 'contributions')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.active        = False
+        self.level         = 1
+        self.value         = 0
+        self.goal          = 2000
+        self.total         = 0
+        self.perc          = 0
+        self.started       = 0
+        self.expires       = 0
+        self.conductors    = {}    # source (BITS/SUBS) -> display name
+        self.contributions = {}    # display name -> hype points
+
+    def start(self, progress):
+        self.reset()
+        self.active  = True
+        self.started = time.time()
+        self.update(progress)
+
+    # Copy the progress of a start/progression/level up event
+    def update(self, progress, user = None):
+        total = progress.total
+        if user and total > self.total:
+            self.contributions[user] = self.contributions.get(user, 0) + total - self.total
+
+        self.active = True
+        self.level  = progress.level
+        self.value  = progress.value
+        self.goal   = progress.goal
+        self.total  = total
+        self.perc   = self.value * 100 // self.goal if self.goal else 0
+        if progress.remaining is not None:
+            self.expires = time.time() + progress.remaining
+
+    def conductor(self, source, user):
+        self.conductors[source] = user
+
+    def end(self):
+        self.active = False
+
+    def top(self, n = 3):
+        return nlargest(n, self.contributions.items(), key=lambda item: item[1])
+
+    def snapshot(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    # Restore a snapshot, ignoring one from a train that has since run out
+    def restore(self, snapshot, maxage = 600):
+        if not snapshot or not snapshot.get('active'):
+            return False
+        expires = snapshot.get('expires') or snapshot.get('started', 0) + maxage
+        if expires < time.time():
+            return False
+        for name in self.__slots__:
+            if name in snapshot:
+                setattr(self, name, snapshot[name])
+        return True
+
+    def __repr__(self):
+        return f'<HypeTrain level {self.level} {self.value}/{self.goal} ({self.perc}%) total {self.total}>'
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+import ssl
+from collections import deque
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+class HttpError(Exception):
+    pass
+
+# Minimal asyncio HTTP/1.1 client that keeps its connection open between requests
+# Only what we need for small JSON requests: Content-Length or chunked bodies, and
+# reconnecting when the server closes the socket.
+class HttpClient:
+    def __init__(self, url, timeout = 2, headers = None):
+        parts = urlsplit(url)
+        self.scheme  = parts.scheme
+        self.host    = parts.hostname
+        self.port    = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.path    = parts.path or '/'
+        self.timeout = timeout
+        self.headers = headers or {}
+        self._reader = None
+        self._writer = None
+        self._lock   = asyncio.Lock()
+
+    async def get(self, path = None):
+        return await self.request('GET', path)
+
+    async def request(self, method, path = None, body = None, headers = None):
+        async with self._lock:
+            try:
+                return await asyncio.wait_for(self._request(method, path or self.path, body, headers), timeout=self.timeout)
+            except BaseException:
+                self.close()
+                raise
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _request(self, method, path, body, headers):
+        if self._writer is None or self._writer.is_closing():
+            sslctx = ssl.create_default_context() if self.scheme == 'https' else None
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port, ssl=sslctx)
+
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}', 'Connection: keep-alive']
+        lines += [f'{k}: {v}' for k, v in self.headers.items()]
+        if headers:
+            lines += [f'{k}: {v}' for k, v in headers.items()]
+        if body is not None:
+            lines.append(f'Content-Length: {len(body)}')
+        self._writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin1'))
+        if body is not None:
+            self._writer.write(body)
+        await self._writer.drain()
+
+        status = await self._reader.readline()
+        if not status:
+            raise HttpError('Connection closed by server')
+        try:
+            status = int(status.split()[1])
+        except (IndexError, ValueError):
+            raise HttpError(f'Bad status line: {status!r}')
+
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int((await self._reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await self._reader.readline()
+                    break
+                body += await self._reader.readexactly(size)
+                await self._reader.readline()
+        elif 'content-length' in headers:
+            body = await self._reader.readexactly(int(headers['content-length']))
+        else:
+            body = await self._reader.read()
+            self.close()
+
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+
+        return status, body
+
+# Dad jokes, served from memory
+# A background task keeps the cache topped up from icanhazdadjoke.com (or whatever url is
+# configured, eg. a local stub server) so a redemption doesn't wait on the network.
+class JokeCache:
+    def __init__(self, url = 'https://icanhazdadjoke.com/', size = 10, lowwater = 3, timeout = 2, retries = 2):
+        self.size     = size
+        self.lowwater = lowwater
+        self.retries  = retries
+        self.client   = HttpClient(url, timeout, headers={
+            'Accept': 'application/json',
+            'User-Agent': 'TwitchBot (https://github.com/addstar/TwitchBot)',
+        })
+        self._jokes   = deque()
+        self._seen    = set()
+        self._refill  = None
+
+    def __len__(self):
+        return len(self._jokes)
+
+    # Take a joke from the cache (None if it is empty), refilling in the background when low
+    def take(self):
+        joke = self._jokes.popleft() if self._jokes else None
+        if len(self._jokes) < self.lowwater:
+            self._startRefill()
+        return joke
+
+    # Take a joke, fetching one directly if the cache has run dry
+    async def get(self):
+        joke = self.take()
+        if joke is None:
+            joke = await self.fetch()
+        return joke
+
+    async def fetch(self):
+        for attempt in range(self.retries + 1):
+            try:
+                status, body = await self.client.get()
+                if status != 200:
+                    logger.info(f'Dad joke bad response: {status} {body[:200]!r}')
+                    continue
+                data = json.loads(body)
+                return data['joke']
+            except (OSError, asyncio.TimeoutError, HttpError, ValueError, KeyError) as ex:
+                logger.info(f'Dad joke fetch failed: {ex!r}')
+        return None
+
+    def _startRefill(self):
+        if self._refill is None or self._refill.done():
+            self._refill = asyncio.ensure_future(self.prefetch())
+
+    # Fill the cache up to size
+    async def prefetch(self):
+        misses = 0
+        while len(self._jokes) < self.size and misses < 3:
+            joke = await self.fetch()
+            if joke is None:
+                break
+            # Skip jokes we have served recently
+            if joke in self._seen:
+                misses += 1
+                continue
+            self._seen.add(joke)
+            self._jokes.append(joke)
+            if len(self._seen) > self.size * 10:
+                self._seen = set(self._jokes)
@@ -0,0 +1,138 @@
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Journal entry states
+PENDING = 'pending'
+DONE    = 'done'
+FAILED  = 'failed'
+SKIPPED = 'skipped'    # throttled and refunded, never to be run (see throttle.py)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id         INTEGER PRIMARY KEY,
+    msgid      TEXT UNIQUE,
+    channel_id TEXT NOT NULL,
+    topic      TEXT NOT NULL,
+    kind       TEXT NOT NULL,
+    user       TEXT NOT NULL,
+    payload    TEXT NOT NULL,
+    state      TEXT NOT NULL,
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    error      TEXT,
+    received   REAL NOT NULL,
+    updated    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_user  ON events (channel_id, user, kind, id);
+CREATE INDEX IF NOT EXISTS events_state ON events (state, received);
+CREATE TABLE IF NOT EXISTS state (
+    key     TEXT PRIMARY KEY,
+    value   TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+'''
+
+class JournalEntry:
+    __slots__ = ('id', 'msgid', 'channel_id', 'topic', 'kind', 'user', 'payload', 'state', 'attempts', 'error', 'received', 'updated')
+
+    def __init__(self, *row):
+        for name, value in zip(self.__slots__, row):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f'<JournalEntry {self.id} {self.kind} {self.user} {self.state}>'
+
+_COLUMNS = ', '.join(JournalEntry.__slots__)
+
+# Append-only journal of paid events (cheers, subs, redemptions) and whether they were carried out
+#
+# Every event is recorded before it is handled and marked done or failed afterwards, so
+# rewards that were in flight when the process died, or that failed because the RCON
+# server was down, can be replayed on the next start (and picked out again by ?redo).
+# Twitch can deliver the same message twice around a PubSub reconnect: record() returns
+# None for a message id it has seen before, checked against an in-memory LRU of recent
+# ids first and the unique index on disk second. SQLite in WAL mode with synchronous=NORMAL
+# keeps a record/update to a page write without an fsync, cheap enough for the event loop.
+class EventJournal:
+    def __init__(self, path, recent = 10000):
+        self.path    = path
+        self.recent  = recent
+        self._seen   = OrderedDict()
+        self._db     = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+
+        # Prime the duplicate index with the most recent message ids
+        rows = self._db.execute('SELECT msgid FROM events WHERE msgid IS NOT NULL ORDER BY id DESC LIMIT ?', (recent,))
+        for (msgid,) in reversed(rows.fetchall()):
+            self._seen[msgid] = None
+
+    def _remember(self, msgid):
+        self._seen[msgid] = None
+        if len(self._seen) > self.recent:
+            self._seen.popitem(last=False)
+
+    # Record a new event, returns its journal id or None if it's a duplicate delivery
+    def record(self, msgid, channel_id, topic, kind, user, payload):
+        if msgid is not None:
+            if msgid in self._seen:
+                self._seen.move_to_end(msgid)
+                return None
+            self._remember(msgid)
+
+        now = time.time()
+        cur = self._db.execute('INSERT OR IGNORE INTO events (msgid, channel_id, topic, kind, user, payload, state, received, updated) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               (msgid, channel_id, topic, kind, user.lower(), payload, PENDING, now, now))
+        if not cur.rowcount:
+            return None
+        return cur.lastrowid
+
+    def start(self, eid):
+        self._db.execute('UPDATE events SET attempts = attempts + 1, updated = ? WHERE id = ?', (time.time(), eid))
+
+    def done(self, eid):
+        self._db.execute('UPDATE events SET state = ?, error = NULL, updated = ? WHERE id = ?', (DONE, time.time(), eid))
+
+    def failed(self, eid, error):
+        self._db.execute('UPDATE events SET state = ?, error = ?, updated = ? WHERE id = ?', (FAILED, str(error), time.time(), eid))
+
+    def skipped(self, eid, reason):
+        self._db.execute('UPDATE events SET state = ?, error = ?, updated = ? WHERE id = ?', (SKIPPED, reason, time.time(), eid))
+
+    # Events that never completed, received within the last maxage seconds, oldest first
+    def unfinished(self, maxage = 3600, maxattempts = 3):
+        rows = self._db.execute(f'SELECT {_COLUMNS} FROM events WHERE state IN (?, ?) AND received >= ? AND attempts < ? ORDER BY id',
+                                (PENDING, FAILED, time.time() - maxage, maxattempts))
+        return [JournalEntry(*row) for row in rows]
+
+    # Events carried out within the last maxage seconds, in the order they finished
+    def finished(self, maxage):
+        rows = self._db.execute(f'SELECT {_COLUMNS} FROM events WHERE state = ? AND updated >= ? ORDER BY updated',
+                                (DONE, time.time() - maxage))
+        return [JournalEntry(*row) for row in rows]
+
+    # Latest event for a user (optionally of one kind) on a channel, for ?redo
+    def latest(self, channel_id, user, kind = None):
+        if kind is None:
+            row = self._db.execute(f'SELECT {_COLUMNS} FROM events WHERE channel_id = ? AND user = ? ORDER BY id DESC LIMIT 1',
+                                   (channel_id, user.lower())).fetchone()
+        else:
+            row = self._db.execute(f'SELECT {_COLUMNS} FROM events WHERE channel_id = ? AND user = ? AND kind = ? ORDER BY id DESC LIMIT 1',
+                                   (channel_id, user.lower(), kind)).fetchone()
+        return JournalEntry(*row) if row else None
+
+    # Small named JSON state snapshots (eg. hype train progress) kept alongside the events
+    def saveState(self, key, value):
+        self._db.execute('INSERT OR REPLACE INTO state (key, value, updated) VALUES (?, ?, ?)', (key, value, time.time()))
+
+    def loadState(self, key):
+        row = self._db.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,27 @@
+import json
+
+# JSON backend for the hot path
+# Uses orjson or msgspec when installed (several times faster at decoding PubSub frames),
+# falling back to the standard library. loads accepts str or bytes, dumps returns str.
+try:
+    import orjson
+
+    backend = 'orjson'
+    loads = orjson.loads
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode('utf8')
+except ImportError:
+    try:
+        import msgspec
+
+        backend = 'msgspec'
+        loads = msgspec.json.Decoder().decode
+        _encoder = msgspec.json.Encoder()
+
+        def dumps(obj):
+            return _encoder.encode(obj).decode('utf8')
+    except ImportError:
+        backend = 'json'
+        loads = json.loads
+        dumps = json.dumps
@@ -0,0 +1,65 @@
+import atexit
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# Non-blocking logging pipeline
+#
+# The event loop thread only ever puts the LogRecord on a queue. Message formatting
+# (including the %-args, eg. event payloads), the timestamp prefix and the actual
+# handler I/O all happen on the QueueListener's background thread.
+
+class LazyQueueHandler(QueueHandler):
+    # The stock QueueHandler formats the message in the calling thread, skip that
+    def prepare(self, record):
+        return record
+
+class TimestampQueueListener(QueueListener):
+    # Records logged with a 'tag' get the old "<timestamp> <tag><message>" layout
+    def prepare(self, record):
+        tag = getattr(record, 'tag', None)
+        if tag is not None:
+            ts = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created))
+            record.msg  = f'{ts} {tag}{record.getMessage()}'
+            record.args = None
+        return record
+
+    # Safe to call more than once (eg. explicitly and again at exit)
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+# Queue of the supervisor process when running as a worker (see supervisor.py)
+_forward = None
+
+# In a worker process: send every record to the supervisor's queue instead of handling it
+# locally, so all workers end up in the same log files. Must be called before startLogging.
+def forwardLogging(logqueue):
+    global _forward
+    _forward = logqueue
+
+# Move the root logger's configured handlers behind a queue, returns the listener
+# (None in a worker process, where the supervisor's listener does the writing)
+def startLogging(logqueue = None):
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+
+    if _forward is not None:
+        for handler in handlers:
+            root.removeHandler(handler)
+            handler.close()
+        # Stock QueueHandler: the record has to be formatted here to be picklable
+        root.addHandler(QueueHandler(_forward))
+        return None
+
+    logqueue = logqueue or queue.SimpleQueue()
+
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(LazyQueueHandler(logqueue))
+
+    listener = TimestampQueueListener(logqueue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,152 @@
+import random
+
+# Placeholder for the viewer name in precompiled reward commands
+USER = '\x00user\x00'
+
+# Placeholder player name, swapped for each RCON target's player when commands are sent (see fanout.py)
+PLAYER = '\x00player\x00'
+
+# Minecraft command builder
+#
+# The version dialect (1.12 vs modern), spigot's namespaced give and the player name are
+# all fixed at startup, so they are resolved once here into command prefixes/suffixes and
+# version specific methods. The hot path only has to drop the arguments into place.
+# Every builder returns a list of commands, like the old mc* helpers.
+class CommandBuilder:
+    def __init__(self, mcver, mcmodes, player = 'ArtfulMelody'):
+        self.mcver   = mcver
+        self.mcmodes = mcmodes
+        self.player  = player
+        p = player
+
+        give = 'minecraft:give' if 'spigot' in mcmodes else 'give'
+        self._title = f'title {p} '
+        self._give  = f'{give} {p} '
+
+        if mcver == '1.12':
+            self._sound    = (f'execute {p} ~ ~ ~ /playsound ', ' master @s ~ ~ ~ 10')
+            self._effect   = f'effect {p} '
+            self._particle = (f'execute {p} ~ ~ ~ /particle ', ' force @s')
+            self._summon   = (f'execute {p} ~ ~ ~ /summon ', ' ~ ~1 ~ {CustomName:"', '",CustomNameVisible:1,PersistenceRequired:1')
+            self._givedata = True
+            self._items     = {'minecraft:carved_pumpkin': 'minecraft:pumpkin'}
+            self._particles = {'explosion_emitter': 'hugeexplosion'}
+            self.cmd = self._cmd112
+        else:
+            self._sound    = (f'execute as {p} at {p} run playsound ', ' master @s')
+            self._effect   = f'effect give {p} '
+            self._particle = (f'execute at {p} run particle ', ' force')
+            self._summon   = (f'execute at {p} run summon ', ' ~ ~1 ~ {CustomName:"\\"', '\\"",CustomNameVisible:1,PersistenceRequired:1')
+            self._givedata = False
+            self._items     = {}
+            self._particles = {}
+            self.cmd = self._cmd
+
+    def title(self, title, sub, tcolour, scolour, fadein = 20, delay = 100, fadeout = 40):
+        t = self._title
+        return [
+            f'{t}times {fadein} {delay} {fadeout}',
+            f'{t}subtitle {{"text":"{sub}","color":"{scolour}"}}',
+            f'{t}title {{"text":"{title}","color":"{tcolour}"}}',
+        ]
+
+    def sound(self, sound):
+        pre, post = self._sound
+        return [ f'{pre}{sound}{post}' ]
+
+    def effect(self, effect, time, power):
+        return [ f'{self._effect}{effect} {time} {power}' ]
+
+    def particle(self, particle, speed, count, pos = '~ ~1 ~', delta = '1 1 1'):
+        pre, post = self._particle
+        particle = self._particles.get(particle, particle)
+        return [ f'{pre}{particle} {pos} {delta} {speed} {count}{post}' ]
+
+    def give(self, item, count, data = 1):
+        item = self._items.get(item, item)
+        if self._givedata:
+            return [ f'{self._give}{item} {count} {data}' ]
+        return [ f'{self._give}{item} {count}' ]
+
+    def summon(self, entity, age, count, ename, extras = ''):
+        if age:
+            age = f',Age:{age},ForcedAge:{age}'
+
+        if extras:
+            extras = f',{extras}'
+
+        # allow extras to be inside the entity name (seperated by a pipe)
+        if '|' in entity:
+            entity, more = entity.split('|', 1)
+            extras += ',' + more
+
+        pre, name, post = self._summon
+        return [ f'{pre}{entity}{name}{ename}{post}{age}{extras}}}' ]
+
+    def _cmd(self, cmd):
+        return [ cmd ]
+
+    def _cmd112(self, cmd):
+        return [ cmd.replace(' weapon.mainhand ', ' slot.weapon.mainhand ') ]
+
+    # Precompile a reward spec (see rewards.py) into its rendered command list
+    def compileReward(self, spec):
+        return CompiledReward(self, spec)
+
+# A reward spec rendered once into commands for one builder
+# Only the random parts (sounds/summons) and the viewer name are filled in per redemption.
+class CompiledReward:
+    __slots__ = ('spec', 'log', 'action', 'sounds', 'static', 'summons', 'builder')
+
+    def __init__(self, builder, spec):
+        self.spec    = spec
+        self.builder = builder
+        self.log     = spec.get('log')
+        self.action  = spec.get('action')
+        self.sounds  = spec.get('sounds')
+        self.summons = spec.get('summons', ())
+
+        static = []
+        title = spec.get('title')
+        if title:
+            times = title.get('times', (20, 100, 40))
+            static += builder.title(title['text'].replace('{user}', USER), title['sub'].replace('{user}', USER),
+                                    title['colour'], title['subcolour'], *times)
+
+        for effect, secs, power in spec.get('effects', ()):
+            static += builder.effect(effect, secs, power)
+
+        for cmd in spec.get('commands', ()):
+            static += builder.cmd(cmd.replace('{player}', builder.player))
+
+        for give in spec.get('gives', ()):
+            static += builder.give(*give)
+
+        for particle in spec.get('particles', ()):
+            static += builder.particle(*particle)
+
+        self.static = static
+
+    # Render the commands for a redemption by rwho. pickmob(passive, hostile) picks a mob
+    # for any summons in the spec.
+    def render(self, rwho, pickmob = None):
+        builder = self.builder
+        cmds = []
+
+        sounds = self.sounds
+        if sounds:
+            if isinstance(sounds, dict):
+                picked = random.choices(sounds['from'], k=sounds.get('pick', 1))
+                sounds = [picked[i] for i in sounds.get('order', range(len(picked)))]
+            for sound in sounds:
+                cmds += builder.sound(sound)
+
+        cmds += [cmd.replace(USER, rwho) for cmd in self.static]
+
+        for summon in self.summons:
+            for x in range(0, summon.get('count', 1)):
+                mob = pickmob(summon.get('passive', 3), summon.get('hostile', 1))
+                ncolour = random.choice('abcde96')
+                cmds += builder.summon(mob, summon.get('age', ''), 1, '§'+ncolour+rwho)
+
+        return cmds
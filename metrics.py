@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Lightweight in-process metrics
+#
+# Counters, gauges and histograms in the Prometheus data model, cheap enough to leave on
+# during a stream (an update is a dict lookup and an add). Everything registers itself
+# in the module level registry, which can be served over HTTP in the Prometheus text
+# format (serveMetrics) and/or logged as periodic snapshots (logSnapshots).
+# Reads can come from another thread (supervisor.py's worker snapshots) while the event
+# loop adds metrics and label children, so adding them and copying the dicts to iterate
+# over is done under a lock. Updating an existing child takes no lock.
+
+_lock = threading.Lock()    # guards adding to (and copying) the metric and children dicts
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        with _lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def _metrics(self):
+        with _lock:
+            return list(self.metrics.values())
+
+    def render(self):
+        lines = []
+        for metric in self._metrics():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+    # Flat {name{labels}: value} view, used for log snapshots and combining worker metrics
+    def snapshot(self):
+        values = {}
+        for metric in self._metrics():
+            values.update(metric.values())
+        return values
+
+registry = Registry()
+
+def _labelstr(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, values)) + '}'
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels = (), registry = registry):
+        self.name       = name
+        self.help       = help
+        self.labelnames = tuple(labels)
+        self.children   = {}
+        if not self.labelnames:
+            self.children[()] = self._child()
+        registry.register(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with _lock:
+                child = self.children.setdefault(values, self._child())
+        return child
+
+    def _children(self):
+        with _lock:
+            return list(self.children.items())
+
+    def render(self):
+        return [f'{self.name}{_labelstr(self.labelnames, k)} {v}' for k, v in self.values(raw=True)]
+
+    def values(self, raw = False):
+        items = [(k, c.value) for k, c in self._children()]
+        if raw:
+            return items
+        return {f'{self.name}{_labelstr(self.labelnames, k)}': v for k, v in items}
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount = 1):
+        self.value += amount
+
+    def dec(self, amount = 1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _child(self):
+        return _Value()
+
+    def inc(self, amount = 1):
+        self.children[()].value += amount
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    # fn: optional callable evaluated whenever the gauge is read
+    def __init__(self, name, help, labels = (), registry = registry, fn = None):
+        self.fn = fn
+        super().__init__(name, help, labels, registry)
+
+    def _child(self):
+        return _Value()
+
+    def set(self, value):
+        self.children[()].value = value
+
+    def inc(self, amount = 1):
+        self.children[()].value += amount
+
+    def dec(self, amount = 1):
+        self.children[()].value -= amount
+
+    def values(self, raw = False):
+        if self.fn is not None:
+            self.children[()].value = self.fn()
+        return super().values(raw)
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts  = [0] * (len(buckets) + 1)
+        self.sum     = 0.0
+        self.count   = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum   += value
+        self.count += 1
+
+    # Context manager timing a block of code
+    def time(self):
+        return _Timer(self)
+
+class _Timer:
+    __slots__ = ('hist', 'start')
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start)
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels = (), registry = registry, buckets = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labels, registry)
+
+    def _child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def time(self):
+        return self.children[()].time()
+
+    def render(self):
+        lines = []
+        for key, child in self._children():
+            total = 0
+            for le, count in zip(self.buckets + ('+Inf',), child.counts):
+                total += count
+                lines.append(f'{self.name}_bucket{_labelstr(self.labelnames + ("le",), key + (le,))} {total}')
+            lines.append(f'{self.name}_sum{_labelstr(self.labelnames, key)} {child.sum}')
+            lines.append(f'{self.name}_count{_labelstr(self.labelnames, key)} {child.count}')
+        return lines
+
+    def values(self, raw = False):
+        values = {}
+        for key, child in self._children():
+            labels = _labelstr(self.labelnames, key)
+            values[f'{self.name}_count{labels}'] = child.count
+            values[f'{self.name}_sum{labels}'] = child.sum
+        return values
+
+# Event loop lag: how late a sleep(interval) wakes up is how long the loop was blocked
+loop_lag = Histogram('event_loop_lag_seconds', 'Event loop wake up delay')
+loop_lag_max = Gauge('event_loop_lag_max_seconds', 'Worst event loop wake up delay seen')
+
+async def monitorLoopLag(interval = 0.25):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        loop_lag.observe(lag)
+        if lag > loop_lag_max.children[()].value:
+            loop_lag_max.set(lag)
+
+# Serve the registry in the Prometheus text format on http://host:port/metrics
+async def serveMetrics(port, host = '127.0.0.1', registry = registry):
+    async def client(reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if request.split(b' ')[1:2] == [b'/metrics']:
+                status, body = '200 OK', registry.render().encode('utf8')
+            else:
+                status, body = '404 Not Found', b'Not found\n'
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin1') + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(client, host, port)
+    logger.info(f'Metrics available on http://{host}:{port}/metrics')
+    return server
+
+# Log a snapshot of every metric every interval seconds
+async def logSnapshots(interval = 60, registry = registry):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info('METRICS: %s', ' '.join(f'{k}={v:g}' for k, v in registry.snapshot().items()))
@@ -0,0 +1,179 @@
+import functools
+import random
+
+# Mob tables for each game mode profile: (passive mobs, hostile mobs)
+# Entries may carry extra NBT after a pipe (see CommandBuilder.summon), {size} is
+# filled in with a random size when the mob is drawn.
+_MODDED = (
+    [
+        'twilightforest:bighorn_sheep',
+        'twilightforest:deer',
+        'twilightforest:penguin',
+        'twilightforest:quest_ram',
+        'twilightforest:raven',
+        'twilightforest:squirrel',
+        'twilightforest:bunny',
+        'twilightforest:tiny_bird',
+        'twilightforest:wild_boar',
+    ],
+    [
+        'twilightforest:helmet_crab',
+        'twilightforest:minoshroom',
+        'twilightforest:yeti',
+    ],
+)
+
+_AMNESIA = (
+    [
+        'quark:frog',
+        'quark:crab',
+    ],
+    [
+        'twilightforest:rising_zombie',
+    ],
+)
+
+_SF4 = (
+    [
+        'matteroverdrive:failed_chicken',
+        'matteroverdrive:failed_cow',
+        'matteroverdrive:failed_pig',
+        'matteroverdrive:failed_sheep',
+    ],
+    [],
+)
+
+_UNCLEGENNY = (
+    [
+        'animania:kit_new_zealand',
+        'animania:kit_cottontail',
+        'animania:peachick_peach',
+        'animania:lamb_friesian',
+        'animania:kid_pygmy',
+        'animania:hedgehog_albino',
+        'animania:piglet_old_spot',
+        'animania:hamster',
+        'animania:frog',
+        'animania:cow_longhorn',
+        'zawa:galapagostortoise',
+        'zawa:koala',
+        'zawa:echidna',
+        'zawa:platypus',
+        'zawa:cockatoo',
+        'zawa:redpanda',
+        'lilcritters:bandedpenguin',
+        'lilcritters:raccoon',
+        'lilcritters:treesquirrel',
+        'lilcritters:boxturtle',
+        'midnight:nightstag',
+        'quark:frog',
+    ],
+    [
+        'erebus:erebus.rhino_beetle',
+        'erebus:erebus.money_spider',
+        'quark:crab',
+        'animania:dartfrog',
+    ],
+)
+
+_LITV = (
+    [
+        'betteranimalsplus:butterfly|VariantId:"purple_emperor",Size:{size}',
+        'betteranimalsplus:butterfly|VariantId:"red_admiral",Size:{size}',
+        'betteranimalsplus:butterfly|VariantId:"swallowtail",Size:{size}',
+        'betteranimalsplus:butterfly|VariantId:"morpho",Size:{size}',
+        'betteranimalsplus:butterfly|VariantId:"sulphur",Size:{size}',
+        'betteranimalsplus:butterfly|VariantId:"monarch",Size:{size}',
+    ],
+    [],
+)
+
+_VANILLA = (
+    [
+        'minecraft:pig',
+        'minecraft:chicken',
+        'minecraft:cat',
+        'minecraft:rabbit',
+        'minecraft:sheep',
+        'minecraft:mooshroom',
+        'minecraft:turtle',
+        'minecraft:panda',
+        'minecraft:cow',
+        'minecraft:llama',
+        'minecraft:squid',
+        'minecraft:polar_bear',
+        'minecraft:trader_llama',
+        'minecraft:ocelot',
+        'minecraft:parrot',
+        'minecraft:bee',
+    ],
+    [
+        'minecraft:zombie',
+        'minecraft:slime',
+        'minecraft:witch',
+        'minecraft:magma_cube',
+        'minecraft:vex',
+        'minecraft:silverfish',
+        'minecraft:endermite',
+        'minecraft:spider',
+    ],
+)
+
+def mobProfile(mcmodes):
+    if any(x in ('sf4', 'amnesia') for x in mcmodes):
+        passive, hostile = list(_MODDED[0]), list(_MODDED[1])
+        # Add specific mobs for each mod
+        if 'amnesia' in mcmodes:
+            passive += _AMNESIA[0]
+            hostile += _AMNESIA[1]
+        if 'sf4' in mcmodes:
+            passive += _SF4[0]
+            hostile += _SF4[1]
+        return passive, hostile
+    elif 'unclegenny' in mcmodes:
+        return _UNCLEGENNY
+    elif 'litv' in mcmodes:
+        return _LITV
+    return _VANILLA
+
+# Cumulative weights over passive + hostile mobs, each passive mob weighing passivechance
+# and each hostile one hostilechance. Only a handful of chance pairs are ever used (the
+# hostile chance steps up per 30 bits), so the tables are cached.
+@functools.lru_cache(maxsize=128)
+def _cumWeights(npassive, nhostile, passivechance, hostilechance):
+    pweight = passivechance * npassive
+    return tuple(passivechance * (i + 1) for i in range(npassive)) + \
+           tuple(pweight + hostilechance * (i + 1) for i in range(nhostile))
+
+# Weighted random mob picker, built once per game mode profile
+#
+# The old pickMob built a list with each mob repeated passivechance/hostilechance times
+# and ran random.choice over it. The same distribution comes from one random.choices call
+# over the profile's mobs with those weights, off a cumulative weight table that is built
+# once per chance pair, with nothing materialised per call however big the chances get.
+class MobSampler:
+    def __init__(self, mcmodes):
+        self.passive, self.hostile = mobProfile(mcmodes)
+        self._pool  = tuple(self.passive) + tuple(self.hostile)
+        self._sized = any('{size}' in m for m in self._pool)
+
+    # Draw k mobs (with replacement). A sub gets bigger mobs where the profile has sizes.
+    def draw(self, passivechance = 3, hostilechance = 1, k = 1, sub = False):
+        cumweights = _cumWeights(len(self.passive), len(self.hostile), passivechance, hostilechance)
+        if not cumweights or cumweights[-1] <= 0:
+            return []
+        mobs = random.choices(self._pool, cum_weights=cumweights, k=k)
+
+        if self._sized:
+            # pick random size for mob (shared by the whole draw)
+            if sub:
+                size = round(random.uniform(1, 2), 3)
+            else:
+                size = round(random.uniform(0.3, 1), 3)
+            mobs = [m.replace('{size}', str(size)) for m in mobs]
+
+        return mobs
+
+    def pick(self, passivechance = 3, hostilechance = 1, sub = False):
+        mobs = self.draw(passivechance, hostilechance, 1, sub)
+        return mobs[0] if mobs else ''
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import re
+
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+rcon_server_mspt = Gauge('rcon_server_mspt', 'Server tick time (ms) from the last pacing probe', ['server'])
+rcon_server_tps  = Gauge('rcon_server_tps', 'Server TPS from the last pacing probe', ['server'])
+rcon_paced_rate  = Gauge('rcon_paced_rate', 'Commands per second the pacing controller allows', ['server'])
+rcon_mob_scale   = Gauge('rcon_mob_scale', 'Multiplier the pacing controller applies to summon counts', ['server'])
+
+_COLOURS = re.compile('§.')
+_MSPT    = (re.compile(r'Mean tick time: ([\d.]+) ?ms'),                # forge tps
+            re.compile(r'Average time per tick: ([\d.]+) ?ms'),         # vanilla tick query
+            re.compile(r'Tick durations[^:]*:[^\d]*[\d.]+/([\d.]+)/'))   # spark tps (median of the last 10s)
+_TPS     = (re.compile(r'Mean TPS: ([\d.]+)'),                          # forge tps
+            re.compile(r'TPS from last [^:]*:[^\d]*([\d.]+)'))           # spigot/paper/spark tps (most recent window)
+
+# Command that reports a server's tick health, None if there's nothing to ask. Modded
+# (chancecubes/mobs) servers before 1.13 are Forge unless they're marked vanilla.
+def probeCommand(mcver, mcmodes):
+    if 'spark' in mcmodes:
+        return 'spark tps'
+    if 'forge' in mcmodes:
+        return 'forge tps'
+    if 'spigot' in mcmodes or 'paper' in mcmodes:
+        return 'tps'
+    try:
+        version = tuple(int(part) for part in str(mcver).split('.'))
+    except ValueError:
+        return None
+    if version < (1, 13) and 'vanilla' not in mcmodes and ('chancecubes' in mcmodes or 'mobs' in mcmodes):
+        return 'forge tps'
+    return 'tick query' if version >= (1, 20, 3) else None
+
+# (tps, mspt) from a probe's response, either can be None if it's not in there
+def parseHealth(text):
+    text = _COLOURS.sub('', text)
+    mspt = tps = None
+    for pattern in _MSPT:
+        match = pattern.search(text)
+        if match:
+            mspt = float(match.group(1))
+            break
+    for pattern in _TPS:
+        match = pattern.search(text)
+        if match:
+            tps = float(match.group(1))
+            break
+    if tps is None and mspt is not None:
+        # An idle server can report 0.0ms
+        tps = min(20.0, 1000 / mspt) if mspt else 20.0
+    return tps, mspt
+
+# Adapts one RCON server's command rate and summon counts to how well it's keeping up
+#
+# Every interval seconds the server's tick time is asked for (see probeCommand) straight
+# over the pool, not through the queue it's pacing. Additive increase, multiplicative
+# decrease: while the tick time is above high ms (50 is a full tick, so the server is
+# about to fall behind) the queue's rate and its mob scale are halved, down to minrate and
+# minscale; below low ms they step back up towards the configured rate and full counts.
+# In between they are left alone. Servers that only report TPS (spigot's tps) count as
+# lagging below mintps and idle at a full 20, as TPS says nothing until ticks overrun.
+# Handlers multiply mob counts by queue.mobscale (see ChannelContext.mobs) and the queue
+# caps merged summons with it.
+class PacingController:
+    def __init__(self, queue, command, name, interval = 10, high = 45, low = 30, mintps = 19, minrate = 2, minscale = 0.2, timeout = 5):
+        self.queue    = queue
+        self.command  = command
+        self.name     = name
+        self.interval = interval
+        self.high     = high
+        self.low      = low
+        self.mintps   = mintps
+        self.maxrate  = queue.rate
+        self.minrate  = min(minrate, queue.rate)
+        self.minscale = minscale
+        self.timeout  = timeout
+        self.mspt     = None
+        self.tps      = None
+        self._failing = False
+
+    async def run(self):
+        rcon_paced_rate.labels(self.name).set(self.queue.rate)
+        rcon_mob_scale.labels(self.name).set(self.queue.mobscale)
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.sample()
+
+    async def sample(self):
+        try:
+            resp = await asyncio.wait_for(self.queue.pool.command(self.command), timeout=self.timeout)
+        except Exception as ex:
+            # A server too busy to answer in time is as good as lagging
+            if isinstance(ex, asyncio.TimeoutError):
+                self.adjust(True, False)
+            if not self._failing:
+                logger.info(f'Pacing probe "{self.command}" on {self.name} failed: {ex!r}')
+            self._failing = True
+            return
+        self._failing = False
+
+        self.tps, self.mspt = parseHealth(resp or '')
+        if self.mspt is not None:
+            rcon_server_mspt.labels(self.name).set(self.mspt)
+            self.adjust(self.mspt > self.high, self.mspt < self.low)
+        elif self.tps is not None:
+            self.adjust(self.tps < self.mintps, self.tps >= 19.95)
+        else:
+            logger.info(f'Pacing probe "{self.command}" on {self.name}: no tick time in {resp!r:.200}')
+            return
+        if self.tps is not None:
+            rcon_server_tps.labels(self.name).set(self.tps)
+
+    def adjust(self, lagging, idle):
+        queue = self.queue
+        rate, scale = queue.rate, queue.mobscale
+        if lagging:
+            queue.rate     = max(self.minrate, queue.rate / 2)
+            queue.mobscale = max(self.minscale, round(queue.mobscale / 2, 2))
+        elif idle:
+            queue.rate     = min(self.maxrate, queue.rate + self.maxrate / 10)
+            queue.mobscale = min(1.0, round(queue.mobscale + 0.1, 2))
+
+        if (rate, scale) != (queue.rate, queue.mobscale):
+            logger.info(f'Pacing {self.name}: {self.tps} TPS, {self.mspt} ms/tick -> {queue.rate:.1f} commands/s, mobs x{queue.mobscale:.1f}')
+            rcon_paced_rate.labels(self.name).set(queue.rate)
+            rcon_mob_scale.labels(self.name).set(queue.mobscale)
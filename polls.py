@@ -0,0 +1,76 @@
+import time
+
+# Running tally of one Twitch poll
+#
+# Every POLL_UPDATE (a PollEvent, see events.py) carries the full choice list; only choices whose vote count changed
+# touch the tally. The leaders (all choices on the highest count) and the top k choices
+# are kept up to date as votes arrive, so progress titles and the final result are read
+# straight off the maintained state instead of rescanning the choices.
+class PollTally:
+    __slots__ = ('poll_id', 'title', 'k', 'votes', 'names', 'total', 'maxvotes', 'leaders', 'topk', 'shown')
+
+    def __init__(self, poll_id, k = 3):
+        self.poll_id  = poll_id
+        self.title    = ''
+        self.k        = k
+        self.votes    = {}    # choice id -> votes
+        self.names    = {}    # choice id -> title
+        self.total    = 0
+        self.maxvotes = 0
+        self.leaders  = []    # choice ids on maxvotes
+        self.topk     = []    # choice ids, most votes first
+        self.shown    = 0     # when progress was last shown in game
+
+    def update(self, poll):
+        self.title = poll.title
+        for choice in poll.choices:
+            cid   = choice.choice_id
+            votes = choice.votes
+            old   = self.votes.get(cid)
+            if old == votes:
+                continue
+            self.votes[cid] = votes
+            self.names[cid] = choice.title
+            self.total += votes - (old or 0)
+
+            if old is not None and votes < old:
+                # Votes only go up, but don't trust that blindly
+                self._rescan()
+                continue
+            self._leader(cid, votes)
+            self._rank(cid, votes)
+
+    def _leader(self, cid, votes):
+        if votes > self.maxvotes:
+            self.maxvotes = votes
+            self.leaders  = [cid]
+        elif votes == self.maxvotes and cid not in self.leaders:
+            self.leaders.append(cid)
+
+    def _rank(self, cid, votes):
+        topk = self.topk
+        if cid not in topk:
+            if len(topk) >= self.k and votes <= self.votes[topk[-1]]:
+                return
+            topk.append(cid)
+        topk.sort(key=self.votes.__getitem__, reverse=True)
+        del topk[self.k:]
+
+    def _rescan(self):
+        self.maxvotes = max(self.votes.values(), default=0)
+        self.leaders  = [cid for cid, votes in self.votes.items() if votes == self.maxvotes]
+        self.topk     = sorted(self.votes, key=self.votes.__getitem__, reverse=True)[:self.k]
+
+    # True (and resets the timer) if progress hasn't been shown for interval seconds
+    def due(self, interval):
+        now = time.monotonic()
+        if now - self.shown < interval:
+            return False
+        self.shown = now
+        return True
+
+    def top(self):
+        return [(self.names[cid], self.votes[cid]) for cid in self.topk]
+
+    def winners(self):
+        return [self.names[cid] for cid in self.leaders]
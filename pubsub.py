@@ -2,327 +2,525 @@ import sys
 sys.path.insert(1, 'PythonTwitchBotFramework/')
 
 import os
-import websockets
 import asyncio
 import json
 import random
-import traceback
-import re
 import time
-from math import floor
-from pprint import pprint
-from mcrcon import MCRcon
-from datetime import datetime, timedelta
-
-from twitchbot.bots import BaseBot
-from twitchbot import event_handler, Event, Message, Channel, PollData, Command, CommandContext
+import re
+import contextvars
+import functools
+import importlib
 import logging.config
-import yaml
-
-# Fetch configuration from file
-with open('logging.yaml', 'r') as f:
-    config = yaml.safe_load(f.read())
-    logging.config.dictConfig(config)
-
-# Set initial Hype train state
-hypetrain = {}
-hypetrain['level'] = 1
-hypetrain['value'] = 0
-hypetrain['goal']  = 2000
-hypetrain['total'] = 0
-hypetrain['perc']  = 0
+import math
+
+from channels import loadChannels, shardChannels
+from jokes import JokeCache, HttpClient, HttpError
+from dispatch import EventDispatcher
+from bursts import BurstAggregator
+from fanout import fanout
+from pubsubclient import PubSubTransport
+from chat import ChatQueue, CHAT_LIMIT, CHAT_LIMIT_MOD
+from logpipe import startLogging
+from events import FollowEvent, BitsEvent, SubEvent, PointsEvent, RaidEvent, PollEvent, HypeTrainEvent
+from jsonlib import loads, dumps
+from polls import PollTally
+from throttle import ALLOW, REFUND
+from metrics import Counter, Gauge, Histogram, monitorLoopLag, serveMetrics, logSnapshots
+
+# Importing this module has no side effects, main() reads the config and starts the bot.
+# The slow imports (websockets, yaml, sqlite3, the bot framework) are done where they are
+# first needed, so tools can import it cheaply and startup can overlap them with connecting.
 
 # Get the logger specified in the file
 logger = logging.getLogger(__name__)
 
-# Read channel/token from config file
-config = json.load(open('configs/pubsub.json'))
-_channel_id = config['channel_id']
-_auth_token = config['auth_token']
-
-# Set this to the version of minecraft in use
-# This adjusts the commands used for redemptions
-_mcver = config['mcver']
-
-# List of current game modes for rewards (minecraft, chancecubes, etc)
-_mcmodes = config['mcmodes']
-
-# Rcon stuff
-_rconPass = config['rconpass']
-_rconPort = config['rconport']
-
-# PubSub WebSocket
-async def pubsubConnect():
-    uri = 'wss://pubsub-edge.twitch.tv'
-
-    bits_topic_prefix       = 'channel-bits-events-v2.'
-    points_topic_prefix     = 'channel-points-channel-v1.'
-    sub_topic_prefix        = 'channel-subscribe-events-v1.'
-    hype_train_topic_prefix = 'hype-train-events-v1.'
-    raid_topic_prefix       = 'raid.'
-    follow_topic_prefix     = 'following.'
-    polls_topic_prefix      = 'polls.'
-    community_points_prefix = 'community-points-channel-v1.'
-
-    bits_topic       = bits_topic_prefix + _channel_id
-    points_topic     = points_topic_prefix + _channel_id
-    sub_topic        = sub_topic_prefix + _channel_id
-    hype_train_topic = hype_train_topic_prefix + _channel_id
-    raid_topic       = raid_topic_prefix + _channel_id
-    follow_topic     = follow_topic_prefix + _channel_id
-    polls_topic      = polls_topic_prefix + _channel_id
-    community_topic  = community_points_prefix + _channel_id
-
-    # Subscription Request
-    request = {
-        'type': 'LISTEN',
-        'data': {
-            'topics': [bits_topic, points_topic, sub_topic, hype_train_topic, raid_topic, follow_topic, polls_topic, community_topic],
-            'auth_token': _auth_token
-        }
-    }
+# Everything below is set up by setup(config)
+config         = None
+loglistener    = None
+channels       = []    # ChannelContext per served channel (see channels.py)
+channelsById   = {}
+channelsByChat = {}
+commandqueues  = []    # one per RCON server
+jokes          = None  # prefetched dad jokes for the "Joke's On You" reward
+journal        = None  # journal of paid events (see journal.py)
+dispatcher     = None  # worker coroutines that run the handlers off the PubSub receive loop
+bursts         = None  # gift bomb aggregation (see bursts.py)
+chatqueue      = None  # ordered, rate limited chat output
+chatbot        = None
+helix          = None  # Twitch API, for cancelling (refunding) throttled redemptions
+pacers         = []    # per RCON server command rate/mob count control from its tick times
+
+def setup(conf):
+    global config, channels, channelsById, channelsByChat, commandqueues, jokes, journal, dispatcher, bursts, chatqueue, helix, pacers
+    config = conf
+
+    # Channels to serve: a "channels" list of per-broadcaster settings (channel_id, auth_token,
+    # chat, player, mcver, mcmodes, rcon*, rewards), falling back to the top level keys for
+    # anything a channel leaves out. A config without "channels" is a single channel as before.
+    # See channels.py for what is shared between channels.
+    channels = loadChannels(config)
+    channelsById = {ctx.channel_id: ctx for ctx in channels}
+    channelsByChat = {ctx.chat: ctx for ctx in channels}
+    commandqueues = list({id(target.queue): target.queue for ctx in channels for target in ctx.targets}.values())
+
+    jokes = JokeCache(config.get('jokeurl', 'https://icanhazdadjoke.com/'))
+
+    # Dedupes repeated deliveries, replays unfinished rewards on startup (received in the
+    # last journalreplay seconds) and backs ?redo
+    from journal import EventJournal
+    journal = EventJournal(config.get('journal', 'journal.db'))
+
+    # Pick up a hype train that was running when we last stopped
+    for ctx in channels:
+        snapshot = journal.loadState('hypetrain.' + ctx.channel_id)
+        if snapshot and ctx.hypetrain.restore(loads(snapshot)):
+            logmsg('Restored hype train for #%s: %s', ctx.chat, ctx.hypetrain)
+
+    dispatcher = EventDispatcher(workers=config.get('workers', 4))
+
+    # Gift bombs: gifts from one gifter are collected until none have arrived for giftwindow
+    # seconds (or giftmaxwait seconds have passed) and rewarded together
+    bursts = BurstAggregator(window=config.get('giftwindow', 1.0), maxwait=config.get('giftmaxwait', 5.0))
+
+    # chatmod: bot is a mod so gets the higher limit, chatlimit: messages per 30s (supervisor
+    # workers get a share of the account's limit)
+    chatqueue = ChatQueue(sendChat,
+                          limit=config.get('chatlimit') or (CHAT_LIMIT_MOD if config.get('chatmod') else CHAT_LIMIT))
+
+    helix = HttpClient(config.get('helixuri', 'https://api.twitch.tv/helix'), timeout=5)
+
+    # Adaptive pacing ("pacing": true or PacingController settings): each RCON server is asked
+    # for its tick times and its command rate and mob counts follow (see pacing.py). Servers
+    # that can't report them (vanilla before 1.20.3 without spark) keep their fixed rate.
+    pacers = []
+    if config.get('pacing'):
+        from pacing import PacingController, probeCommand
+        settings = config['pacing'] if isinstance(config['pacing'], dict) else {}
+        seen = set()
+        for ctx in channels:
+            for target in ctx.targets:
+                if id(target.queue) in seen:
+                    continue
+                seen.add(id(target.queue))
+                command = probeCommand(ctx.mcver, ctx.mcmodes)
+                if command is None:
+                    logmsg('No tick time probe for %s (%s %s), not pacing it', target.name, ctx.mcver, ctx.mcmodes)
+                    continue
+                pacers.append(PacingController(target.queue, command, target.name, **settings))
+
+# Metrics (see metrics.py), served on metricsport if set and logged every metricslog seconds
+pubsub_messages   = Counter('pubsub_messages_total', 'PubSub messages received', ['topic'])
+pubsub_decode     = Histogram('pubsub_decode_seconds', 'Time to decode a PubSub message')
+pubsub_throttled  = Counter('pubsub_throttled_total', 'Events held back by per-user cooldowns/quotas', ['kind', 'verdict'])
+pubsub_invalid    = Counter('pubsub_invalid_total', 'PubSub messages dropped because their payload could not be decoded', ['topic'])
+pubsub_duplicates = Counter('pubsub_duplicates_total', 'Repeated PubSub deliveries dropped by the journal')
+# Gauges read the objects made by setup()
+Gauge('dispatch_pending', 'Events waiting for a dispatcher worker', fn=lambda: dispatcher.pending())
+Gauge('rcon_queue_depth', 'Commands waiting in the RCON command queues', fn=lambda: sum(q.depth for q in commandqueues))
+Gauge('rcon_queue_dropped', 'Commands dropped by the RCON command queues', fn=lambda: sum(q.dropped for q in commandqueues))
+Gauge('rcon_queue_merged', 'Commands merged by the RCON command queues', fn=lambda: sum(q.merged for q in commandqueues))
+Gauge('chat_queue_depth', 'Chat messages waiting to be sent', fn=lambda: chatqueue.depth)
+Gauge('chat_merged', 'Chat lines merged while rate limited', fn=lambda: chatqueue.merged)
+
+# PubSub topic prefix -> (handler, event, keyed, rawtag, eventkey, burstkey), filled in by @pubsubTopic on the handlers below
+#   event:    the events.py class the payload is decoded into, handlers get an instance of it
+#   keyed:    send every event of the topic to the same dispatcher worker so they are handled in order
+#   rawtag:   log the raw message payload under this tag before dispatching
+#   eventkey: journal the topic's events, fn(event) -> (message id, kind, user). The handler
+#             is wrapped to take the list of journal ids and mark them done/failed (see journaled)
+#   burstkey: batch the topic's events, fn(event) -> key or None. Events with the same key
+#             that arrive close together are handled as one call with a list of events (see
+#             bursts.py), a None key is handled straight away as a list of one. Needs eventkey.
+# A topic with no handler is listened to and logged only.
+topicHandlers = {}
+
+def pubsubTopic(prefix, event, keyed = False, rawtag = None, eventkey = None, burstkey = None):
+    def register(handler):
+        topicHandlers[prefix] = (journaled(handler) if eventkey else handler, event, keyed, rawtag, eventkey, burstkey)
+        return handler
+    return register
+
+# Payload -> typed event (from the JSON unless a transport has decoded it already), None
+# (logged) if it's not valid for the topic
+def decodeEvent(prefix, event, raw, message = None):
+    try:
+        return event.fromPubSub(loads(raw) if message is None else message)
+    except ValueError as ex:    # including EventError
+        pubsub_invalid.labels(prefix).inc()
+        logmsg('INVALID MESSAGE %s: %s (%s)', prefix, ex, raw)
+        return None
+
+# RCON sends started by the journaled handler currently running on this dispatcher worker
+_rconSends = contextvars.ContextVar('rconSends', default=None)
+
+# The handler only queues its commands (see sendRconCommands), so the worker moves on to the
+# next event straight away and the entries are marked done/failed once the sends finish
+def journaled(handler):
+    @functools.wraps(handler)
+    async def run(ctx, message, eids):
+        sends = []
+        token = _rconSends.set(sends)
+        for eid in eids:
+            journal.start(eid)
+        try:
+            await handler(ctx, message)
+        except Exception as ex:
+            for eid in eids:
+                journal.failed(eid, ex)
+            raise
+        finally:
+            _rconSends.reset(token)
+        if sends:
+            background(finishJournaled(eids, sends))
+        else:
+            for eid in eids:
+                journal.done(eid)
+    return run
+
+async def finishJournaled(eids, sends):
+    errors = [error for error in await asyncio.gather(*sends) if error is not None]
+    for eid in eids:
+        if errors:
+            journal.failed(eid, errors[0])
+        else:
+            journal.done(eid)
+
+# Tasks nothing waits on, referenced until they finish so they aren't garbage collected
+_background = set()
+def background(coro):
+    task = asyncio.ensure_future(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+def dispatchBurst(handler, ctx, key, items):
+    events, eids = zip(*items)
+    dispatcher.submit(handler, ctx, list(events), list(eids), key=key)
+
+# Deferred (and merged) events let through by a throttle, several merged ones run as one event
+def dispatchThrottled(handler, ctx, key, items):
+    events, eids = zip(*items)
+    dispatcher.submit(handler, ctx, type(events[0]).merge(list(events)), list(eids), key=key)
+
+# Per-user cooldowns/quotas (the channel's "throttle" config, see throttle.py): a throttle
+# for the redeemed reward, else for the kind of event
+def eventThrottle(ctx, kind, event):
+    if not ctx.throttles:
+        return None
+    if kind == 'points':
+        throttle = ctx.throttles.get('points:' + event.reward.lower())
+        if throttle is not None:
+            return throttle
+    return ctx.throttles.get(kind)
+
+# Run an event past its throttle (if it has one), False if it has been held back
+def admitThrottled(ctx, handler, key, kind, user, event, eid):
+    throttle = eventThrottle(ctx, kind, event)
+    if throttle is None:
+        return True
+    submit = functools.partial(dispatchThrottled, handler, ctx, key)
+    verdict, wait = throttle.admit(event.user_id or user.lower(), (event, eid), submit)
+    if verdict == ALLOW:
+        return True
+    throttled(ctx, throttle, verdict, wait, kind, user, event, eid)
+    return False
+
+def throttled(ctx, throttle, verdict, wait, kind, user, event, eid):
+    pubsub_throttled.labels(kind, verdict).inc()
+    if verdict != REFUND:
+        logmsg('THROTTLED %s by %s: %s, runs in %.1fs', kind, user, verdict, wait)
+        return
 
-    reconnect_timeout = 1
-    # Loop Forever
-    while True:
-        # Connect to server
-        logmsg("Connecting to Twitch PubSub...")
-        async with websockets.connect(uri) as websocket:
-            reconnect_timeout = 1
-
-            # Send request
-            #logmsg("Sending: " + create_debug_message(request))
-            await websocket.send(json.dumps(request))
-
-            # Receive response
-            try:
-                response_raw = await asyncio.wait_for(websocket.recv(), timeout=10)
-                #logmsg("Connect Response: " + create_debug_message(response_raw))
-            except asyncio.TimeoutError:
-                logmsg(create_debug_message('PubSub failed to respond, retrying connection'))
-                continue
-            response = json.loads(response_raw)
-
-            # If no errors, begin loop
-            if (response['error'] == ''):
-                #logmsg(create_debug_message('PubSub Connected'))
-                logmsg('PubSub Connected')
-
-                # When the last ping was sent
-                last_ping = datetime.now()
-                next_ping = timedelta(minutes=4, seconds=30)
-
-                while not websocket.closed:
-                    # As per documentation, send ping requests within 5 minutes
-                    ping_delay = next_ping - (datetime.now() - last_ping)
-                    try:
-                        response_raw = await asyncio.wait_for(websocket.recv(), timeout=ping_delay.seconds)
-                    except asyncio.TimeoutError:
-                        # If timeout, ping server
-                        await websocket.send('{"type": "PING"}')
-                        try:
-                            await asyncio.wait_for(websocket.recv(), timeout=5)
-                            # Update last ping time
-                            last_ping = datetime.now()
-                        except asyncio.TimeoutError:
-                            break # If no response from server, reconnection is needed
-                        continue # If we get a response, ping was successful, return to listening
-                    except websockets.exceptions.ConnectionClosedError as ex:
-                        logmsg(f'ConnectionClosedError: {ex}')
-                        continue
-                    except Exception as ex:
-                        logmsg(f'Unexpected asyncio error: {ex}')
-                        continue
-
-                    # Process response
-                    #logmsg("Message payload: " + response_raw)
-                    response = json.loads(response_raw)
-
-                    if response['type'] == 'MESSAGE':
-                        # Get the topic for this message
-                        topic   = response['data']['topic']
-                        message = json.loads(response['data']['message'])
-
-                        try:
-                            if topic.startswith(bits_topic_prefix):
-                                handleBitsMessage(message)
-                            elif topic.startswith(sub_topic_prefix):
-                                handleSubMessage(message)
-                            elif topic.startswith(points_topic_prefix):
-                                handlePointsMessage(message)
-                            elif topic.startswith(follow_topic):
-                                handleFollow(message)
-                            elif topic.startswith(follow_topic):
-                                handleFollow(message)
-                            elif topic.startswith(hype_train_topic):
-                                handleHypeTrain(message)
-                            elif topic.startswith(raid_topic_prefix):
-                                handleRaid(message)
-                            elif topic.startswith(polls_topic_prefix):
-                                handlePoll(message)
-                            elif topic.startswith(community_points_prefix):
-                                logmsg(f'COMMUNITY POINTS: {response_raw}')
-                            else:
-                                logmsg(f'UNHANDLED MESSAGE: {response_raw}')
-                        except Exception as ex:
-                            logmsg(f'Unexpected error handling message: {ex}')
-                            logmsf(traceback.format_exc())
-                            continue
-
-                    elif response['type'] == "RECONNECT":
-                        # Do reconnect if requested
-                        logmsg(create_debug_message('PubSub Reconnect requested, complying'))
-                        break
-            else:
-                logmsg(create_debug_message('PubSub Error! ' + response['error']))
-                logmsg('PubSub Error! ' + response['error'])
-            logmsg(create_debug_message('PubSub Disconnected'))
-            logmsg('PubSub Disconnected')
-        
-        await asyncio.sleep(reconnect_timeout)
-        reconnect_timeout += reconnect_timeout # Exponential timeout
-
-def handleFollow(message):
-    #logmsg("RAWFOLLOW: " + json.dumps(message))
-    follow = {
-        'username': message['username'],
-        'userid': message['user_id']
+    # Never run: the journal keeps it from being replayed, the viewer is told why and channel
+    # points are given back where Twitch lets us (bits can't be, so nothing is promised)
+    wait = math.ceil(wait)
+    journal.skipped(eid, f'throttled for {wait}s')
+    logmsg('THROTTLED %s by %s: refunded, %ss to go', kind, user, wait)
+    if kind == 'points':
+        what = f'"{event.reward}"'
+        msg = throttle.message or '@{user} {what} can be used again in {wait}s'
+    else:
+        what = f'{kind.capitalize()} rewards'
+        msg = throttle.message or '@{user} {what} are on cooldown for another {wait}s, this one was skipped'
+    say(msg.format(user=user, what=what, wait=wait), ctx.chat)
+    if kind == 'points' and ctx.client_id:
+        asyncio.ensure_future(cancelRedemption(ctx, event))
+
+# Cancelling a redemption returns its points, only possible for rewards made by our client id
+async def cancelRedemption(ctx, redemption):
+    path = (helix.path.rstrip('/') + f'/channel_points/custom_rewards/redemptions?id={redemption.redemption_id}'
+            f'&broadcaster_id={ctx.channel_id}&reward_id={redemption.reward_id}')
+    headers = {
+        'Authorization': 'Bearer ' + ctx.auth_token.replace('oauth:', '', 1),
+        'Client-Id': ctx.client_id,
+        'Content-Type': 'application/json',
     }
+    try:
+        status, body = await helix.request('PATCH', path, b'{"status": "CANCELED"}', headers)
+    except (OSError, asyncio.TimeoutError, HttpError) as ex:
+        status, body = None, str(ex)
+    if status != 200:
+        logmsg('Unable to refund redemption %s: %s %r', redemption.redemption_id, status, body[:200])
+
+# Re-run a journaled event (startup replay and ?redo). The startup replay is throttled
+# like live events, ?redo (a mod's call) isn't.
+def replayEvent(entry, throttle = False):
+    ctx   = channelsById.get(entry.channel_id)
+    route = topicHandlers.get(entry.topic)
+    if ctx is None or route is None or route[4] is None:
+        logmsg('Unable to replay event %s: unknown channel or topic', entry)
+        return False
+    handler, event, keyed, rawtag, eventkey, burstkey = route
+    event = decodeEvent(entry.topic, event, entry.payload)
+    if event is None:
+        return False
+    key = entry.topic + '.' + entry.channel_id if keyed else None
+    if burstkey is not None:
+        event = [event]
+    elif throttle:
+        msgid, kind, user = eventkey(event)
+        if not admitThrottled(ctx, handler, key, kind, user, event, entry.id):
+            return True
+    dispatcher.submit(handler, ctx, event, [entry.id], key=key)
+    return True
+
+# Book the runs that completed before this start into the throttles (deferred events that
+# were waiting are replayed after them, so they still wait their turn)
+def seedThrottles():
+    ttl = max((throttle.ttl for ctx in channels for throttle in ctx.throttles.values()), default=0)
+    if not ttl:
+        return
+    offset = time.monotonic() - time.time()
+    for entry in journal.finished(ttl):
+        ctx   = channelsById.get(entry.channel_id)
+        route = topicHandlers.get(entry.topic)
+        if ctx is None or route is None or route[4] is None or route[5] is not None:
+            continue
+        event = decodeEvent(entry.topic, route[1], entry.payload)
+        if event is None:
+            continue
+        msgid, kind, user = route[4](event)
+        throttle = eventThrottle(ctx, kind, event)
+        if throttle is not None:
+            throttle.seed(event.user_id or user.lower(), entry.updated + offset)
+
+# Open a connection to each RCON server up front so the first reward doesn't wait for it
+async def warmRcon():
+    async def warm(queue):
+        try:
+            conn = await queue.pool.acquire()
+            await queue.pool.release(conn)
+        except Exception as ex:
+            logmsg('Unable to connect to RCON %s:%s: %s', queue.pool.host, queue.pool.port, ex)
+    await asyncio.gather(*(warm(queue) for queue in commandqueues))
+
+# entries: the journal's unfinished events from before this start (see startBotServices)
+async def replayJournal(entries):
+    await warmRcon()
+    if entries:
+        logmsg('Replaying %s unfinished event(s) from the journal', len(entries))
+    for entry in entries:
+        logmsg('Replaying %s %s by %s (state %s, %s attempts)', entry.kind, entry.msgid, entry.user, entry.state, entry.attempts)
+        replayEvent(entry, throttle=True)
+
+# Twitch event transport: legacy PubSub topics or EventSub WebSocket subscriptions ("transport"
+# in the config, see transport.py). EventSub is only imported when it's used.
+def transportClass():
+    if config.get('transport', 'pubsub') == 'eventsub':
+        from eventsub import EventSubTransport
+        return EventSubTransport
+    return PubSubTransport
+
+# Serves one shard of channels (see shardChannels) on its own socket
+async def eventConnect(cls, shard):
+    transport = cls(shard, list(topicHandlers), routeEvent, config)
+    logmsg("Connecting to Twitch %s...", transport.name)
+    await transport.run()
+
+# Process an event from a transport: handlers run on the dispatcher workers, this only
+# decodes and enqueues
+def routeEvent(channel_id, prefix, raw, message = None):
+    pubsub_messages.labels(prefix).inc()
+
+    route = topicHandlers.get(prefix)
+    ctx   = channelsById.get(channel_id)
+    if route is None or ctx is None:
+        logmsg('UNHANDLED MESSAGE: %s.%s %s', prefix, channel_id, raw)
+        return
+    handler, event, keyed, rawtag, eventkey, burstkey = route
+
+    if rawtag:
+        logmsg('%s: %s', rawtag, raw)
+    if handler is None:
+        return
+
+    # Decoded into the topic's event type (see events.py), invalid payloads are dropped here
+    decode_start = time.perf_counter()
+    event = decodeEvent(prefix, event, raw, message)
+    pubsub_decode.observe(time.perf_counter() - decode_start)
+    if event is None:
+        return
+
+    # Stateful topics are keyed so their events stay in order.
+    topic = prefix + '.' + channel_id
+    if eventkey is None:
+        dispatcher.submit(handler, ctx, event, key=topic if keyed else None)
+        return
+
+    # Paid events are journaled first, repeated deliveries are dropped here
+    msgid, kind, user = eventkey(event)
+    eid = journal.record(msgid, ctx.channel_id, prefix, kind, user, raw)
+    if eid is None:
+        pubsub_duplicates.inc()
+        logmsg('DUPLICATE %s: %s', kind, msgid)
+        return
+    if burstkey is None:
+        # Cooldowns/quotas can hold it back (gift bombs and subs aren't throttled)
+        if admitThrottled(ctx, handler, topic if keyed else None, kind, user, event, eid):
+            dispatcher.submit(handler, ctx, event, [eid], key=topic if keyed else None)
+        return
 
-    username = follow['username']
-    userid   = follow['userid']
-    logmsg(f'Follow: {username} ({userid})')
-
-def updateHypeTrain(progress):
-    hypetrain['level'] = int(progress['level']['value'])
-    hypetrain['value'] = int(progress['value'])
-    hypetrain['goal']  = int(progress['goal'])
-    hypetrain['total'] = int(progress['total'])
-    hypetrain['perc']  = floor((int(progress['value']) / int(progress['goal'])) * 100)
-    logmsg("UPDATEHYPE: " + json.dumps(hypetrain))
-    return hypetrain
-
-def handleHypeTrain(message):
-    logmsg("RAWHYPE: " + json.dumps(message))
-    htype = message['type']
-
-    if 'data' in message:
-        data = message['data']
+    # Bursts (eg. gift bombs) are collected and handled as one batch
+    bkey = burstkey(event)
+    submitBurst = functools.partial(dispatchBurst, handler, ctx, topic if keyed else None)
+    if bkey is None:
+        submitBurst([(event, eid)])
     else:
-        data = {}
+        bursts.add((ctx.channel_id, prefix, bkey), (event, eid), submitBurst)
+
+@pubsubTopic('following', FollowEvent)
+async def handleFollow(ctx, follow):
+    logmsg('Follow: #%s %s (%s)', ctx.chat, follow.username, follow.user_id)
+
+def saveHypeTrain(ctx):
+    journal.saveState('hypetrain.' + ctx.channel_id, dumps(ctx.hypetrain.snapshot()))
+
+@pubsubTopic('hype-train-events-v1', HypeTrainEvent, keyed=True, rawtag='RAWHYPE')
+async def handleHypeTrain(ctx, event):
+    htype = event.type
+    train = ctx.hypetrain
 
     if htype == 'hype-train-start':
         # Start of a hype train
-        time.sleep(0.8)
         logmsg(f'HypeTrainStart: ...')
-        updateHypeTrain(data['progress'])
-        chatbot.say('/me CurseLit CurseLit CurseLit CurseLit CurseLit CurseLit')
-        chatbot.say('/me ~ The HYPE TRAIN has arrived ~')
-        chatbot.say('/me CurseLit CurseLit CurseLit CurseLit CurseLit CurseLit')
+        train.start(event.progress)
+        say('/me CurseLit CurseLit CurseLit CurseLit CurseLit CurseLit', ctx.chat)
+        say('/me ~ The HYPE TRAIN has arrived ~', ctx.chat)
+        say('/me CurseLit CurseLit CurseLit CurseLit CurseLit CurseLit', ctx.chat)
 
     elif htype == 'hype-train-progression':
         # Each time the hype train progresses
-        time.sleep(0.2)
-        progress = updateHypeTrain(data['progress'])
-        logmsg(f'HypeTrainProgress: Level {progress["level"]} - {progress["value"]}/{progress["goal"]} ({progress["perc"]}%)')
+        train.update(event.progress, event.user)
+        logmsg('HypeTrainProgress: Level %s - %s/%s (%s%%)', train.level, train.value, train.goal, train.perc)
 
     elif htype == 'hype-train-level-up':
         # Each time the hype train levels up
-        time.sleep(0.8)
-        progress = updateHypeTrain(data['progress'])
-        oldlevel = int(progress["level"]) - 1
+        train.update(event.progress)
+        oldlevel = train.level - 1
+
+        logmsg(f'HypeTrainLevelUp: New level: {train.level} / Goal: {train.goal}')
+        say(f'/me Hype Train level {oldlevel} completed! PogChamp', ctx.chat)
+        say(f'/me PowerUpL Now on level {train.level} PowerUpR', ctx.chat)
 
-        logmsg(f'HypeTrainLevelUp: New level: {progress["level"]} / Goal: {progress["goal"]}')
-        chatbot.say(f'/me Hype Train level {oldlevel} completed! PogChamp')
-        chatbot.say(f'/me PowerUpL Now on level {progress["level"]} PowerUpR')
+    elif htype == 'hype-train-conductor-update':
+        train.conductor(event.source, event.user)
+        logmsg('HypeTrainConductor: %s %s', event.source, event.user)
 
     elif htype == 'hype-train-end':
         # When the hype train ends, it doesnt give much info so we will have to rely on
         # stored information collected from the progression updates and level ups
-        time.sleep(0.8)
-        reason = data['ending_reason']
+        # (restored from the last snapshot if we were restarted part way through)
+        reason = event.reason
+        train.end()
         logmsg(f'HypeTrainEnd: {reason}')
-        if reason == 'COMPLETED' and hypetrain['level'] >= 5 and hypetrain['perc'] >= 100:
-            chatbot.say('/me PogChamp PogChamp Level 5 Hype train COMPLETED!!! PogChamp PogChamp')
-            chatbot.say('/me artful5Hugs Thank you for your support artful5Hugs')
+        logmsg('HypeTrainTop: %s', ', '.join(f'{user} ({points})' for user, points in train.top()))
+        if reason == 'COMPLETED' and train.level >= 5 and train.perc >= 100:
+            say('/me PogChamp PogChamp Level 5 Hype train COMPLETED!!! PogChamp PogChamp', ctx.chat)
+            say('/me artful5Hugs Thank you for your support artful5Hugs', ctx.chat)
         else:
-            chatbot.say(f'/me CurseLit Hype train has ended on level {hypetrain["level"]} CurseLit')
-            chatbot.say('/me artful5Hugs Thank you for your support artful5Hugs')
+            say(f'/me CurseLit Hype train has ended on level {train.level} CurseLit', ctx.chat)
+            say('/me artful5Hugs Thank you for your support artful5Hugs', ctx.chat)
+        if train.conductors:
+            say('/me Conductors: ' + ', '.join(f'{user} ({source.lower()})' for source, user in train.conductors.items()), ctx.chat)
 
-def handleRaid(message):
-    logmsg("RAWRAID: " + json.dumps(message))
-
-def handlePoll(message):
-    logmsg("RAWPOLL: " + json.dumps(message))
+    else:
+        return
 
-    if message['type'] == 'POLL_COMPLETE':
-        poll = message['data']['poll']
-        title = poll['title']
-        choices = poll['choices']
-        winners = []
+    logmsg('UPDATEHYPE: level %s %s/%s total %s (%s%%)', train.level, train.value, train.goal, train.total, train.perc)
+    saveHypeTrain(ctx)
+
+@pubsubTopic('raid', RaidEvent, rawtag='RAWRAID')
+async def handleRaid(ctx, raid):
+    # Nothing to do yet, the raw payload is logged by the receive loop
+    pass
+
+@pubsubTopic('polls', PollEvent, keyed=True, rawtag='RAWPOLL')
+async def handlePoll(ctx, poll):
+    mtype = poll.type
+
+    # Tallies are kept per poll id for as long as the poll runs
+    tally = ctx.polls.get(poll.poll_id)
+    if tally is None:
+        tally = ctx.polls[poll.poll_id] = PollTally(poll.poll_id)
+    tally.update(poll)
+
+    if mtype == 'POLL_UPDATE':
+        # Optional in game progress, at most once every polltitles seconds
+        interval = config.get('polltitles', 0)
+        if interval and tally.total and tally.due(interval):
+            name, votes = tally.top()[0]
+            title = tally.title.replace('"', "'")
+            sub = f'{name} leads with {votes} votes ({votes * 100 // tally.total}%)'.replace('"', "'")
+            sendRconCommands(ctx, [ctx.mc.title(title, sub, 'gold', 'yellow')])
+
+    elif mtype == 'POLL_COMPLETE':
+        del ctx.polls[poll.poll_id]
+        title = tally.title
+        maxvotes = tally.maxvotes
+        winners = tally.winners()
 
         logmsg(f'Poll title: {title}')
+        for cid, votes in tally.votes.items():
+            logmsg(f'  - {tally.names[cid]} = {votes}')
 
-        # First get the max vote count
-        maxvotes = 0
-        for choice in choices:
-            entry = choice['title']
-            votes = choice['votes']['total']
-            logmsg(f'  - {entry} = {votes}')
-            if votes > maxvotes:
-                maxvotes = votes
-
-        # Get the winning choice(s)
-        for choice in choices:
-            entry = choice['title']
-            votes = choice['votes']['total']
-            if votes == maxvotes:
-                winners.append(entry)
-
-        chatbot.say(f'/me Poll ended: "{title}"')
+        say(f'/me Poll ended: "{title}"', ctx.chat)
         if len(winners) > 1:
-            chatbot.say('/me NotLikeThis Results are tied!')
+            say('/me NotLikeThis Results are tied!', ctx.chat)
         else:
-            chatbot.say('/me FBtouchdown The winner was:')
+            say('/me FBtouchdown The winner was:', ctx.chat)
 
         for name in winners:
-            chatbot.say(f'/me PorscheWIN {name} ({maxvotes} votes)')
+            say(f'/me PorscheWIN {name} ({maxvotes} votes)', ctx.chat)
+
+    elif mtype in ('POLL_TERMINATE', 'POLL_ARCHIVE'):
+        ctx.polls.pop(poll.poll_id, None)
 
-def handleBitsMessage(message):
+def bitsEventKey(cheer):
+    return cheer.message_id, 'cheer', cheer.user
+
+@pubsubTopic('channel-bits-events-v2', BitsEvent, eventkey=bitsEventKey)
+async def handleBitsMessage(ctx, cheer):
     # Do bits message
-    #logmsg("RAWBIT: " + json.dumps(message))
-    if message['data']['context'] == 'cheer':
-        cheer = message['data']
-        msg = {
-            'bits': {
-                'bits_used': cheer['bits_used'],
-                'chat_message': cheer['chat_message'],
-                'user_name': cheer['user_name'],
-                'timestamp': cheer['time']
-            }
-        }
-        if msg['bits']['user_name'] is None or msg['bits']['user_name'] == '':
-            msg['bits']['user_name'] = 'Anonymous'
-
-        logmsg(json.dumps(msg))
-        bits  = msg['bits']['bits_used']
-        rwho  = msg['bits']['user_name']
+    if cheer.context == 'cheer':
+        logmsg('%s', cheer)
+        bits  = cheer.bits
+        rwho  = cheer.user
         cubes = 0
 
         # Do the chance cube thing if necessary
-        if 'chancecubes' in _mcmodes:
+        if 'chancecubes' in ctx.mcmodes:
             cost  = 100
             cubes = int(bits/cost)
 
-        if 'mobs' in _mcmodes:
+        if 'mobs' in ctx.mcmodes:
             cost  = 85
-            maxmobs = int(bits/cost)+1
+            maxmobs = ctx.mobs(int(bits/cost)+1)    # fewer while the server is lagging
             logmsg(f'Max mobs selected: {maxmobs}')
 
         # Do we spawn mobs?
         age = ''
         mob = ''
-        if 'mobs' in _mcmodes:
+        if 'mobs' in ctx.mcmodes:
             # Increase hostile chance with more bits
             # Rules:
             #   <100 bits does not increase chance
@@ -335,10 +533,10 @@ def handleBitsMessage(message):
             passivechance = 3
 
             if bits >= minbits:
-                # Select a mob to spawn if necessary
-                mobs = pickMob(passivechance, hostilechance, bits)
-                mob = random.choice(mobs)
-                if any(x in ('vanilla', 'spigot') for x in _mcmodes):
+                # Select the mobs to spawn if necessary (chance cubes come with just the one)
+                mobs = ctx.mobsampler.draw(passivechance, hostilechance, 1 if cubes else maxmobs)
+                mob = mobs[0] if mobs else ''
+                if any(x in ('vanilla', 'spigot') for x in ctx.mcmodes):
                     age = '-99999999'
 
                 # Pick a random colour for the mob name
@@ -347,650 +545,373 @@ def handleBitsMessage(message):
             if cubes and cubes > 0:
                 logmsg(f'Bit reward: {cubes}x Chance cubes (by {rwho})')
                 cmds = [
-                    mcTitle(f'{cubes}x Chance Cubes!!!', f'Given by {rwho}', 'blue', 'red'),
-                    mcCmd(f'give ArtfulMelody chancecubes:chance_cube {cubes}'),
-                    mcEffect('minecraft:nausea', 5, 1),
-                    mcEffect('tombstone:ghostly_shape', 5, 1),
+                    ctx.mc.title(f'{cubes}x Chance Cubes!!!', f'Given by {rwho}', 'blue', 'red'),
+                    ctx.mc.cmd(f'give {ctx.mc.player} chancecubes:chance_cube {cubes}'),
+                    ctx.mc.effect('minecraft:nausea', 5, 1),
+                    ctx.mc.effect('tombstone:ghostly_shape', 5, 1),
                 ]
                 if mob:
-                    cmds.append(mcSummon(mob, age, 1, '§'+ncolour+rwho))
+                    cmds.append(ctx.mc.summon(mob, age, 1, '§'+ncolour+rwho))
 
-                sendRconCommands(cmds)
+                sendRconCommands(ctx, cmds)
             elif mob and bits >= minbits:
                 logmsg(f'Bit reward: Spawning {mob} (by {rwho})')
                 cmds = [
-                    mcTitle(f'New buddy!', f'Given by {rwho}', 'yellow', 'red'),
-                    mcEffect('minecraft:nausea', 5, 1),
+                    ctx.mc.title(f'New buddy!', f'Given by {rwho}', 'yellow', 'red'),
+                    ctx.mc.effect('minecraft:nausea', 5, 1),
                 ]
 
                 # number of mobs based on amount
-                for x in range(0, maxmobs):
-                    cmds.append(mcSummon(mob, age, 1, '§'+ncolour+rwho))
+                for mob in mobs:
+                    cmds.append(ctx.mc.summon(mob, age, 1, '§'+ncolour+rwho))
                     ncolour = random.choice(namecolours)
-                    mob = random.choice(mobs)
-
-                sendRconCommands(cmds)
-
-def handleSubMessage(message):
-    # So sub message
-    logmsg("RAWSUB: " + json.dumps(message))
-    msg = {
-        'sub': {
-            'user_name': '',
-            'timestamp': message['time'],
-            'sub_plan': message['sub_plan'],
-            'months': message['months'],
-            'context': message['context'],
-            'message': message['sub_message']['message'],
-            'from_user': ''
-        }
-    }
 
-    sub = msg['sub']
-    if sub['context'] == 'anonsubgift':
-        sub['user_name'] = message['recipient_display_name']
-        sub['from_user'] = 'Anonymous Gifter'
-        rwho = sub['from_user']
-    elif sub['context'] == 'subgift':
-        sub['user_name'] = message['recipient_display_name']
-        sub['from_user'] = message['display_name']
-        rwho = sub['from_user']
-    else:
-        sub['user_name'] = message['display_name']
-        rwho = sub['user_name']
+                sendRconCommands(ctx, cmds)
+
+# PubSub sub events carry no message id, so one is made up from what identifies the sub
+def subEventKey(sub):
+    msgid = sub.message_id or ':'.join(str(v or '') for v in (sub.user_id, sub.user, sub.recipient_id, sub.recipient, sub.context, sub.time))
+    return msgid, 'gift' if sub.gift else 'sub', sub.user or 'Anonymous Gifter'
+
+# Gifts from one gifter (of the same length) arriving together are one gift bomb
+def subBurstKey(sub):
+    if not sub.gift:
+        return None
+    return sub.user_id or sub.user, sub.context, sub.duration
+
+@pubsubTopic('channel-subscribe-events-v1', SubEvent, rawtag='RAWSUB', eventkey=subEventKey, burstkey=subBurstKey)
+async def handleSubMessage(ctx, subs):
+    # So sub event(s), several for a gift bomb
+    recipients = []
+    for sub in subs:
+        if sub.context == 'anonsubgift':
+            rwho = 'Anonymous Gifter'
+        elif sub.context == 'subgift':
+            rwho = sub.user
+            # Not known for gifts received over EventSub
+            if sub.recipient:
+                recipients.append(sub.recipient)
+        else:
+            rwho = sub.user
+
+        logmsg('%s', sub)
 
-    logmsg(json.dumps(msg))
+    gifts = len(subs)
+    if gifts > 1:
+        logmsg(f'Gift bomb: {gifts} subs from {rwho}')
 
     # Do we spawn mobs?
-    if 'mobs' in _mcmodes:
+    if 'mobs' in ctx.mcmodes:
         hostilechance = 2
         passivechance = 3
-        mobs = pickMob(passivechance, hostilechance, 0, 1)
-        mob = random.choice(mobs)
+        # One mob for the subscriber and one per gift receiver (up to giftmobs for a bomb)
+        recipients = recipients[:ctx.mobs(config.get('giftmobs', 5))]
+        mob, *giftmobs = ctx.mobsampler.draw(passivechance, hostilechance, 1 + len(recipients), sub=True)
 
         age = ''
-        if 'vanilla' in _mcmodes:
+        if 'vanilla' in ctx.mcmodes:
             age = '-99999999'
 
         # Pick a random colour for the mob name
         namecolours = 'abcde96'
         ncolour = random.choice(namecolours)
 
-        if 'chancecubes' in _mcmodes:
-            logmsg(f'Sub reward: Giant chance cube (by {rwho})')
+        cmds = []
+        if 'chancecubes' in ctx.mcmodes:
+            logmsg(f'Sub reward: {gifts}x Giant chance cube (by {rwho})')
             cmds = [
-                mcTitle(f'Giant Chance Cube!', f'Thanks to {rwho}', 'green', 'red'),
-                mcCmd(f'give ArtfulMelody chancecubes:compact_giant_chance_cube 1'),
-                mcEffect('minecraft:nausea', 5, 1),
-                mcEffect('tombstone:ghostly_shape', 5, 1),
+                ctx.mc.title(f'{gifts}x Giant Chance Cubes!' if gifts > 1 else 'Giant Chance Cube!', f'Thanks to {rwho}', 'green', 'red'),
+                ctx.mc.cmd(f'give {ctx.mc.player} chancecubes:compact_giant_chance_cube {gifts}'),
+                ctx.mc.effect('minecraft:nausea', 5, 1),
+                ctx.mc.effect('tombstone:ghostly_shape', 5, 1),
             ]
 
             if mob:
-                cmds.append(mcSummon(mob, age, 1, '§'+ncolour+rwho))
-                # Also make a mob for the gift receiver
-                if sub['context'] == 'subgift':
-                    mob = random.choice(mobs)
-                    cmds.append(mcSummon(mob, age, 1, '§'+ncolour+sub['user_name']))
+                cmds.append(ctx.mc.summon(mob, age, 1, '§'+ncolour+rwho))
+                # Also make a mob for the gift receivers
+                for giftmob, recipient in zip(giftmobs, recipients):
+                    cmds.append(ctx.mc.summon(giftmob, age, 1, '§'+ncolour+recipient))
 
-        elif 'mobs' in _mcmodes and mob:
+        elif 'mobs' in ctx.mcmodes and mob:
             logmsg(f'Sub reward: Spawning {mob} (by {rwho})')
             cmds = [
-                mcTitle(f'New buddy!', f'Given by {rwho}', 'yellow', 'red'),
-                mcEffect('minecraft:nausea', 5, 1),
-                mcSummon(mob, age, 1, '§'+ncolour+rwho),
+                ctx.mc.title(f'{gifts} new buddies!' if gifts > 1 else 'New buddy!', f'Given by {rwho}', 'yellow', 'red'),
+                ctx.mc.effect('minecraft:nausea', 5, 1),
+                ctx.mc.summon(mob, age, 1, '§'+ncolour+rwho),
             ]
 
-            # Also make a mob for the gift receiver
-            if sub['context'] == 'subgift':
-                mob = random.choice(mobs)
-                cmds.append(mcSummon(mob, age, 1, '§'+ncolour+sub['user_name']))
+            # Also make a mob for the gift receivers
+            for giftmob, recipient in zip(giftmobs, recipients):
+                cmds.append(ctx.mc.summon(giftmob, age, 1, '§'+ncolour+recipient))
 
         # Execute the set of commands
-        sendRconCommands(cmds)
+        # (pacing to avoid killing the server is handled by the command queue)
+        sendRconCommands(ctx, cmds)
 
-        # Invoke a small delay to avoid killing the server with commands
-        # Since gift subs tend to be in batches, we sleep a little more between them
-        if sub['context'] == 'subgift' or sub['context'] == 'anonsubgift':
-            time.sleep(0.3)
-        else:
-            time.sleep(0.1)
+# Community points are only logged for now
+topicHandlers['community-points-channel-v1'] = (None, None, False, 'COMMUNITY POINTS', None, None)
 
-def handlePointsMessage(data):
-    message = data['data']
-    #logmsg(message)
+def pointsEventKey(redemption):
+    return redemption.redemption_id, 'points', redemption.user
 
+@pubsubTopic('channel-points-channel-v1', PointsEvent, eventkey=pointsEventKey)
+async def handlePointsMessage(ctx, redemption):
     # Do reward points message
-    reward = message['redemption']['reward']
-    msg = {
-        'reward': {
-            'timestamp': message['timestamp'],
-            'user_name': message['redemption']['user']['display_name'],
-            'reward_name': reward['title'],
-            'image': reward['default_image'],
-            'user_input': ''
-        }
-    }
+    rtype = redemption.reward
+    rwho  = redemption.user
 
-    if reward['is_user_input_required']:
-        msg['reward']['user_input'] = message['redemption']['user_input']
-
-    #logmsg(json.dumps(msg))
-
-    rtype = msg['reward']['reward_name']
-    rwho  = msg['reward']['user_name']
-
-    if rtype.startswith('Drop/Destroy it'):
-        # Destroy item in hand
-        logmsg(f'Reward: Destroy item (by {rwho})')
-        cmds = [
-            mcTitle('Item Destroyed!!', f'Evil deed done by {rwho}', 'red', 'yellow'),
-            mcCmd('replaceitem entity ArtfulMelody weapon.mainhand minecraft:air'),
-            mcEffect('minecraft:nausea', 5, 1),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Pumpkin'):
-        # Give pumpkin mask (remove current headwear first)
-        logmsg(f'Reward: WIP - Pumpkin mask (by {rwho})')
-        cmds = [
-            mcTitle('Pumpkin Mask Time!', f'Requested by {rwho}', 'gold', 'yellow'),
-            mcEffect('minecraft:nausea', 5, 1),
-            mcGive('minecraft:carved_pumpkin', 1),
-            mcEffect('minecraft:nausea', 5, 1),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Sticky Feet'):
-        # Give very high slowness effect
-        logmsg(f'Reward: Sticky feet (by {rwho})')
-        cmds = [
-            mcTitle('You have Sticky Feet!', f'{rwho} put glue on your boots', 'dark_purple', 'yellow'),
-            mcEffect('minecraft:slowness', 30, 20),
-            mcEffect('minecraft:nausea', 5, 1),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Encase in ice'):
-        # Give very high slowness effect
-        logmsg(f'Reward: {rtype} (by {rwho})')
-        cmds = [
-            mcTitle('Encased in ice!', f'Made cool by {rwho}', 'blue', 'yellow'),
-            mcEffect('minecraft:nausea', 5, 1),
-            mcEffect('mowziesmobs:frozen', 20, 1),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Hype Mode'):
-        logmsg(f'Reward: {rtype} (by {rwho})')
-        cmds = [
-            mcTitle('Hype Mode Engaged!!', f'{rwho} wants a party!', 'light_purple', 'yellow'),
-            mcEffect('minecraft:nausea', 5, 1),
-            mcEffect('minecraft:jump_boost', 30, 3),
-            mcEffect('cyclicmagic:potion.bounce', 30, 3),
-            mcEffect('minecraft:speed', 30, 3),
-            mcEffect('minecraft:night_vision', 30, 1),
-            mcEffect('trailmix:trailmix', 30, 1),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Who turned off the lights'):
-        logmsg(f'Reward: {rtype} (by {rwho})')
-        cmds = [
-            mcTitle('Who turned off the lights?!', f'(psst.. it was {rwho})', 'red', 'yellow'),
-            mcEffect('minecraft:nausea', 5, 1),
-            mcEffect('minecraft:blindness', 30, 1),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Get Confuzzled'):
-        logmsg(f'Reward: {rtype} (by {rwho})')
-        cmds = [
-            mcTitle('You are confuzzled!', f'(blame {rwho})', 'red', 'yellow'),
-            mcEffect('minecraft:nausea', 7, 1),
-            mcEffect('quark:danger_sight', 30, 1),
-            mcEffect('midnight:confusion', 30, 1),
-            mcEffect('cyclicmagic:potion.butter', 30, 2),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Bring on the night'):
-        logmsg(f'Reward: {rtype} (by {rwho})')
-        cmds = [
-            mcTitle('There will be night!', f'{rwho} likes the night life...', 'red', 'yellow'),
-            mcEffect('minecraft:nausea', 5, 1),
-            mcCmd(f'time set night'),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Daytime is good'):
-        logmsg(f'Reward: {rtype} (by {rwho})')
-        cmds = [
-            mcTitle('Let there be light!', f'{rwho} said so...', 'yellow', 'white'),
-            mcCmd(f'time set day'),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('This is Australia'):
-        logmsg(f'Reward: {rtype} (by {rwho})')
-        cmds = [
-            mcTitle('Australia is real!', f'{rwho} has proof!', 'blue', 'red', 20, 300, 40),
-            mcEffect('minecraft:nausea', 7, 1),
-            mcEffect('randomthings:collapse', 20, 1),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Healing Save'):
-        # Give Regen + Fire Resistance
-        logmsg(f'Reward: Healing save (by {rwho})')
-        cmds = [
-            mcTitle('Healing Save!!', f'Apparently {rwho} is nice', 'green', 'yellow'),
-            mcEffect('minecraft:regeneration', 45, 1),
-            mcEffect('minecraft:fire_resistance', 45, 1),
-            mcEffect('minecraft:resistance', 45, 1),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('No sleep tonight'):
-        # No sleep
-        logmsg(f'Reward: No sleep tonight (by {rwho})')
-        cmds = [
-            mcTitle('No Sleep!', f'Requested by {rwho}', 'red', 'yellow'),
-            mcEffect('minecraft:nausea', 5, 1),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Free lunch'):
-        logmsg(f'Reward: Free lunch')
-        cmds = [
-            mcTitle('Free Lunch!', f'Given by {rwho}', 'green', 'yellow'),
-            mcEffect('minecraft:nausea', 5, 1),
-            mcGive('minecraft:cooked_beef', 5),
-            mcGive('minecraft:baked_potato', 5),
-            mcGive('minecraft:pumpkin_pie', 2),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Wink'):
-        logmsg(f'Reward: Wink')
-        cmds = [
-            mcTitle('Wink!', f'Requested by {rwho}', 'light_purple', 'white'),
-            mcEffect('minecraft:nausea', 5, 1),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Make Me Dab'):
-        logmsg(f'Reward: Make Me Dab')
-        cmds = [
-            mcTitle('Stop! Dabbing time!', f'Requested by {rwho}', 'yellow', 'white'),
-            mcEffect('minecraft:nausea', 5, 1),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Posture Check'):
-        logmsg(f'Reward: Posture Check')
-        cmds = [
-            mcTitle('Check that posture!', f'Requested by {rwho}', 'gold', 'white'),
-            mcEffect('minecraft:nausea', 5, 1),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Yo, drink some'):
-        logmsg(f'Reward: Drink some water')
-        cmds = [
-            mcTitle('Hydrate!', f'{rwho} splashed some water on you', 'aqua', 'white'),
-            mcEffect('minecraft:nausea', 5, 1),
-            mcParticle('splash', 1, 1000),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Craft a damn shovel'):
-        logmsg(f'Reward: Craft a damn shovel')
-        cmds = [
-            mcTitle('Shovel it!', f'Requested by {rwho}', 'green', 'white'),
-            mcEffect('minecraft:nausea', 5, 1),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('Spawn something bad'):
-        logmsg(f'Reward: Spawn something bad')
-        mobs = pickMob(0, 1, 0)
-        mob = random.choice(mobs)
-        ncolour = random.choice('abcde96')
-
-        cmds = [
-            mcTitle('Bad mob for you!', f'You can thank {rwho}', 'red', 'white'),
-            mcEffect('minecraft:nausea', 5, 1),
-            mcSummon(mob, '', 1, '§'+ncolour+rwho),
-        ]
-        sendRconCommands(cmds)
-    elif rtype.startswith('BOOO'):
-        # Scary in game message/sound
-        logmsg(f'Reward: BOOOO (by {rwho})')
-        sounds = [
-            'minecraft:entity.ghast.hurt',
-            'minecraft:entity.ghast.scream',
-            'minecraft:entity.horse.death',
-            'minecraft:entity.wolf.howl',
-            'minecraft:entity.elder_guardian.curse',
-            'minecraft:entity.bat.takeoff',
-            'minecraft:entity.lightning.thunder',
-            'minecraft:entity.llama.death',
-            'minecraft:ambient.cave',
-            'minecraft:entity.donkey.death',
-        ]
-        sound1 = random.choice(sounds)
-        sound2 = random.choice(sounds)
-        sound3 = random.choice(sounds)
-        cmds = [
-            mcSound(sound1),
-            mcSound(sound2),
-            mcSound(sound3),
-            mcSound(sound2),
-            mcSound(sound1),
-            mcSound(sound3),
-            mcEffect('minecraft:nausea', 6, 1),
-            mcEffect('minecraft:blindness', 2, 1),
-            mcParticle('explosion_emitter', 7, 2),
-            mcTitle('BOOOOOOOOOOOO!!!!', f'Requested by {rwho}', 'red', 'gray', 5, 80, 20),
-        ]
-        sendRconCommands(cmds, 0.01)
-    elif rtype.startswith("Joke's On You"):
-        logmsg(f'Reward: Dad Joke')
-        stream = os.popen('curl --max-time 2 --retry 2 -s -H "Accept: application/json" https://icanhazdadjoke.com/')
-        result = stream.read()
-        logmsg(f'Dad Joke result: {result}')
-        if result:
-            data = json.loads(result)
-            if data['status'] == 200:
-                joke = data['joke']
-                chatbot.say(f'@ArtfulMelody - You must read this joke on stream:')
-                chatbot.say(f'@ArtfulMelody - {joke}')
-            else:
-                logmsg(f'Bad response: {result}')
-        else:
-            logmsg(f'No response received!')
-    else:
+    reward = ctx.rewards.lookup(rtype)
+    if reward is None:
         logmsg(f'Unknown reward: {rtype}')
-        logmsg('Full request: ' + json.dumps(msg))
-
-def sendRconCommands(cmds, delay = 0.03):
-    mcr = MCRcon("127.0.0.1", _rconPass, _rconPort, 0)
-
-    try:
-        mcr.connect()
-    except Exception as ex:
-        logmsg(f'ERROR: Unable to connect to rcon server: {ex}')
+        logmsg('Full request: %s', redemption)
         return
 
+    logmsg('Reward: %s (by %s)', reward.log or rtype, rwho)
+    if reward.action:
+        await rewardActions[reward.action](ctx, reward, rwho)
+    else:
+        sendRconCommands(ctx, [reward.render(rwho, ctx.mobsampler.pick)])
+
+async def rewardDadJoke(ctx, reward, rwho):
+    # Served from the prefetched cache, only hits the network if it has run dry
+    joke = await jokes.get()
+    logmsg(f'Dad Joke result: {joke}')
+    if joke:
+        say(f'@{ctx.player} - You must read this joke on stream:', ctx.chat)
+        say(f'@{ctx.player} - {joke}', ctx.chat)
+    else:
+        logmsg(f'No response received!')
+
+# Rewards that need code rather than a list of commands ("action" in the reward spec)
+rewardActions = {
+    'dadjoke': rewardDadJoke,
+}
+
+# Queue commands for the channel's RCON targets without waiting for them to be sent: a
+# backlog builds up in the command queues, where it is merged/dropped by priority, rather
+# than holding the dispatcher workers. A journaled handler's entries are finished once
+# its sends are (see journaled).
+def sendRconCommands(ctx, cmds):
+    send = background(sendRcon(ctx, cmds))
+    sends = _rconSends.get()
+    if sends is not None:
+        sends.append(send)
+    return send
+
+# Returns the error if no target got all the commands, else None
+async def sendRcon(ctx, cmds):
     # flatten all commands
     cmds = [item for sublist in cmds for item in sublist]
 
-    for cmd in cmds:
-        try:
-            resp = mcr.command(cmd)
-            logmsg(f'RCON Command: {cmd}: {resp}')
-            time.sleep(delay)
-        except Exception as ex:
-            logmsg(f'ERROR: Unable to send rcon command: {cmd}')
-            logmsg(f'       {ex}')
-            break
-
-    mcr.disconnect()
-
-def mcTitle(title, sub, tcolour, scolour, fadein = 20, delay = 100, fadeout = 40):
-    cmds = [
-        f'title ArtfulMelody times {fadein} {delay} {fadeout}',
-        f'title ArtfulMelody subtitle {{"text":"{sub}","color":"{scolour}"}}',
-        f'title ArtfulMelody title {{"text":"{title}","color":"{tcolour}"}}',
-    ]
-    return cmds
-
-def mcSound(sound, player = 'ArtfulMelody'):
-    if _mcver == '1.12':
-        cmd = f'execute {player} ~ ~ ~ /playsound {sound} master @s ~ ~ ~ 10'
-    else:
-        cmd = f'execute as {player} at {player} run playsound {sound} master @s'
-
-    return [ cmd ]
+    # Sent to every RCON target of the channel at once, each paced and prioritised by its
+    # server's command queue (see fanout.py)
+    sent = await fanout(ctx.targets, cmds)
+    failed = []
+    for target, tcmds, results in sent:
+        tag = f'[{target.name}] ' if len(sent) > 1 else ''
+        error = None
+        for cmd, resp in zip(tcmds, results):
+            if isinstance(resp, Exception):
+                logmsg('ERROR: %sUnable to send rcon command: %s', tag, cmd)
+                logmsg('       %s', resp)
+                error = error or resp
+            elif resp is None:
+                logmsg('%sRCON Command dropped (queue full): %s', tag, cmd)
+            else:
+                logmsg('%sRCON Command: %s: %s', tag, cmd, resp)
+        if error is not None:
+            failed.append(error)
+
+    # The event only counts as failed (for the journal) if no target got it all
+    if sent and len(failed) == len(sent):
+        return failed[0]
+    return None
+
+# Start everything at once: the PubSub sockets and the RCON warm up (followed by the journal
+# replay) are started first, then the bot framework is imported on a thread while they wait
+# on the network, and the IRC connection is started as soon as it has loaded.
+async def startBotServices():
+    global chatbot, _chatready
+    logmsg("Starting services...")
+    loop = asyncio.get_running_loop()
+    _chatready = asyncio.Event()
+    # Taken before any transport connects, so events arriving during the RCON warm up aren't replayed too
+    unfinished = journal.unfinished(config.get('journalreplay', 3600))
+    seedThrottles()
+    logmsg("Creating event transport tasks...")
+    transport = transportClass()
+    for shard in shardChannels(channels, transport.topics(topicHandlers), transport.limit):
+        loop.create_task(eventConnect(transport, shard)) # PubSub/EventSub WebSocket (one per 50 topics/300 subscriptions)
+    loop.create_task(replayJournal(unfinished)) # RCON warm up, then rewards that never completed last time
+    loop.create_task(jokes.prefetch()) # Dad joke cache
+    loop.create_task(monitorLoopLag()) # Event loop lag metrics
+    for pacer in pacers:
+        loop.create_task(pacer.run()) # RCON server load feedback
+    if config.get('metricsport'):
+        loop.create_task(serveMetrics(config['metricsport'])) # Prometheus endpoint
+    if config.get('metricslog', 300):
+        loop.create_task(logSnapshots(config.get('metricslog', 300))) # Periodic metric snapshots
+
+    await loop.run_in_executor(None, importlib.import_module, 'twitchbot')
+    logmsg("Creating chatbot task...")
+    chatbot = createChatBot()
+    _chatready.set()
+    loop.create_task(chatbot.run()) # ChatBot server
+    logmsg("Services started in %.2fs", time.perf_counter() - _launched)
+
+# The timestamp prefix and any %-formatting of args are done on the log thread
+_logtag = {'tag': '|'}
+def logmsg(msg: str, *args):
+    logging.info(msg, *args, extra=_logtag)
+
+# Chat from the handlers. Events are handled before the chat bot has loaded (see
+# startBotServices), so messages are queued straight away and held by the chat queue
+# until the bot is there to send them.
+_chattag = {'tag': '>'}
+def say(msg, channel):
+    logging.info('Sending #%s: %s', channel, msg, extra=_chattag)
+    chatqueue.put(channel, msg)
+
+_chatready = None
+async def sendChat(channel, msg):
+    if chatbot is None:
+        await _chatready.wait()
+    await chatbot.irc.send_privmsg(channel, msg)
+
+# The chat bot needs the bot framework, which is slow to import, so the class is only
+# defined once it's needed
+def createChatBot():
+    from twitchbot.bots import BaseBot
+    from twitchbot import Message, Channel, PollData, Command
+
+    # A supervisor worker only joins the chat channels of its own shard, so ?redo is answered
+    # once (the config is changed in memory only, cfg['channels'] = ... would save it)
+    if config.get('worker') is not None:
+        from twitchbot.config import cfg
+        cfg.data['channels'] = [ctx.chat for ctx in channels]
+
+    class ChatBot(BaseBot):
+        _logtag = {'tag': '>'}
+        def logmsg(self, msg: str, *args):
+            logging.info(msg, *args, extra=self._logtag)
+
+        def say(self, msg: str, channel = 'artfulmelody'):
+            say(msg, channel)
+
+        async def on_raw_message(self, RawMsg: Message):
+            msg = str(RawMsg)
+            if msg != 'PING':
+                logging.debug("Raw: '%s'", msg)
+                if '!test' in msg:
+                    self.logmsg('Test message received')
+                    #oldlevel=2
+
+        async def on_channel_joined(self, channel: Channel):
+            self.logmsg(f'Joined #{channel.name}')
+
+        async def on_privmsg_received(self, msg: Message):
+            # Handle viewer chat and bot chat separately
+            if 'streamlabs' in msg.author or 'yoghurtbot' in msg.author:
+                match = re.match(r'^(.*) just tipped (.*)$', msg.content)
+                if match:
+                    groups = match.groups()
+                    who    = g[0]
+                    amount = g[1]
+                    self.logmsg(f'[Tip] #{msg.channel.name} Tipper:{who} Amount:{amount}')
+                else:
+                    self.logmsg(f'[Bot] #{msg.channel.name} ({msg.author}) {msg.content}')
+            else:
+                self.logmsg(f'[Chat] #{msg.channel.name} ({msg.author}) {msg.content}')
 
-def mcEffect(effect, time, power, player = 'ArtfulMelody'):
-    if _mcver == '1.12':
-        cmd = f'effect {player} {effect} {time} {power}'
-    else:
-        cmd = f'effect give {player} {effect} {time} {power}'
+        async def on_channel_points_redemption(self, msg: Message, reward: str):
+            self.logmsg(f'PointsRedeem #{msg.channel.name} ({msg.author}) {reward}: {msg.content}')
 
-    return [ cmd ]
+        async def on_bits_donated(self, msg: Message, bits: int):
+            self.logmsg(f'BitsCheered #{msg.channel.name} ({msg.author}) {bits}: {msg.content}')
 
-def mcParticle(particle, speed, count, pos = '~ ~1 ~', delta = '1 1 1', player = 'ArtfulMelody'):
-    if _mcver == '1.12':
-        particle = particle.replace('explosion_emitter', 'hugeexplosion')
-        cmd = f'execute {player} ~ ~ ~ /particle {particle} {pos} {delta} {speed} {count} force @s'
-    else:
-        cmd = f'execute at {player} run particle {particle} {pos} {delta} {speed} {count} force'
+        async def on_channel_raided(self, channel: Channel, raider: str, viewer_count: int):
+            self.logmsg(f'ChannelRaid #{channel.name} ({raider}) {viewer_count}')
 
-    return [ cmd ]
+        async def on_channel_subscription(self, subscriber: str, channel: Channel, msg: Message):
+            self.logmsg(f'Subscription #{channel.name} ({subscriber}): {msg.content}')
 
-def mcGive(item, count, data = 1, player = 'ArtfulMelody'):
-    give = 'give'
-    if 'spigot' in _mcmodes:
-        give = 'minecraft:give'
-    if _mcver == '1.12':
-        item = item.replace('minecraft:carved_pumpkin', 'minecraft:pumpkin')
-        data = f' {data}'
-    else:
-        data = ''
+        async def on_poll_started(self, channel: Channel, poll: PollData):
+            self.logmsg(f'PollStarted #{channel.name}: {poll.duration_seconds} {poll.title}')
 
-    return [ f'{give} {player} {item} {count}{data}' ]
+        async def on_poll_ended(self, channel: Channel, poll: PollData):
+            self.logmsg(f'PollStarted #{channel.name}: {poll.title}')
 
-def mcSummon(entity, age, count, ename, extras = '', player = 'ArtfulMelody'):
-    if age:
-        age = f',Age:{age},ForcedAge:{age}'
+        async def on_user_join(self, user: str, channel: Channel):
+            self.logmsg(f'UserJoin #{channel.name}: {user}')
 
-    if extras:
-        extras = f',{extras}'
+        async def on_user_part(self, user: str, channel: Channel):
+            self.logmsg(f'UserPart #{channel.name}: {user}')
 
-    # allow extras to be inside the entity name (seperated by a pipe)
-    if '|' in entity:
-        parts = entity.split('|')
-        entity = parts[0]
-        extras += ',' + parts[1]
+        async def on_whisper_received(self, msg: Message):
+            self.logmsg(f'WhisperRecv {msg.author}: {msg.content}')
 
-    # construct the command (based on version)
-    if _mcver == '1.12':
-        cmd = f'execute {player} ~ ~ ~ /summon {entity} ~ ~1 ~ {{CustomName:"{ename}",CustomNameVisible:1,PersistenceRequired:1{age}{extras}}}'
-    else:
-        cmd = f'execute at {player} run summon {entity} ~ ~1 ~ {{CustomName:"\\"{ename}\\"",CustomNameVisible:1,PersistenceRequired:1{age}{extras}}}'
-
-    return [ cmd ]
-
-def mcCmd(cmd):
-    if _mcver == '1.12':
-        cmd = cmd.replace(' weapon.mainhand ', ' slot.weapon.mainhand ')
-    return [ cmd ]
-
-def pickMob(passivechance = 3, hostilechance = 1, bits = 0, sub = 0):
-    if any(x in ('sf4', 'amnesia') for x in _mcmodes):
-        # Common "modded" mobs
-        mobs = (
-            ['twilightforest:bighorn_sheep']    * passivechance +
-            ['twilightforest:deer']             * passivechance +
-            ['twilightforest:penguin']          * passivechance +
-            ['twilightforest:quest_ram']        * passivechance +
-            ['twilightforest:raven']            * passivechance +
-            ['twilightforest:squirrel']         * passivechance +
-            ['twilightforest:bunny']            * passivechance +
-            ['twilightforest:tiny_bird']        * passivechance +
-            ['twilightforest:wild_boar']        * passivechance +
-            ['twilightforest:helmet_crab']      * hostilechance +
-            ['twilightforest:minoshroom']       * hostilechance +
-            ['twilightforest:yeti']             * hostilechance
-        )
-
-        # Add specific mobs for each mod
-        if 'amnesia' in _mcmodes:
-            mobs.extend(
-                ['quark:frog']                      * passivechance +
-                ['quark:crab']                      * passivechance +
-                ['twilightforest:rising_zombie']    * hostilechance
-            )
-
-        if 'sf4' in _mcmodes:
-            mobs.extend(
-                ['matteroverdrive:failed_chicken']  * passivechance +
-                ['matteroverdrive:failed_cow']      * passivechance +
-                ['matteroverdrive:failed_pig']      * passivechance +
-                ['matteroverdrive:failed_sheep']    * passivechance
-            )
-    elif 'unclegenny' in _mcmodes:
-        mobs = (
-            ['animania:kit_new_zealand']    * passivechance +
-            ['animania:kit_cottontail']     * passivechance +
-            ['animania:peachick_peach']     * passivechance +
-            ['animania:lamb_friesian']      * passivechance +
-            ['animania:kid_pygmy']          * passivechance +
-            ['animania:hedgehog_albino']    * passivechance +
-            ['animania:piglet_old_spot']    * passivechance +
-            ['animania:hamster']            * passivechance +
-            ['animania:frog']               * passivechance +
-            ['animania:cow_longhorn']       * passivechance +
-            ['zawa:galapagostortoise']      * passivechance +
-            ['zawa:koala']                  * passivechance +
-            ['zawa:echidna']                * passivechance +
-            ['zawa:platypus']               * passivechance +
-            ['zawa:cockatoo']               * passivechance +
-            ['zawa:redpanda']               * passivechance +
-            ['lilcritters:bandedpenguin']   * passivechance +
-            ['lilcritters:raccoon']         * passivechance +
-            ['lilcritters:treesquirrel']    * passivechance +
-            ['lilcritters:boxturtle']       * passivechance +
-            ['midnight:nightstag']          * passivechance +
-            ['quark:frog']                  * passivechance +
-            ['erebus:erebus.rhino_beetle']  * hostilechance +
-            ['erebus:erebus.money_spider']  * hostilechance +
-            ['quark:crab']                  * hostilechance +
-            ['animania:dartfrog']           * hostilechance
-        )
-    elif 'litv' in _mcmodes:
-        # pick random size for mob
-        if sub:
-            size = round(random.uniform(1, 2), 3)
-        else:
-            size = round(random.uniform(0.3, 1), 3)
-
-        mobs = (
-            [f'betteranimalsplus:butterfly|VariantId:"purple_emperor",Size:{size}'] * passivechance +
-            [f'betteranimalsplus:butterfly|VariantId:"red_admiral",Size:{size}']    * passivechance +
-            [f'betteranimalsplus:butterfly|VariantId:"swallowtail",Size:{size}']    * passivechance +
-            [f'betteranimalsplus:butterfly|VariantId:"morpho",Size:{size}']         * passivechance +
-            [f'betteranimalsplus:butterfly|VariantId:"sulphur",Size:{size}']        * passivechance +
-            [f'betteranimalsplus:butterfly|VariantId:"monarch",Size:{size}']        * passivechance
-        )
-    else:
-        # Vanilla mobs
-        mobs = (
-            ['minecraft:pig']          * passivechance +
-            ['minecraft:chicken']      * passivechance +
-            ['minecraft:cat']          * passivechance +
-            ['minecraft:rabbit']       * passivechance +
-            ['minecraft:sheep']        * passivechance +
-            ['minecraft:mooshroom']    * passivechance +
-            ['minecraft:turtle']       * passivechance +
-            ['minecraft:panda']        * passivechance +
-            ['minecraft:cow']          * passivechance +
-            ['minecraft:llama']        * passivechance +
-            ['minecraft:squid']        * passivechance +
-            ['minecraft:polar_bear']   * passivechance +
-            ['minecraft:trader_llama'] * passivechance +
-            ['minecraft:ocelot']       * passivechance +
-            ['minecraft:parrot']       * passivechance +
-            ['minecraft:bee']          * passivechance +
-            ['minecraft:zombie']       * hostilechance +
-            ['minecraft:slime']        * hostilechance +
-            ['minecraft:witch']        * hostilechance +
-            ['minecraft:magma_cube']   * hostilechance +
-            ['minecraft:vex']          * hostilechance +
-            ['minecraft:silverfish']   * hostilechance +
-            ['minecraft:endermite']    * hostilechance +
-            ['minecraft:spider']       * hostilechance
-        )
-
-    return mobs
-
-def startBotServices():
-    logmsg("Starting services...")
-    asyncio.set_event_loop(event_loop)
-    logmsg("Creating pubsub task...")
-    event_loop.create_task(pubsubConnect()) # PubSub WebSocket Server
-    logmsg("Creating chatbot task...")
-    event_loop.create_task(chatbot.run()) # ChatBot server
-    logmsg("Starting event loop...")
-    asyncio.get_event_loop().run_forever() # Start WebSocket Servers
-
-def logmsg(msg: str):
-    now = datetime.now()
-    ts = now.strftime("%Y-%m-%d %H:%M:%S")
-    logging.info(ts + " |" + msg)
-
-def create_debug_message(msg):
-    return json.dumps({'debug': msg})
-
-class ChatBot(BaseBot):
-    def logmsg(self, msg: str):
-        now = datetime.now()
-        ts = now.strftime("%Y-%m-%d %H:%M:%S")
-        logging.info(ts + " >" + msg)
-
-    def say(self, msg: str, channel = 'artfulmelody'):
-        self.logmsg(f'Sending #{channel}: {msg}')
-        event_loop.create_task(self.irc.send_privmsg(channel, msg))
-
-    async def on_raw_message(self, RawMsg: Message):
-        msg = str(RawMsg)
-        if msg != 'PING':
-            logging.debug(f"Raw: '{msg}'")
-            if '!test' in msg:
-                self.logmsg('Test message received')
-                #oldlevel=2
-
-    async def on_channel_joined(self, channel: Channel):
-        self.logmsg(f'Joined #{channel.name}')
-
-    async def on_privmsg_received(self, msg: Message):
-        # Handle viewer chat and bot chat separately
-        if 'streamlabs' in msg.author or 'yoghurtbot' in msg.author:
-            match = re.match(r'^(.*) just tipped (.*)$', msg.content)
-            if match:
-                groups = match.groups()
-                who    = g[0]
-                amount = g[1]
-                self.logmsg(f'[Tip] #{msg.channel.name} Tipper:{who} Amount:{amount}')
-            else:
-                self.logmsg(f'[Bot] #{msg.channel.name} ({msg.author}) {msg.content}')
-        else:
-            self.logmsg(f'[Chat] #{msg.channel.name} ({msg.author}) {msg.content}')
+        @Command('redo', permission='redo', help='Re-trigger an action', syntax='?redo <sub|gift|cheer|points> <user> <params..>')
+        async def cmd_function(msg: Message, *args):
+            if not args:
+                await msg.reply('No parameters given')
+                return
 
-    async def on_channel_points_redemption(self, msg: Message, reward: str):
-        self.logmsg(f'PointsRedeem #{msg.channel.name} ({msg.author}) {reward}: {msg.content}')
+            action = args[0].lower()
+            if action == 'cheer' or action == 'bits':
+                action = 'cheer'
+            if action not in ('sub', 'gift', 'cheer', 'points') or len(args) < 2:
+                await msg.reply('Usage: ?redo <sub|gift|cheer|points> <user>')
+                return
 
-    async def on_bits_donated(self, msg: Message, bits: int):
-        self.logmsg(f'BitsCheered #{msg.channel.name} ({msg.author}) {bits}: {msg.content}')
+            # Latest journaled event of that kind from the user on this channel
+            user = args[1].lstrip('@')
+            ctx = channelsByChat.get(msg.channel.name.lower())
+            entry = journal.latest(ctx.channel_id, user, action) if ctx else None
+            if entry is None:
+                await msg.reply(f'No {action} from {user} found')
+                return
 
-    async def on_channel_raided(self, channel: Channel, raider: str, viewer_count: int):
-        self.logmsg(f'ChannelRaid #{channel.name} ({raider}) {viewer_count}')
+            if replayEvent(entry):
+                await msg.reply(f'Retriggering {action} from {user}...')
 
-    async def on_channel_subscription(self, subscriber: str, channel: Channel, msg: Message):
-        self.logmsg(f'Subscription #{channel.name} ({subscriber}): {msg.content}')
+    return ChatBot()
 
-    async def on_poll_started(self, channel: Channel, poll: PollData):
-        self.logmsg(f'PollStarted #{channel.name}: {poll.duration_seconds} {poll.title}')
+# Reference point for the startup time logged by startBotServices
+_launched = time.perf_counter()
 
-    async def on_poll_ended(self, channel: Channel, poll: PollData):
-        self.logmsg(f'PollStarted #{channel.name}: {poll.title}')
+# A startup that fails (eg. the bot framework or its configs/config.json missing) stops the
+# process rather than leaving it running without chat
+def startupDone(task):
+    if task.cancelled() or task.exception() is None:
+        return
+    ex = task.exception()
+    logging.error('Startup failed: %r', ex, exc_info=ex, extra=_logtag)
+    task.get_loop().stop()
 
-    async def on_user_join(self, user: str, channel: Channel):
-        self.logmsg(f'UserJoin #{channel.name}: {user}')
+def main():
+    global loglistener
 
-    async def on_user_part(self, user: str, channel: Channel):
-        self.logmsg(f'UserPart #{channel.name}: {user}')
+    # Fetch configuration from file
+    import yaml
+    with open('logging.yaml', 'r') as f:
+        logging.config.dictConfig(yaml.safe_load(f.read()))
 
-    async def on_whisper_received(self, msg: Message):
-        self.logmsg(f'WhisperRecv {msg.author}: {msg.content}')
+    # Formatting and log I/O happen on a background thread, handlers only enqueue records
+    loglistener = startLogging()
 
-    @Command('redo', permission='redo', help='Re-trigger an action', syntax='?redo <sub|gift|cheer|points> <user> <params..>')
-    async def cmd_function(msg: Message, *args):
-        if not args:
-            await msg.reply('No parameters given')
-            return
+    # Read channel/token from config file (PUBSUB_CONFIG can point elsewhere, eg. for bench/loadtest.py)
+    with open(os.environ.get('PUBSUB_CONFIG', 'configs/pubsub.json'), 'r') as f:
+        setup(json.load(f))
 
-        action = args[0].lower()
-        if action == 'sub' or action == 'gift':
-            user = args[1]
+    # Start all the services
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    event_loop.create_task(startBotServices()).add_done_callback(startupDone)
+    event_loop.run_forever()
 
-        await msg.reply('Retriggering action...')
+    # Only stopped by a failed startup
+    loglistener.stop()
+    sys.exit(1)
 
-# Start all the services
-event_loop = asyncio.new_event_loop()
-chatbot = ChatBot()
-startBotServices()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+from jsonlib import loads, dumps
+from metrics import Counter, Histogram
+from transport import Transport
+
+logger = logging.getLogger(__name__)
+
+pubsub_pings = Histogram('pubsub_ping_seconds', 'PubSub PING to PONG round trip')
+pubsub_reconnects = Counter('pubsub_reconnects_total', 'PubSub disconnects/reconnects')
+pubsub_overlap = Counter('pubsub_overlap_duplicates_total', 'Messages seen on both sockets during a PubSub handover')
+
+class PubSubError(Exception):
+    pass
+
+# Capped exponential backoff with full jitter
+class Backoff:
+    def __init__(self, base = 1, cap = 120):
+        self.base     = base
+        self.cap      = cap
+        self.attempts = 0
+
+    def reset(self):
+        self.attempts = 0
+
+    def next(self):
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** self.attempts))
+        self.attempts += 1
+        return delay
+
+# One Twitch PubSub connection for a fixed set of LISTEN requests
+#
+# Keeps a spare socket connected (and PINGed) next to the live one. When the live socket is
+# lost the spare only needs its LISTENs sent, and when Twitch sends RECONNECT the spare is
+# subscribed first and the old socket kept reading until it is, so nothing is missed during
+# maintenance. Messages delivered on both sockets during a handover are dropped by a small
+# window of recently seen (topic, message) pairs. PINGs go out every ~4 minutes (jittered)
+# and a socket whose PONG doesn't arrive within pongtimeout seconds is replaced.
+# Reconnects back off exponentially with jitter up to a cap, reset once a socket is subscribed.
+class PubSubClient:
+    def __init__(self, uri, requests, onMessage, name = 'pubsub', standby = True,
+                 pinginterval = 240, pongtimeout = 10, listentimeout = 10, recent = 1024):
+        self.uri           = uri
+        self.requests      = requests
+        self.onMessage     = onMessage
+        self.name          = name
+        self.standby       = standby
+        self.pinginterval  = pinginterval
+        self.pongtimeout   = pongtimeout
+        self.listentimeout = listentimeout
+        self.backoff       = Backoff()
+        self._recent       = deque(maxlen=recent)
+        self._recentset    = set()
+        self._spare        = None
+
+    async def run(self):
+        websocket = await self._subscribed()
+        while True:
+            reconnect = asyncio.Event()
+            reader = asyncio.ensure_future(self._serve(websocket, reconnect))
+            waiter = asyncio.ensure_future(reconnect.wait())
+            try:
+                await asyncio.wait({reader, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:
+                reader.cancel()
+                waiter.cancel()
+                await websocket.close()
+                await self.close()
+                raise
+
+            pubsub_reconnects.inc()
+            if reconnect.is_set():
+                # Keep reading the old socket until the new one is subscribed
+                logger.info(f'{self.name}: reconnect requested, handing over to a new socket')
+                try:
+                    replacement = await self._subscribed()
+                finally:
+                    reader.cancel()
+                    await websocket.close()
+            else:
+                waiter.cancel()
+                try:
+                    reader.result()
+                except Exception as ex:
+                    logger.info(f'{self.name}: connection lost: {ex}')
+                replacement = await self._subscribed()
+            websocket = replacement
+
+    # A subscribed socket: the spare if there is one, else a new connection (with backoff)
+    async def _subscribed(self):
+        while True:
+            spare, self._spare = self._spare, None
+            try:
+                if spare is not None:
+                    websocket = await spare
+                else:
+                    websocket = await self._connect()
+                await self._listen(websocket)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                delay = self.backoff.next()
+                logger.info(f'{self.name}: unable to subscribe ({ex}), retrying in {delay:.1f}s')
+                await asyncio.sleep(delay)
+                continue
+
+            self.backoff.reset()
+            logger.info(f'{self.name}: connected')
+            if self.standby:
+                self._spare = asyncio.ensure_future(self._connect())
+            return websocket
+
+    async def _connect(self):
+        import websockets
+        websocket = await asyncio.wait_for(websockets.connect(self.uri, ping_interval=None), timeout=self.listentimeout)
+        # Spares need PINGs too or Twitch will drop them
+        websocket.pubsub_keeper = asyncio.ensure_future(self._keepSpare(websocket))
+        return websocket
+
+    # Stop the spare connection (and its keeper), the live one is closed by run()
+    async def close(self):
+        spare, self._spare = self._spare, None
+        if spare is None:
+            return
+        spare.cancel()
+        websocket, = await asyncio.gather(spare, return_exceptions=True)
+        if isinstance(websocket, BaseException):
+            return
+        await self._stopKeeper(websocket)
+        await websocket.close()
+
+    # The keeper has to be gone before anything else reads the socket
+    async def _stopKeeper(self, websocket):
+        websocket.pubsub_keeper.cancel()
+        await asyncio.gather(websocket.pubsub_keeper, return_exceptions=True)
+
+    async def _listen(self, websocket):
+        await self._stopKeeper(websocket)
+        nonces = {request['nonce']: request for request in self.requests}
+        for request in self.requests:
+            await websocket.send(dumps(request))
+
+        # Wait for a RESPONSE per LISTEN (anything else arriving meanwhile is processed)
+        errors = []
+        deadline = time.monotonic() + self.listentimeout
+        while nonces:
+            frame = await asyncio.wait_for(websocket.recv(), timeout=max(0, deadline - time.monotonic()))
+            response = loads(frame)
+            if response['type'] == 'RESPONSE' and response.get('nonce') in nonces:
+                del nonces[response['nonce']]
+                if response.get('error'):
+                    errors.append(response['error'])
+                    logger.info(f'{self.name}: LISTEN {response["nonce"]} failed: {response["error"]}')
+            elif response['type'] == 'MESSAGE':
+                self._received(frame, response)
+        if errors and len(errors) == len(self.requests):
+            await websocket.close()
+            raise PubSubError(errors[0])
+
+    async def _keepSpare(self, websocket):
+        try:
+            while True:
+                await asyncio.sleep(self.pinginterval + random.uniform(0, 30))
+                await websocket.send('{"type": "PING"}')
+                await asyncio.wait_for(websocket.recv(), timeout=self.pongtimeout)
+        except Exception as ex:
+            # A dead spare fails its LISTEN and is replaced when it's needed
+            logger.info(f'{self.name}: spare connection lost: {ex}')
+
+    # Read a subscribed socket until it is lost (raises) or RECONNECT arrives (sets reconnect)
+    async def _serve(self, websocket, reconnect):
+        pong = asyncio.Event()
+        pinger = asyncio.ensure_future(self._ping(websocket, pong))
+        try:
+            while True:
+                recv = asyncio.ensure_future(websocket.recv())
+                await asyncio.wait({recv, pinger}, return_when=asyncio.FIRST_COMPLETED)
+                if not recv.done():
+                    recv.cancel()
+                    pinger.result()    # raises why the ping failed
+                frame = recv.result()
+                response = loads(frame)
+                rtype = response['type']
+                if rtype == 'PONG':
+                    pong.set()
+                elif rtype == 'RECONNECT':
+                    reconnect.set()
+                else:
+                    self._received(frame, response)
+        finally:
+            pinger.cancel()
+
+    async def _ping(self, websocket, pong):
+        while True:
+            await asyncio.sleep(self.pinginterval + random.uniform(0, 30))
+            pong.clear()
+            start = time.monotonic()
+            await websocket.send('{"type": "PING"}')
+            try:
+                await asyncio.wait_for(pong.wait(), timeout=self.pongtimeout)
+            except asyncio.TimeoutError:
+                raise PubSubError(f'no PONG within {self.pongtimeout}s')
+            pubsub_pings.observe(time.monotonic() - start)
+
+    def _received(self, frame, response):
+        if response['type'] == 'MESSAGE':
+            data = response['data']
+            key = (data['topic'], data['message'])
+            if key in self._recentset:
+                pubsub_overlap.inc()
+                return
+            if len(self._recent) == self._recent.maxlen:
+                self._recentset.discard(self._recent[0])
+            self._recent.append(key)
+            self._recentset.add(key)
+        self.onMessage(frame, response)
+
+# Legacy PubSub as a transport: one LISTEN per channel (each has its own auth token) for
+# every topic prefix, MESSAGE payloads are already in the format the handlers expect
+class PubSubTransport(Transport):
+    limit = 50
+
+    def __init__(self, shard, prefixes, onEvent, config):
+        super().__init__(shard, prefixes, onEvent, config)
+        requests = [{
+            'type': 'LISTEN',
+            'nonce': ctx.channel_id,
+            'data': {
+                'topics': [prefix + '.' + ctx.channel_id for prefix in prefixes],
+                'auth_token': ctx.auth_token
+            }
+        } for ctx in shard]
+        self.client = PubSubClient(config.get('pubsuburi', 'wss://pubsub-edge.twitch.tv'), requests, self._message,
+                                   name=self.name, standby=config.get('pubsubstandby', True))
+
+    async def run(self):
+        await self.client.run()
+
+    def _message(self, frame, response):
+        if response['type'] != 'MESSAGE':
+            return
+        # Topics are '<prefix>.<channel id>'
+        data = response['data']
+        prefix, _, channel_id = data['topic'].rpartition('.')
+        self.onEvent(channel_id, prefix, data['message'], None)
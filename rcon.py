@@ -0,0 +1,251 @@
+import asyncio
+import itertools
+import logging
+import socket
+import struct
+import time
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# RCON packet types
+_SERVERDATA_RESPONSE = 0
+_SERVERDATA_COMMAND  = 2
+_SERVERDATA_LOGIN    = 3
+
+rcon_rtt = Histogram('rcon_command_seconds', 'RCON command round trip time', ['target'])
+rcon_connects = Counter('rcon_connects_total', 'RCON connections opened')
+rcon_reconnects = Counter('rcon_reconnects_total', 'RCON connections dropped mid batch and reopened')
+
+class RconError(Exception):
+    pass
+
+class RconAuthError(RconError):
+    pass
+
+# What a dropped connection can raise: our own errors, plus socket errors from writing
+# and a short read surfacing before the read loop has failed the request
+_DROPPED = (RconError, OSError, asyncio.IncompleteReadError)
+
+# A single authenticated RCON socket
+# Requests are pipelined and replies are matched back to their caller by request id
+class RconConnection:
+    def __init__(self, host, port, password, timeout = 5):
+        self.host     = host
+        self.port     = port
+        self.password = password
+        self.timeout  = timeout
+        self.lastused = 0
+        self._rtt     = rcon_rtt.labels(f'{host}:{port}')
+        self._reader  = None
+        self._writer  = None
+        self._task    = None
+        self._pending = {}
+        self._ids     = itertools.count(1)
+
+    @property
+    def closed(self):
+        return self._writer is None or self._writer.is_closing() or self._task.done()
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout=self.timeout)
+
+        # Keep idle sockets alive through NAT/firewalls between keepalive pings
+        sock = self._writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+        self._task = asyncio.ensure_future(self._readLoop())
+        try:
+            await self._request(_SERVERDATA_LOGIN, self.password)
+        except RconAuthError:
+            self.close()
+            raise
+        self.lastused = time.monotonic()
+
+    async def command(self, cmd):
+        start = time.monotonic()
+        resp = await self._request(_SERVERDATA_COMMAND, cmd)
+        self.lastused = time.monotonic()
+        self._rtt.observe(self.lastused - start)
+        return resp
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._fail(RconError('Connection closed'))
+
+    async def _request(self, ptype, body):
+        if self.closed:
+            raise RconError('Connection closed')
+
+        rid = next(self._ids)
+        payload = struct.pack('<ii', rid, ptype) + body.encode('utf8') + b'\x00\x00'
+        future = asyncio.get_running_loop().create_future()
+        self._pending[rid] = future
+        try:
+            self._writer.write(struct.pack('<i', len(payload)) + payload)
+            await self._writer.drain()
+            return await asyncio.wait_for(future, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            # A missing reply leaves the stream in an unknown state, so drop the socket
+            self.close()
+            raise RconError(f'Timed out waiting for reply to request {rid}')
+        finally:
+            self._pending.pop(rid, None)
+
+    async def _readLoop(self):
+        try:
+            while True:
+                header = await self._reader.readexactly(4)
+                (length,) = struct.unpack('<i', header)
+                packet = await self._reader.readexactly(length)
+                rid, ptype = struct.unpack('<ii', packet[:8])
+                body = packet[8:-2].decode('utf8', errors='replace')
+
+                if rid == -1:
+                    # Server rejected the login; it answers with id -1 instead of our id
+                    self._fail(RconAuthError('RCON authentication failed'))
+                    continue
+
+                future = self._pending.get(rid)
+                if future is not None and not future.done():
+                    future.set_result(body)
+        except (asyncio.IncompleteReadError, ConnectionError) as ex:
+            self._fail(RconError(f'Connection lost: {ex}'))
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+
+    def _fail(self, ex):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ex)
+        self._pending.clear()
+
+# A small pool of warm RCON connections shared by every handler
+# Connections are opened lazily, kept alive while idle and transparently replaced when they drop
+class RconPool:
+    def __init__(self, host, port, password, size = 2, timeout = 5, keepalive = 60, keepalive_cmd = 'list'):
+        self.host          = host
+        self.port          = port
+        self.password      = password
+        self.size          = size
+        self.timeout       = timeout
+        self.keepalive     = keepalive
+        self.keepalive_cmd = keepalive_cmd
+        self._idle         = []
+        self._count        = 0
+        self._cond         = None
+        self._keeper       = None
+
+    async def acquire(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        if self._keeper is None and self.keepalive:
+            self._keeper = asyncio.ensure_future(self._keepAlive())
+
+        async with self._cond:
+            while True:
+                while self._idle:
+                    conn = self._idle.pop()
+                    if not conn.closed:
+                        return conn
+                    self._count -= 1
+                if self._count < self.size:
+                    self._count += 1
+                    break
+                await self._cond.wait()
+
+        conn = RconConnection(self.host, self.port, self.password, self.timeout)
+        try:
+            await conn.connect()
+        except BaseException:
+            await self._discard()
+            raise
+        rcon_connects.inc()
+        logger.info(f'RCON connection opened to {self.host}:{self.port}')
+        return conn
+
+    async def release(self, conn):
+        if conn.closed:
+            await self._discard()
+            return
+        async with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    async def command(self, cmd):
+        return (await self.commands([cmd]))[0][1]
+
+    # Send a list of commands over a single pooled connection, in order
+    # Returns a list of (cmd, response) tuples. If the connection drops part way,
+    # the remaining commands are retried once on a fresh connection.
+    async def commands(self, cmds, delay = 0):
+        results = []
+        retried = False
+        while len(results) < len(cmds):
+            conn = await self.acquire()
+            try:
+                for cmd in cmds[len(results):]:
+                    results.append((cmd, await conn.command(cmd)))
+                    if delay:
+                        await asyncio.sleep(delay)
+            except RconAuthError:
+                raise
+            except _DROPPED as ex:
+                conn.close()
+                if retried:
+                    if isinstance(ex, RconError):
+                        raise
+                    raise RconError(f'Connection lost: {ex!r}') from ex
+                retried = True
+                rcon_reconnects.inc()
+                logger.info(f'RCON connection to {self.host}:{self.port} dropped, reconnecting')
+            finally:
+                await self.release(conn)
+        return results
+
+    async def close(self):
+        if self._keeper is not None:
+            self._keeper.cancel()
+            self._keeper = None
+        # Connections in use are counted off as they're released (or discarded) later
+        for conn in self._idle:
+            conn.close()
+        self._count -= len(self._idle)
+        self._idle.clear()
+
+    async def _discard(self):
+        async with self._cond:
+            self._count -= 1
+            self._cond.notify()
+
+    async def _keepAlive(self):
+        while True:
+            await asyncio.sleep(self.keepalive)
+            now = time.monotonic()
+            for conn in list(self._idle):
+                if now - conn.lastused < self.keepalive:
+                    continue
+                if conn in self._idle:
+                    self._idle.remove(conn)
+                else:
+                    continue
+                try:
+                    await conn.command(self.keepalive_cmd)
+                except _DROPPED as ex:
+                    logger.info(f'RCON keepalive failed, dropping connection: {ex!r}')
+                    conn.close()
+                except BaseException:
+                    conn.close()
+                    raise
+                finally:
+                    # Hand back or discard it, so a failed ping never leaks a pool slot
+                    await self.release(conn)
@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Channel points reward registry
+#
+# Rewards are loaded from a JSON file mapping a reward title prefix to a declarative
+# action spec, eg:
+#
+#   "Sticky Feet": {
+#       "title":   {"text": "You have Sticky Feet!", "sub": "{user} put glue on your boots",
+#                   "colour": "dark_purple", "subcolour": "yellow"},
+#       "effects": [["minecraft:slowness", 30, 20], ["minecraft:nausea", 5, 1]]
+#   }
+#
+# Supported keys: log, title, effects, gives, sounds, particles, commands, summons, action.
+# Lookup walks a character trie so finding the matching prefix is O(len(title)), and the
+# file is reloaded automatically when it changes on disk (so rewards can be added or
+# retuned between streams without a restart). Its mtime is checked at most every
+# interval seconds, not on every redemption.
+# If a compile function is given, each spec is passed through it at load time and
+# lookup returns the compiled result instead of the raw spec.
+class RewardRegistry:
+    def __init__(self, path, compile = None, interval = 5):
+        self.path      = path
+        self.compile   = compile
+        self.interval  = interval
+        self.rewards   = {}
+        self._trie     = {}
+        self._mtime    = None
+        self._nextstat = 0
+
+    def load(self):
+        with open(self.path, 'r') as f:
+            rewards = json.load(f)
+
+        trie = {}
+        for prefix, spec in rewards.items():
+            node = trie
+            for ch in prefix:
+                node = node.setdefault(ch, {})
+            # None can never clash with a single character key
+            node[None] = self.compile(spec) if self.compile else spec
+
+        self.rewards   = rewards
+        self._trie     = trie
+        self._mtime    = os.stat(self.path).st_mtime
+        self._nextstat = time.monotonic() + self.interval
+        logger.info(f'Loaded {len(rewards)} rewards from {self.path}')
+
+    def reloadIfChanged(self):
+        self._nextstat = time.monotonic() + self.interval
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            self.load()
+        except (OSError, ValueError, KeyError, TypeError) as ex:
+            # Keep serving the old rewards if the new file is broken
+            logger.info(f'Unable to reload rewards from {self.path}: {ex}')
+            self._mtime = mtime
+            return False
+        return True
+
+    # Find the spec for a reward title (longest matching prefix wins)
+    def lookup(self, title):
+        if time.monotonic() >= self._nextstat:
+            self.reloadIfChanged()
+        node = self._trie
+        found = node.get(None)
+        for ch in title:
+            node = node.get(ch)
+            if node is None:
+                break
+            found = node.get(None, found)
+        return found
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# Process-sharded runner for pubsub.py
+#
+# Splits the configured channels (see channels.py) over N worker processes, each running
+# its own pubsub.py event loop for its shard, so JSON decoding and command building for
+# many channels can use more than one core. Crashed workers are restarted with a capped
+# backoff. Worker log records come back over a queue and are written by this process'
+# logging handlers (logging.yaml), and worker metric snapshots are combined with a
+# worker="N" label and served/logged from here.
+#
+#   python supervisor.py --processes 4
+#   PUBSUB_CONFIG=configs/other.json python supervisor.py
+import argparse
+import asyncio
+import json
+import logging
+import logging.config
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+from chat import CHAT_LIMIT, CHAT_LIMIT_MOD
+from logpipe import startLogging, forwardLogging
+from metrics import Counter, Gauge, registry, serveMetrics, logSnapshots
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger(__name__)
+
+# Restart backoff for crashed workers (doubles per quick crash, resets once a worker stays up)
+RESTART_MIN    = 1
+RESTART_MAX    = 60
+RESTART_STABLE = 60
+
+worker_restarts = Counter('supervisor_worker_restarts_total', 'Worker processes restarted', ['worker'])
+
+# Split the channel entries into n contiguous shards (no empty shards)
+#
+# Every worker gets its own journal file (journal.db -> journal.worker0.db, ...), and the
+# chat account's message limit is shared out between them since they all send as the same
+# bot. Workers only join the chat channels of their shard (see pubsub.createChatBot).
+def shardConfig(config, n):
+    entries = config.get('channels') or [{k: v for k, v in config.items() if k != 'channels'}]
+    n = max(1, min(n, len(entries)))
+    size, extra = divmod(len(entries), n)
+    journal, ext = os.path.splitext(config.get('journal', 'journal.db'))
+    chatlimit = config.get('chatlimit') or (CHAT_LIMIT_MOD if config.get('chatmod') else CHAT_LIMIT)
+    shards, start = [], 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        shard = dict(config, channels=entries[start:end])
+        shard['worker']    = i
+        shard['journal']   = f'{journal}.worker{i}{ext}'
+        shard['chatlimit'] = max(1, chatlimit // n)
+        # Metrics are served and logged by the supervisor
+        shard.pop('metricsport', None)
+        shard['metricslog'] = 0
+        shards.append(shard)
+        start = end
+    return shards
+
+# Worker process entry point: run pubsub.py for one shard
+def _workerMain(idx, configpath, logqueue, metricsqueue, interval):
+    forwardLogging(logqueue)
+    os.environ['PUBSUB_CONFIG'] = configpath
+
+    # Ship a metrics snapshot to the supervisor every interval seconds
+    def pushMetrics():
+        while True:
+            time.sleep(interval)
+            try:
+                metricsqueue.put((idx, registry.snapshot()))
+            except Exception as ex:
+                logger.info(f'Unable to send metrics from worker {idx}: {ex}')
+    threading.Thread(target=pushMetrics, name='metrics', daemon=True).start()
+
+    os.chdir(ROOT)
+    import pubsub
+    pubsub.main()
+
+# Latest metric snapshot from each worker, rendered alongside the supervisor's own registry
+class WorkerMetrics:
+    def __init__(self, local = registry):
+        self.local   = local
+        self.workers = {}
+
+    def update(self, idx, snapshot):
+        self.workers[idx] = snapshot
+
+    def _labelled(self):
+        for idx, snapshot in sorted(self.workers.items()):
+            for key, value in snapshot.items():
+                name, brace, labels = key.partition('{')
+                if brace:
+                    yield f'{name}{{worker="{idx}",{labels}', value
+                else:
+                    yield f'{name}{{worker="{idx}"}}', value
+
+    def render(self):
+        return self.local.render() + ''.join(f'{key} {value}\n' for key, value in self._labelled())
+
+    def snapshot(self):
+        values = self.local.snapshot()
+        values.update(self._labelled())
+        return values
+
+class Supervisor:
+    def __init__(self, config, processes, interval = 5):
+        self.config    = config
+        self.shards    = shardConfig(config, processes)
+        self.interval  = interval
+        self.mp        = multiprocessing.get_context('spawn')
+        self.logqueue  = self.mp.Queue()
+        self.statqueue = self.mp.Queue()
+        self.metrics   = WorkerMetrics()
+        self.workers   = [None] * len(self.shards)
+        self.paths     = []
+        self.stopping  = False
+        Gauge('supervisor_workers_alive', 'Worker processes running',
+              fn=lambda: sum(1 for w in self.workers if w is not None and w[0].is_alive()))
+
+    def start(self):
+        for idx, shard in enumerate(self.shards):
+            fd, path = tempfile.mkstemp(prefix=f'pubsub-worker{idx}-', suffix='.json')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(shard, f)
+            self.paths.append(path)
+            self._spawn(idx, RESTART_MIN)
+
+    def _spawn(self, idx, backoff):
+        proc = self.mp.Process(target=_workerMain, name=f'pubsub-worker{idx}',
+                               args=(idx, self.paths[idx], self.logqueue, self.statqueue, self.interval))
+        proc.start()
+        channels = ', '.join(str(c.get('chat', c.get('channel_id'))) for c in self.shards[idx]['channels'])
+        logger.info(f'Started worker {idx} (pid {proc.pid}): {channels}')
+        self.workers[idx] = (proc, time.monotonic(), backoff)
+
+    # Restart any worker that has exited
+    async def watch(self):
+        restarts = {}
+        while not self.stopping:
+            await asyncio.sleep(1)
+            now = time.monotonic()
+            for idx, (proc, started, backoff) in enumerate(self.workers):
+                if proc.is_alive() or self.stopping:
+                    continue
+                if idx not in restarts:
+                    if now - started >= RESTART_STABLE:
+                        backoff = RESTART_MIN
+                    logger.info(f'Worker {idx} exited with code {proc.exitcode}, restarting in {backoff}s')
+                    restarts[idx] = (now + backoff, min(backoff * 2, RESTART_MAX))
+                due, nextbackoff = restarts[idx]
+                if now >= due:
+                    del restarts[idx]
+                    worker_restarts.labels(str(idx)).inc()
+                    self._spawn(idx, nextbackoff)
+
+    # Collect metric snapshots from the workers (blocking queue read, so on a thread)
+    async def collect(self):
+        loop = asyncio.get_running_loop()
+        while not self.stopping:
+            try:
+                idx, snapshot = await loop.run_in_executor(None, self.statqueue.get, True, 1)
+            except queue.Empty:
+                continue
+            self.metrics.update(idx, snapshot)
+
+    def stop(self):
+        self.stopping = True
+        for worker in self.workers:
+            if worker is not None and worker[0].is_alive():
+                worker[0].terminate()
+        for worker in self.workers:
+            if worker is not None:
+                worker[0].join(10)
+        for path in self.paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    async def run(self):
+        self.start()
+        tasks = [asyncio.ensure_future(self.watch()), asyncio.ensure_future(self.collect())]
+        if self.config.get('metricsport'):
+            await serveMetrics(self.config['metricsport'], registry=self.metrics)
+        if self.config.get('metricslog', 300):
+            tasks.append(asyncio.ensure_future(logSnapshots(self.config.get('metricslog', 300), registry=self.metrics)))
+        await asyncio.gather(*tasks)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Run pubsub.py for all configured channels over several processes')
+    parser.add_argument('--processes', '-n', type=int, default=os.cpu_count() or 1, help='worker processes (default: CPU count)')
+    parser.add_argument('--config', default=os.environ.get('PUBSUB_CONFIG', 'configs/pubsub.json'))
+    parser.add_argument('--metrics-interval', type=float, default=5, help='seconds between worker metric snapshots')
+    args = parser.parse_args(argv)
+
+    with open('logging.yaml', 'r') as f:
+        logging.config.dictConfig(yaml.safe_load(f.read()))
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    supervisor = Supervisor(config, args.processes, args.metrics_interval)
+
+    # Stop the workers on SIGTERM as well as Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Worker records arrive on the same queue as our own and are written by one listener
+    listener = startLogging(supervisor.logqueue)
+    logger.info(f'Supervisor starting {len(supervisor.shards)} worker(s)')
+    try:
+        asyncio.run(supervisor.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+        logger.info('Supervisor stopped')
+        listener.stop()
+
+if __name__ == '__main__':
+    sys.exit(main())
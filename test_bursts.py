@@ -0,0 +1,50 @@
+import asyncio
+
+import pubsub
+from bursts import BurstAggregator
+from events import SubEvent
+
+def sub(user, recipient = None, context = 'subgift', duration = 1):
+    return SubEvent(None, context, user, user.lower(), recipient, None, '1000', 1, duration, '', '2024-01-01T00:00:00Z')
+
+def test_gifts_are_keyed_by_gifter_kind_and_length():
+    keys = {pubsub.subBurstKey(sub('Gifter', 'a')), pubsub.subBurstKey(sub('Gifter', 'b'))}
+    assert len(keys) == 1
+    assert pubsub.subBurstKey(sub('Other', 'a')) not in keys
+    assert pubsub.subBurstKey(sub('Gifter', 'a', duration=3)) not in keys
+    assert pubsub.subBurstKey(sub('Gifter', 'a', context='anonsubgift')) not in keys
+    assert pubsub.subBurstKey(sub('Viewer', context='sub')) is None
+
+def test_burst_is_flushed_once_quiet():
+    async def run():
+        bursts = BurstAggregator(window=0.02, maxwait=1)
+        flushed = []
+        for n in range(3):
+            bursts.add('gifter', n, flushed.append)
+        bursts.add('other', 9, flushed.append)
+        assert flushed == []
+        await asyncio.sleep(0.05)
+        return bursts, flushed
+    bursts, flushed = asyncio.run(run())
+    assert sorted(flushed) == [[0, 1, 2], [9]]
+    assert len(bursts) == 0
+
+def test_burst_is_capped_by_items_and_maxwait():
+    async def run():
+        bursts = BurstAggregator(window=0.05, maxwait=0.1, maxitems=3)
+        flushed = []
+        for n in range(4):
+            bursts.add('gifter', n, flushed.append)
+        # Full at three, the fourth starts a new burst
+        assert flushed == [[0, 1, 2]]
+
+        # Gifts keep coming within the window, but the burst goes out after maxwait
+        for n in range(4, 10):
+            await asyncio.sleep(0.03)
+            bursts.add('slow', n, flushed.append)
+        await asyncio.sleep(0.1)
+        return flushed
+    flushed = asyncio.run(run())
+    assert flushed[1] == [3]
+    slow = flushed[2:]
+    assert len(slow) > 1 and sum(slow, []) == list(range(4, 10))
@@ -0,0 +1,62 @@
+import json
+import logging
+
+import pytest
+
+from channels import MAX_CONNECTIONS, TOPICS_PER_CONNECTION, loadChannels, shardChannels
+
+@pytest.fixture
+def config(tmp_path):
+    rewards = tmp_path / 'rewards.json'
+    rewards.write_text(json.dumps({'Night': {'commands': ['time set night']}}))
+    return {
+        'auth_token': 'oauth:token',
+        'mcver': '1.20.1',
+        'mcmodes': ['mobs'],
+        'rconport': 25575,
+        'rconpass': 'secret',
+        'rewards': str(rewards),
+    }
+
+def test_single_channel_from_the_top_level(config):
+    [ctx] = loadChannels(dict(config, channel_id=1234, player='Streamer'))
+    assert (ctx.channel_id, ctx.chat, ctx.player) == ('1234', 'streamer', 'Streamer')
+    [target] = ctx.targets
+    assert (target.name, target.player) == ('127.0.0.1:25575', 'Streamer')
+
+def test_channels_share_servers_and_samplers(config):
+    config['channels'] = [
+        {'channel_id': '1', 'auth_token': 'one', 'player': 'One'},
+        {'channel_id': '2', 'auth_token': 'two', 'player': 'Two', 'mcmodes': ['mobs', 'vanilla']},
+        {'channel_id': '3', 'auth_token': 'three', 'player': 'Three', 'rconport': 25576,
+         'targets': [{}, {'rconport': 25577, 'player': 'Alt'}]},
+    ]
+    one, two, three = loadChannels(config)
+    assert one.targets[0].queue is two.targets[0].queue
+    assert one.targets[0].queue is not three.targets[0].queue
+    assert [target.player for target in three.targets] == ['Three', 'Alt']
+    assert one.mobsampler is not two.mobsampler
+    assert one.rewards.lookup('Night') is not None
+
+@pytest.mark.parametrize('count, topics, limit, sizes', [
+    (1, 6, TOPICS_PER_CONNECTION, [1]),
+    (8, 6, TOPICS_PER_CONNECTION, [8]),           # 48 topics fit on one connection
+    (9, 6, TOPICS_PER_CONNECTION, [8, 1]),
+    (20, 13, 300, [20]),                          # EventSub subscriptions
+    (3, 80, TOPICS_PER_CONNECTION, [1, 1, 1]),    # more than fit: one channel per connection
+])
+def test_shards_stay_within_the_topic_limit(count, topics, limit, sizes):
+    channels = list(range(count))
+    shards = shardChannels(channels, topics, limit)
+    assert [len(shard) for shard in shards] == sizes
+    assert sum(shards, []) == channels
+
+def test_too_many_connections_is_warned_about(caplog):
+    with caplog.at_level(logging.INFO):
+        shardChannels(list(range(10 * MAX_CONNECTIONS)), 10)
+    assert 'Twitch recommends no more than' in caplog.text
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        shardChannels(list(range(5 * MAX_CONNECTIONS)), 10)
+    assert caplog.text == ''
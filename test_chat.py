@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+from chat import ChatQueue
+
+# Queue msgs ([(channel, msg)]) and return [(send time, channel, msg)] once count have been sent
+def sendAll(queue, msgs, count):
+    sent = []
+    async def send(channel, msg):
+        sent.append((time.monotonic(), channel, msg))
+    queue.send = send
+
+    async def run():
+        for channel, msg in msgs:
+            queue.put(channel, msg)
+        while len(sent) < count:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+    asyncio.run(run())
+    return sent
+
+def test_never_more_than_limit_per_period():
+    queue = ChatQueue(None, limit=5, period=0.3)
+    sent = sendAll(queue, [('channel', f'message {i}') for i in range(12)], 12)
+
+    assert [msg for at, channel, msg in sent] == [f'message {i}' for i in range(12)]
+    # The first limit go straight out, after that any limit+1 in a row span a whole period
+    times = [at for at, channel, msg in sent]
+    assert times[4] - times[0] < 0.1
+    for first, last in zip(times, times[5:]):
+        assert last - first >= 0.3
+
+def test_me_lines_are_merged_at_the_limit():
+    queue = ChatQueue(None, limit=2, period=0.3)
+    sent = sendAll(queue, [('channel', msg) for msg in ('/me one', '/me two', '/me three', '/me four', '/me five')], 3)
+
+    assert [msg for at, channel, msg in sent] == ['/me one', '/me two', '/me three | four | five']
+    assert queue.merged == 2
+
+def test_other_channels_and_plain_lines_are_not_merged():
+    msgs = [('a', 'hello'), ('a', '/me one'), ('b', '/me two'), ('b', 'plain')]
+    queue = ChatQueue(None, limit=1, period=0.1)
+    sent = sendAll(queue, msgs, 4)
+
+    assert [(channel, msg) for at, channel, msg in sent] == msgs
+    assert queue.merged == 0
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from cmdqueue import CommandQueue, commandPriority, isMergeable, PRIO_TITLE, PRIO_EFFECT, PRIO_OTHER, PRIO_SUMMON
+from mccommands import CommandBuilder
+
+DIALECTS = ['1.12', '1.20.1']
+
+@pytest.mark.parametrize('mcver', DIALECTS)
+def test_summons_are_last_and_mergeable(mcver):
+    mc = CommandBuilder(mcver, ['mobs'], 'Player')
+    for cmd in mc.summon('minecraft:zombie', '', 1, 'viewer'):
+        assert commandPriority(cmd) == PRIO_SUMMON
+        assert isMergeable(cmd)
+
+@pytest.mark.parametrize('mcver', DIALECTS)
+def test_effects_sounds_and_particles(mcver):
+    mc = CommandBuilder(mcver, ['mobs'], 'Player')
+    for cmd in mc.effect('minecraft:nausea', 5, 1):
+        assert commandPriority(cmd) == PRIO_EFFECT
+        assert isMergeable(cmd)
+    for cmd in mc.sound('entity.creeper.primed') + mc.particle('explosion_emitter', 1, 5):
+        assert commandPriority(cmd) == PRIO_EFFECT
+        assert not isMergeable(cmd)
+
+@pytest.mark.parametrize('mcver', DIALECTS)
+def test_titles_and_other_commands(mcver):
+    mc = CommandBuilder(mcver, ['mobs'], 'Player')
+    for cmd in mc.title('A summon of mobs', 'by viewer', 'red', 'yellow'):
+        assert commandPriority(cmd) == PRIO_TITLE
+    for cmd in mc.give('minecraft:diamond', 1) + mc.cmd('time set night'):
+        assert commandPriority(cmd) == PRIO_OTHER
+        assert not isMergeable(cmd)
+
+class FakePool:
+    def __init__(self):
+        self.sent = []
+
+    async def command(self, cmd):
+        self.sent.append(cmd)
+        return ''
+
+@pytest.mark.parametrize('mcver', DIALECTS)
+def test_merged_summons_are_capped_by_mobscale(mcver):
+    async def run():
+        pool = FakePool()
+        queue = CommandQueue(pool, rate=1000, maxdepth=1, summoncap=4)
+        queue.mobscale = 0.5
+        summon = CommandBuilder(mcver, ['mobs'], 'Player').summon('minecraft:zombie', '', 1, 'viewer')[0]
+        await asyncio.gather(*queue.submit([summon] * 10))
+        await queue.stop()
+        return queue, pool.sent
+    queue, sent = asyncio.run(run())
+    assert queue.merged == 9
+    assert len(sent) == 2
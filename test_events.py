@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+import pubsub
+from events import BitsEvent, EventError, HypeTrainEvent, PointsEvent, SubEvent
+
+CHEER = {
+    'message_id': 'm1',
+    'data': {'context': 'cheer', 'user_name': 'viewer', 'user_id': '42', 'bits_used': '250',
+             'chat_message': 'Cheer250', 'time': '2024-05-01T12:00:00Z'},
+}
+
+def test_bits():
+    cheer = BitsEvent.fromPubSub(CHEER)
+    assert (cheer.message_id, cheer.user, cheer.user_id, cheer.bits) == ('m1', 'viewer', '42', 250)
+    anon = BitsEvent.fromPubSub({'data': dict(CHEER['data'], user_name=None)})
+    assert anon.user == 'Anonymous' and anon.message_id is None
+
+def test_merged_cheers_add_up():
+    first = BitsEvent.fromPubSub(CHEER)
+    second = BitsEvent.fromPubSub({'message_id': 'm2', 'data': dict(CHEER['data'], bits_used=100, chat_message='')})
+    third = BitsEvent.fromPubSub({'message_id': 'm3', 'data': dict(CHEER['data'], bits_used=50, chat_message='Cheer50')})
+    assert BitsEvent.merge([first]) is first
+    merged = BitsEvent.merge([first, second, third])
+    assert (merged.message_id, merged.bits, merged.chat_message) == ('m1', 400, 'Cheer250 Cheer50')
+
+def test_gifted_sub():
+    sub = SubEvent.fromPubSub({'context': 'subgift', 'display_name': 'Gifter', 'user_id': '42',
+                               'recipient_display_name': 'Lucky', 'recipient_id': '43', 'sub_plan': '1000',
+                               'multi_month_duration': 3, 'time': '2024-05-01T12:00:00Z'})
+    assert sub.gift and (sub.user, sub.recipient, sub.duration, sub.months, sub.text) == ('Gifter', 'Lucky', 3, 1, '')
+
+def test_points_input_only_when_required():
+    message = {'type': 'reward-redeemed', 'data': {'timestamp': '2024-05-01T12:00:00Z', 'redemption': {
+        'id': 'r1', 'user': {'id': '42', 'login': 'viewer', 'display_name': 'Viewer'},
+        'reward': {'id': 'w1', 'title': 'Spawn a mob', 'is_user_input_required': False},
+        'user_input': 'ignored'}}}
+    redemption = PointsEvent.fromPubSub(message)
+    assert (redemption.reward, redemption.user, redemption.user_input) == ('Spawn a mob', 'Viewer', '')
+    message['data']['redemption']['reward']['is_user_input_required'] = True
+    assert PointsEvent.fromPubSub(message).user_input == 'ignored'
+
+def test_hype_train_kinds():
+    progress = {'level': {'value': 2}, 'value': '300', 'goal': '1800', 'total': '1900', 'remaining_seconds': 120}
+    update = HypeTrainEvent.fromPubSub({'type': 'hype-train-progression', 'data': {'progress': progress, 'user_display_name': 'Viewer'}})
+    assert (update.user, update.progress.level, update.progress.total, update.progress.remaining) == ('Viewer', 2, 1900, 120)
+
+    conductor = HypeTrainEvent.fromPubSub({'type': 'hype-train-conductor-update',
+                                           'data': {'source': 'BITS', 'user': {'login': 'viewer'}}})
+    assert (conductor.user, conductor.source, conductor.progress) == ('viewer', 'BITS', None)
+    assert HypeTrainEvent.fromPubSub({'type': 'hype-train-end', 'data': {'ending_reason': 'EXPIRE'}}).reason == 'EXPIRE'
+    assert HypeTrainEvent.fromPubSub({'type': 'hype-train-cooldown-expiration'}).type == 'hype-train-cooldown-expiration'
+
+@pytest.mark.parametrize('message', [
+    {'data': {'context': 'cheer'}},                                 # missing field
+    {'data': dict(CHEER['data'], bits_used='lots')},                # not a number
+    {'data': None},                                                 # wrong type
+])
+def test_bad_payloads_raise_event_error(message):
+    with pytest.raises(EventError, match='Invalid BitsEvent payload'):
+        BitsEvent.fromPubSub(message)
+
+def test_invalid_messages_are_counted_not_raised():
+    invalid = pubsub.pubsub_invalid.labels('channel-bits-events-v2')
+    before = invalid.value
+    assert pubsub.decodeEvent('channel-bits-events-v2', BitsEvent, '{"data": {}}') is None
+    assert pubsub.decodeEvent('channel-bits-events-v2', BitsEvent, 'not json') is None
+    assert invalid.value == before + 2
+    assert pubsub.decodeEvent('channel-bits-events-v2', BitsEvent, json.dumps(CHEER)).bits == 250
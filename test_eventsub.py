@@ -0,0 +1,94 @@
+import pubsub
+from eventsub import SUBSCRIPTIONS
+from events import BitsEvent, FollowEvent, HypeTrainEvent, PointsEvent, PollEvent, RaidEvent, SubEvent
+
+METADATA = {'message_id': 'msg1', 'message_timestamp': '2024-05-01T12:00:00.123456789Z'}
+
+# Normalize an EventSub notification and decode it the way the topic's handler gets it
+def decode(stype, event, state = None):
+    version, prefix, field, normalize = SUBSCRIPTIONS[stype]
+    eventcls = pubsub.topicHandlers[prefix][1]
+    return [eventcls.fromPubSub(message) for message in normalize(event, METADATA, {} if state is None else state)]
+
+USER = {'user_id': '42', 'user_login': 'viewer', 'user_name': 'Viewer'}
+
+def test_follow_and_raid():
+    [follow] = decode('channel.follow', dict(USER, followed_at='2024-05-01T12:00:00Z'))
+    assert isinstance(follow, FollowEvent)
+    assert (follow.user_id, follow.username) == ('42', 'viewer')
+
+    [raid] = decode('channel.raid', {'to_broadcaster_user_id': '7', 'to_broadcaster_user_login': 'other',
+                                     'to_broadcaster_user_name': 'Other', 'viewers': 12})
+    assert isinstance(raid, RaidEvent)
+    assert (raid.target_id, raid.target, raid.viewer_count) == ('7', 'Other', 12)
+
+def test_cheer():
+    [cheer] = decode('channel.cheer', dict(USER, is_anonymous=False, bits=250, message='Cheer250 hi'))
+    assert isinstance(cheer, BitsEvent)
+    assert (cheer.message_id, cheer.user, cheer.bits, cheer.chat_message) == ('msg1', 'Viewer', 250, 'Cheer250 hi')
+
+    [anon] = decode('channel.cheer', dict(USER, is_anonymous=True, bits=100, message=''))
+    assert anon.user == 'Anonymous'
+
+def test_subs_and_resubs():
+    [sub] = decode('channel.subscribe', dict(USER, tier='1000', is_gift=False))
+    assert isinstance(sub, SubEvent)
+    assert (sub.context, sub.user, sub.plan, sub.gift) == ('sub', 'Viewer', '1000', False)
+    # Gifts are rewarded from channel.subscription.gift, which names the gifter
+    assert decode('channel.subscribe', dict(USER, tier='1000', is_gift=True)) == []
+
+    [resub] = decode('channel.subscription.message', dict(USER, tier='2000', cumulative_months=14,
+                                                          message={'text': 'Hello'}))
+    assert (resub.context, resub.months, resub.text) == ('resub', 14, 'Hello')
+
+def test_gift_bomb_is_one_event_per_gift():
+    gifts = decode('channel.subscription.gift', dict(USER, tier='1000', total=3, is_anonymous=False))
+    assert len(gifts) == 3
+    assert all(gift.gift and gift.context == 'subgift' and gift.user == 'Viewer' for gift in gifts)
+    assert len({gift.message_id for gift in gifts}) == 3
+    # All in the same burst
+    assert len({pubsub.subBurstKey(gift) for gift in gifts}) == 1
+
+    [anon] = decode('channel.subscription.gift', dict(USER, tier='1000', total=1, is_anonymous=True))
+    assert anon.context == 'anonsubgift' and anon.user is None
+
+def test_redemption():
+    event = dict(USER, id='r1', redeemed_at='2024-05-01T12:00:00Z', user_input='creeper',
+                 reward={'id': 'w1', 'title': 'Spawn a mob', 'cost': 500, 'prompt': 'Which one?'})
+    [redemption] = decode('channel.channel_points_custom_reward_redemption.add', event)
+    assert isinstance(redemption, PointsEvent)
+    assert (redemption.redemption_id, redemption.reward, redemption.reward_id) == ('r1', 'Spawn a mob', 'w1')
+    assert (redemption.user, redemption.user_id, redemption.user_input) == ('Viewer', '42', 'creeper')
+
+def test_polls():
+    event = {'id': 'p1', 'title': 'Best mob?', 'status': 'active',
+             'choices': [{'id': 'c1', 'title': 'Creeper', 'votes': 3}, {'id': 'c2', 'title': 'Zombie'}]}
+    [poll] = decode('channel.poll.progress', event)
+    assert isinstance(poll, PollEvent)
+    assert (poll.type, poll.poll_id, poll.title) == ('POLL_UPDATE', 'p1', 'Best mob?')
+    assert [(c.choice_id, c.title, c.votes) for c in poll.choices] == [('c1', 'Creeper', 3), ('c2', 'Zombie', 0)]
+
+    assert decode('channel.poll.begin', event)[0].type == 'POLL_CREATE'
+    assert decode('channel.poll.end', dict(event, status='completed'))[0].type == 'POLL_COMPLETE'
+    assert decode('channel.poll.end', dict(event, status='terminated'))[0].type == 'POLL_TERMINATE'
+
+def test_hype_train_levels_up_from_progress():
+    state = {}
+    def progress(level, total, **extra):
+        return dict({'level': level, 'progress': total % 1000, 'goal': 1000, 'total': total}, **extra)
+
+    [start] = decode('channel.hype_train.begin', progress(1, 100), state)
+    assert isinstance(start, HypeTrainEvent)
+    assert start.type == 'hype-train-start'
+    assert (start.progress.level, start.progress.total, start.progress.remaining) == (1, 100, None)
+
+    [update] = decode('channel.hype_train.progress', progress(1, 600, last_contribution={'user_name': 'Viewer'}), state)
+    assert (update.type, update.user, update.progress.value) == ('hype-train-progression', 'Viewer', 600)
+
+    [levelup] = decode('channel.hype_train.progress', progress(2, 1200), state)
+    assert (levelup.type, levelup.progress.level) == ('hype-train-level-up', 2)
+
+    [end] = decode('channel.hype_train.end', {'level': 5, 'total': 9000}, state)
+    assert (end.type, end.reason) == ('hype-train-end', 'COMPLETED')
+    assert state == {}
+    assert decode('channel.hype_train.end', {'level': 2, 'total': 1500})[0].reason == 'EXPIRE'
@@ -0,0 +1,97 @@
+import asyncio
+
+from cmdqueue import CommandQueue
+from fanout import CircuitBreaker, RconTarget
+from rcon import RconError
+
+# A command queue whose server answers after delay seconds, or fails while down
+class FakeQueue:
+    def __init__(self, delay = 0.02):
+        self.delay   = delay
+        self.down    = True
+        self.batches = 0
+
+    def submit(self, cmds, timeout = None):
+        self.batches += 1
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for cmd in cmds]
+        def answer():
+            for future in futures:
+                if not future.done():
+                    if self.down:
+                        future.set_exception(RconError('connection refused'))
+                    else:
+                        future.set_result('ok')
+        loop.call_later(self.delay, answer)
+        return futures
+
+def test_breaker_opens_and_lets_one_probe_through():
+    async def run():
+        queue = FakeQueue()
+        target = RconTarget('test', queue, 'Player', breaker=CircuitBreaker(failures=2, cooldown=0.05))
+        for _ in range(2):
+            await target.send(['say hi'])
+        assert queue.batches == 2
+
+        # Open: nothing goes out
+        cmds, results = await target.send(['say hi'])
+        assert queue.batches == 2 and isinstance(results[0], RconError)
+
+        # Half open: of several batches at once only one reaches the server
+        await asyncio.sleep(0.06)
+        queue.down = False
+        sent = await asyncio.gather(*(target.send(['say hi']) for _ in range(5)))
+        assert queue.batches == 3
+        assert sum(1 for cmds, results in sent if results == ['ok']) == 1
+
+        # The probe worked, so the breaker is closed again
+        await asyncio.gather(*(target.send(['say hi']) for _ in range(3)))
+        assert queue.batches == 6
+    asyncio.run(run())
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker(failures=1, cooldown=0)
+    assert breaker.allow() and not breaker.probing
+    assert breaker.failure()
+    assert breaker.allow() and breaker.probing
+    assert not breaker.allow()
+    assert breaker.failure(probe=True)
+    assert not breaker.probing and breaker.opened is not None
+
+def test_abandoned_probe_lets_another_through():
+    breaker = CircuitBreaker(failures=1, cooldown=0)
+    breaker.failure()
+    assert breaker.allow()
+    breaker.abandon(True)
+    assert breaker.allow() and breaker.probing
+
+class SlowPool:
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def command(self, cmd):
+        await asyncio.sleep(self.delay)
+        return 'ok'
+
+def test_timeout_does_not_count_the_queue_wait():
+    async def run():
+        queue = CommandQueue(SlowPool(0.03), rate=1000)
+        target = RconTarget('test', queue, 'Player', timeout=0.1, breaker=CircuitBreaker(failures=1))
+        # Together they wait in the queue far longer than the timeout, each exchange doesn't
+        sent = await asyncio.gather(*(target.send(['say hi', 'say there']) for _ in range(5)))
+        await queue.stop()
+        return target, sent
+    target, sent = asyncio.run(run())
+    assert all(results == ['ok', 'ok'] for cmds, results in sent)
+    assert target.breaker.opened is None
+
+def test_slow_exchange_times_out():
+    async def run():
+        queue = CommandQueue(SlowPool(1), rate=1000)
+        target = RconTarget('test', queue, 'Player', timeout=0.05, breaker=CircuitBreaker(failures=1))
+        cmds, results = await target.send(['say hi'])
+        await queue.stop()
+        return target, results
+    target, results = asyncio.run(run())
+    assert isinstance(results[0], RconError) and 'Timed out' in str(results[0])
+    assert target.breaker.opened is not None
@@ -0,0 +1,52 @@
+import time
+
+from events import HypeProgress
+from hypetrain import HypeTrain
+from journal import EventJournal
+from jsonlib import dumps, loads
+
+def runningTrain():
+    train = HypeTrain()
+    train.start(HypeProgress(1, 100, 1600, 100, 300))
+    train.update(HypeProgress(1, 600, 1600, 600, 280), 'viewer1')
+    train.update(HypeProgress(2, 200, 1800, 1800, 300), 'viewer2')
+    train.update(HypeProgress(2, 300, 1800, 1900, 290), 'viewer1')
+    train.conductor('BITS', 'viewer2')
+    return train
+
+def test_contributions_come_from_the_total():
+    train = runningTrain()
+    assert (train.level, train.value, train.goal, train.total, train.perc) == (2, 300, 1800, 1900, 16)
+    assert train.top() == [('viewer2', 1200), ('viewer1', 600)]
+    # A repeated (or out of date) update doesn't count twice
+    train.update(HypeProgress(2, 300, 1800, 1900, 290), 'viewer1')
+    assert train.contributions['viewer1'] == 600
+
+def test_restored_from_the_journal(tmp_path):
+    train = runningTrain()
+    journal = EventJournal(str(tmp_path / 'journal.db'))
+    journal.saveState('hypetrain.1234', dumps(train.snapshot()))
+    journal.close()
+
+    journal = EventJournal(str(tmp_path / 'journal.db'))
+    restored = HypeTrain()
+    assert restored.restore(loads(journal.loadState('hypetrain.1234')))
+    assert restored.snapshot() == train.snapshot()
+    assert restored.conductors == {'BITS': 'viewer2'}
+
+def test_finished_or_expired_trains_are_not_restored():
+    train = runningTrain()
+    train.end()
+    assert not HypeTrain().restore(train.snapshot())
+
+    train = runningTrain()
+    snapshot = dict(train.snapshot(), expires=time.time() - 1)
+    restored = HypeTrain()
+    assert not restored.restore(snapshot)
+    assert not restored.active and restored.total == 0
+
+    # Without an expiry it is kept for maxage after the start
+    snapshot = dict(train.snapshot(), expires=0, started=time.time() - 60)
+    assert HypeTrain().restore(snapshot, maxage=120)
+    assert not HypeTrain().restore(snapshot, maxage=30)
+    assert not HypeTrain().restore(None)
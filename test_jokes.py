@@ -0,0 +1,104 @@
+import asyncio
+import itertools
+import json
+
+import pytest
+
+from jokes import HttpClient, JokeCache
+
+# Stub joke server: numbered jokes over keep-alive HTTP/1.1, stalling for delay seconds
+# before answering or failing with status
+class JokeServer:
+    def __init__(self, delay = 0, status = 200, chunked = False):
+        self.delay       = delay
+        self.status      = status
+        self.chunked     = chunked
+        self.connections = 0
+        self.requests    = 0
+        self._jokes      = itertools.count(1)
+        self._server     = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._client, '127.0.0.1', 0)
+        self.url = f'http://127.0.0.1:{self._server.sockets[0].getsockname()[1]}/'
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _client(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request = await reader.readuntil(b'\r\n\r\n')
+                self.requests += 1
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                body = json.dumps({'joke': f'Joke {next(self._jokes)}'}).encode()
+                if self.chunked:
+                    head = b'Transfer-Encoding: chunked'
+                    body = b'%x\r\n%s\r\n0\r\n\r\n' % (len(body), body)
+                else:
+                    head = b'Content-Length: %d' % len(body)
+                writer.write(b'HTTP/1.1 %d OK\r\n%s\r\n\r\n%s' % (self.status, head, body))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+def serve(test, **kwargs):
+    async def run():
+        server = await JokeServer(**kwargs).start()
+        try:
+            return await test(server)
+        finally:
+            await server.stop()
+    return asyncio.run(run())
+
+@pytest.mark.parametrize('chunked', [False, True])
+def test_connection_is_kept_alive(chunked):
+    async def test(server):
+        client = HttpClient(server.url)
+        bodies = [(await client.get())[1] for _ in range(3)]
+        client.close()
+        assert [json.loads(body)['joke'] for body in bodies] == ['Joke 1', 'Joke 2', 'Joke 3']
+        assert server.connections == 1
+    serve(test, chunked=chunked)
+
+def test_timeout_drops_the_connection():
+    async def test(server):
+        client = HttpClient(server.url, timeout=0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await client.get()
+        # The late reply can't be read as the answer to the next request, that goes over
+        # a new connection
+        server.delay = 0
+        status, body = await client.get()
+        client.close()
+        assert status == 200 and json.loads(body)['joke']
+        assert server.connections == 2
+    serve(test, delay=0.2)
+
+def test_empty_cache_fetches_directly_and_refills():
+    async def test(server):
+        cache = JokeCache(server.url, size=3, lowwater=1)
+        assert await cache.get() == 'Joke 1'
+        # Running low started a refill in the background
+        await cache._refill
+        assert len(cache) == 3
+        assert [cache.take() for _ in range(3)] == ['Joke 2', 'Joke 3', 'Joke 4']
+        await cache._refill
+        cache.client.close()
+        assert server.connections == 1
+    serve(test)
+
+def test_failing_server_gives_no_joke():
+    async def test(server):
+        cache = JokeCache(server.url, retries=2)
+        assert await cache.fetch() is None
+        assert len(cache) == 0
+        cache.client.close()
+        assert server.requests == 3
+    serve(test, status=503)
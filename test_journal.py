@@ -0,0 +1,66 @@
+import asyncio
+
+import pubsub
+from journal import EventJournal, DONE, FAILED, PENDING, SKIPPED
+
+def makeJournal(tmp_path):
+    return EventJournal(str(tmp_path / 'journal.db'))
+
+def test_record_drops_duplicates(tmp_path):
+    journal = makeJournal(tmp_path)
+    eid = journal.record('m1', '1234', 'channel-bits-events-v2', 'cheer', 'Viewer', '{}')
+    assert eid is not None
+    assert journal.record('m1', '1234', 'channel-bits-events-v2', 'cheer', 'Viewer', '{}') is None
+
+def test_duplicates_are_found_on_disk_after_restart(tmp_path):
+    journal = makeJournal(tmp_path)
+    journal.record('m1', '1234', 'channel-bits-events-v2', 'cheer', 'Viewer', '{}')
+    journal.close()
+
+    journal = EventJournal(str(tmp_path / 'journal.db'), recent=0)
+    assert journal.record('m1', '1234', 'channel-bits-events-v2', 'cheer', 'Viewer', '{}') is None
+
+def test_unfinished_is_pending_and_failed_only(tmp_path):
+    journal = makeJournal(tmp_path)
+    eids = {state: journal.record(state, '1234', 'channel-bits-events-v2', 'cheer', 'viewer', '{}')
+            for state in (PENDING, FAILED, DONE, SKIPPED)}
+    journal.failed(eids[FAILED], 'rcon down')
+    journal.done(eids[DONE])
+    journal.skipped(eids[SKIPPED], 'throttled')
+
+    entries = journal.unfinished()
+    assert [entry.id for entry in entries] == [eids[PENDING], eids[FAILED]]
+    assert [entry.state for entry in entries] == [PENDING, FAILED]
+
+def test_unfinished_skips_old_and_retried_events(tmp_path):
+    journal = makeJournal(tmp_path)
+    eid = journal.record('m1', '1234', 'channel-bits-events-v2', 'cheer', 'viewer', '{}')
+    for _ in range(3):
+        journal.start(eid)
+        journal.failed(eid, 'rcon down')
+    assert journal.unfinished() == []
+    assert [entry.id for entry in journal.unfinished(maxattempts=4)] == [eid]
+    assert journal.unfinished(maxage=-1) == []
+
+def test_latest_by_user_and_kind(tmp_path):
+    journal = makeJournal(tmp_path)
+    journal.record('m1', '1234', 'channel-bits-events-v2', 'cheer', 'Viewer', '{}')
+    sub = journal.record('m2', '1234', 'channel-subscribe-events-v1', 'sub', 'Viewer', '{}')
+    cheer = journal.record('m3', '1234', 'channel-bits-events-v2', 'cheer', 'Viewer', '{}')
+    assert journal.latest('1234', 'viewer').id == cheer
+    assert journal.latest('1234', 'VIEWER', 'sub').id == sub
+    assert journal.latest('5678', 'viewer') is None
+
+def test_replay_is_limited_to_the_startup_snapshot(tmp_path, monkeypatch):
+    journal = makeJournal(tmp_path)
+    old = journal.record('m1', '1234', 'channel-bits-events-v2', 'cheer', 'viewer', '{}')
+    snapshot = journal.unfinished()
+    # Arrives live while RCON is warming up, and is handled by the live path
+    journal.record('m2', '1234', 'channel-bits-events-v2', 'cheer', 'viewer', '{}')
+
+    replayed = []
+    monkeypatch.setattr(pubsub, 'journal', journal)
+    monkeypatch.setattr(pubsub, 'commandqueues', [])
+    monkeypatch.setattr(pubsub, 'replayEvent', lambda entry, throttle = False: replayed.append(entry.id))
+    asyncio.run(pubsub.replayJournal(snapshot))
+    assert replayed == [old]
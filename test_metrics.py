@@ -0,0 +1,36 @@
+import threading
+
+from metrics import Counter, Histogram, Registry
+
+def test_snapshot_while_another_thread_adds_labels():
+    registry = Registry()
+    counter = Counter('test_total', 'Test', ['n'], registry=registry)
+    hist = Histogram('test_seconds', 'Test', ['n'], registry=registry)
+    errors = []
+    stop = threading.Event()
+
+    def read():
+        try:
+            while not stop.is_set():
+                registry.snapshot()
+                registry.render()
+        except RuntimeError as ex:
+            errors.append(ex)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for n in range(2000):
+        counter.labels(str(n)).inc()
+        hist.labels(str(n)).observe(0.01)
+    stop.set()
+    reader.join()
+    assert errors == []
+    assert registry.snapshot()['test_total{n="1999"}'] == 1
+
+def test_snapshot_values():
+    registry = Registry()
+    Counter('events_total', 'Test', registry=registry).inc(3)
+    hist = Histogram('latency_seconds', 'Test', registry=registry)
+    hist.observe(0.5)
+    hist.observe(1.5)
+    assert registry.snapshot() == {'events_total': 3, 'latency_seconds_count': 2, 'latency_seconds_sum': 2.0}
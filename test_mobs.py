@@ -0,0 +1,26 @@
+import random
+from collections import Counter
+
+from mobs import MobSampler
+
+def test_hostile_share_follows_the_chances():
+    random.seed(1)
+    sampler = MobSampler(['vanilla'])
+    mobs = sampler.draw(passivechance=3, hostilechance=6, k=20000)
+    hostiles = sum(1 for mob in mobs if mob in sampler.hostile)
+    # 16 passive mobs at 3 vs 8 hostile mobs at 6: half of them hostile
+    assert abs(hostiles / len(mobs) - 0.5) < 0.02
+
+def test_mobs_in_a_class_are_equally_likely():
+    random.seed(2)
+    sampler = MobSampler(['vanilla'])
+    counts = Counter(sampler.draw(passivechance=1, hostilechance=0, k=16000))
+    assert set(counts) == set(sampler.passive)
+    assert max(counts.values()) - min(counts.values()) < 250
+
+def test_sizes_are_filled_in():
+    sampler = MobSampler(['litv'])
+    for mob in sampler.draw(k=5, sub=True):
+        assert '{size}' not in mob
+    assert MobSampler(['litv']).draw(passivechance=0, hostilechance=5) == []
+    assert sampler.pick(passivechance=0) == ''
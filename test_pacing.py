@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from pacing import PacingController, parseHealth, probeCommand, rcon_server_tps
+
+@pytest.mark.parametrize('mcver, mcmodes, command', [
+    ('1.12', ['chancecubes'], 'forge tps'),
+    ('1.12', ['mobs'], 'forge tps'),
+    ('1.12', ['mobs', 'vanilla'], None),
+    ('1.12', ['mobs', 'spigot'], 'tps'),
+    ('1.16.5', ['mobs', 'forge'], 'forge tps'),
+    ('1.20.1', ['mobs'], None),
+    ('1.20.4', ['mobs', 'vanilla'], 'tick query'),
+    ('1.20.4', ['mobs', 'spark'], 'spark tps'),
+    ('snapshot', ['mobs'], None),
+])
+def test_probe_command(mcver, mcmodes, command):
+    assert probeCommand(mcver, mcmodes) == command
+
+def test_parse_forge_tps():
+    text = ('Dim  0 (overworld) : Mean tick time: 12.034 ms. Mean TPS: 20.000\n'
+            'Overall : Mean tick time: 62.500 ms. Mean TPS: 16.000')
+    # The first (overworld) line is the one read
+    assert parseHealth(text) == (20.0, 12.034)
+
+def test_parse_spigot_tps_has_no_tick_time():
+    assert parseHealth('§6TPS from last 1m, 5m, 15m: §a19.5, §a*20.0, §a*20.0') == (19.5, None)
+
+def test_parse_vanilla_tick_query():
+    tps, mspt = parseHealth('Target tick rate: 20.0 per second.\nAverage time per tick: 62.5ms (Target: 50.0ms)')
+    assert (tps, mspt) == (16.0, 62.5)
+
+def test_parse_spark_tps():
+    text = ('TPS from last 5s, 10s, 1m, 5m, 15m:\n *20.0, *20.0, *20.0, *20.0, *20.0\n\n'
+            'Tick durations (min/med/95%ile/max ms) from last 10s, 1m:\n 1.2/3.4/8.9/20.1;  1.0/3.1/7.5/30.2')
+    assert parseHealth(text) == (20.0, 3.4)
+
+def test_parse_idle_tick_time():
+    assert parseHealth('Average time per tick: 0.0ms (Target: 50.0ms)') == (20.0, 0.0)
+
+def test_parse_nothing():
+    assert parseHealth('Unknown command') == (None, None)
+
+class FakeQueue:
+    rate     = 30
+    mobscale = 1.0
+    pool     = None
+
+def test_aimd():
+    queue = FakeQueue()
+    pacer = PacingController(queue, 'forge tps', 'test', minrate=2, minscale=0.2)
+    for _ in range(6):
+        pacer.adjust(True, False)
+    assert (queue.rate, queue.mobscale) == (2, 0.2)
+
+    pacer.adjust(False, False)
+    assert (queue.rate, queue.mobscale) == (2, 0.2)
+
+    for _ in range(20):
+        pacer.adjust(False, True)
+    assert (queue.rate, queue.mobscale) == (30, 1.0)
+
+class AnsweringPool:
+    def __init__(self, resp):
+        self.resp = resp
+
+    async def command(self, cmd):
+        return self.resp
+
+def test_sample_keeps_gauges_numeric():
+    queue = FakeQueue()
+    queue.pool = AnsweringPool('Average time per tick: 0.0ms (Target: 50.0ms)')
+    pacer = PacingController(queue, 'tick query', 'idle')
+    asyncio.run(pacer.sample())
+    assert rcon_server_tps.values()['rcon_server_tps{server="idle"}'] == 20.0
+
+    queue.pool = AnsweringPool('Unknown command')
+    pacer = PacingController(queue, 'tick query', 'unknown')
+    asyncio.run(pacer.sample())
+    assert all(isinstance(v, float) for v in rcon_server_tps.values().values())
@@ -0,0 +1,44 @@
+import random
+
+from events import PollEvent
+from polls import PollTally
+
+def pollEvent(votes, mtype = 'POLL_UPDATE'):
+    choices = [{'choice_id': f'c{n}', 'title': f'Choice {n}', 'votes': {'total': v}} for n, v in enumerate(votes)]
+    return PollEvent.fromPubSub({'type': mtype, 'data': {'poll': {'poll_id': 'p1', 'title': 'Best mob?', 'choices': choices}}})
+
+# What the tally should hold, worked out from scratch
+def expected(votes, k = 3):
+    top = max(votes)
+    leaders = [f'Choice {n}' for n, v in enumerate(votes) if v == top]
+    ranked = sorted(range(len(votes)), key=lambda n: votes[n], reverse=True)[:k]
+    return sum(votes), leaders, [(f'Choice {n}', votes[n]) for n in ranked]
+
+def test_incremental_tally_matches_a_rescan():
+    rng = random.Random(7)
+    tally = PollTally('p1')
+    votes = [0] * 5
+    for _ in range(200):
+        votes[rng.randrange(5)] += rng.randrange(3)
+        tally.update(pollEvent(votes))
+        total, leaders, top = expected(votes)
+        assert tally.total == total
+        assert sorted(tally.winners()) == sorted(leaders)
+        assert [v for name, v in tally.top()] == [v for name, v in top]
+
+def test_tally_started_mid_poll():
+    # eg. after a restart: the first update seen already has votes in it
+    tally = PollTally('p1')
+    tally.update(pollEvent([4, 9, 9, 1]))
+    assert tally.title == 'Best mob?'
+    assert (tally.total, tally.maxvotes) == (23, 9)
+    assert tally.winners() == ['Choice 1', 'Choice 2']
+    assert tally.top() == [('Choice 1', 9), ('Choice 2', 9), ('Choice 0', 4)]
+
+def test_votes_going_down_rescan():
+    tally = PollTally('p1')
+    tally.update(pollEvent([5, 3, 1]))
+    tally.update(pollEvent([2, 3, 1], 'POLL_COMPLETE'))
+    assert tally.total == 6
+    assert tally.winners() == ['Choice 1']
+    assert tally.top() == [('Choice 1', 3), ('Choice 0', 2), ('Choice 2', 1)]
@@ -0,0 +1,113 @@
+import asyncio
+
+import pubsub
+from chat import ChatQueue
+from cmdqueue import CommandQueue
+from dispatch import EventDispatcher
+from fanout import RconTarget
+from events import HypeProgress, HypeTrainEvent
+from hypetrain import HypeTrain
+from journal import EventJournal
+from jsonlib import loads
+
+class Channel:
+    channel_id = '1234'
+    chat       = 'channel'
+
+    def __init__(self):
+        self.hypetrain = HypeTrain()
+
+class Irc:
+    def __init__(self):
+        self.sent = []
+
+    async def send_privmsg(self, channel, msg):
+        self.sent.append((channel, msg))
+
+class ChatBot:
+    def __init__(self):
+        self.irc = Irc()
+
+def test_handlers_chat_before_the_chat_bot_has_loaded(tmp_path, monkeypatch):
+    journal = EventJournal(str(tmp_path / 'journal.db'))
+    monkeypatch.setattr(pubsub, 'journal', journal)
+    monkeypatch.setattr(pubsub, 'chatbot', None)
+    monkeypatch.setattr(pubsub, 'chatqueue', ChatQueue(pubsub.sendChat))
+    ctx = Channel()
+
+    async def run():
+        monkeypatch.setattr(pubsub, '_chatready', asyncio.Event())
+        start = HypeTrainEvent('hype-train-start', HypeProgress(1, 100, 1600, 100, 300))
+        await pubsub.handleHypeTrain(ctx, start)
+        # The snapshot is saved even though there's no chat bot yet
+        assert loads(journal.loadState('hypetrain.1234'))
+        await asyncio.sleep(0.05)
+
+        # Held until the bot is there, then sent in order
+        bot = ChatBot()
+        monkeypatch.setattr(pubsub, 'chatbot', bot)
+        pubsub._chatready.set()
+        while len(bot.irc.sent) < 3:
+            await asyncio.sleep(0.01)
+        await pubsub.chatqueue.stop()
+        return bot.irc.sent
+    sent = asyncio.run(run())
+    assert [msg for channel, msg in sent][1] == '/me ~ The HYPE TRAIN has arrived ~'
+    assert {channel for channel, msg in sent} == {'channel'}
+
+def test_failed_startup_is_logged_and_stops_the_loop(caplog):
+    async def fail():
+        raise FileNotFoundError('configs/config.json')
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.create_task(fail()).add_done_callback(pubsub.startupDone)
+        loop.call_later(5, loop.stop)
+        loop.run_forever()
+        assert 'Startup failed' in caplog.text
+        assert 'configs/config.json' in caplog.text
+    finally:
+        loop.close()
+
+class StalledPool:
+    def __init__(self):
+        self.sent = []
+        self.go = asyncio.Event()
+
+    async def command(self, cmd):
+        await self.go.wait()
+        self.sent.append(cmd)
+        return ''
+
+class RconChannel:
+    def __init__(self, queue):
+        self.targets = [RconTarget('server', queue, 'Player')]
+
+def test_rcon_backlog_builds_up_in_the_command_queue(tmp_path, monkeypatch):
+    journal = EventJournal(str(tmp_path / 'journal.db'))
+    monkeypatch.setattr(pubsub, 'journal', journal)
+    pool = StalledPool()
+    queue = CommandQueue(pool, rate=1000, maxdepth=3)
+    ctx = RconChannel(queue)
+
+    @pubsub.journaled
+    async def handler(ctx, n):
+        pubsub.sendRconCommands(ctx, [['effect give Player minecraft:nausea 5 1']])
+
+    async def run():
+        dispatcher = EventDispatcher(workers=1)
+        eids = [journal.record(f'm{n}', '1234', 'test', 'test', 'viewer', '{}') for n in range(10)]
+        for n, eid in enumerate(eids):
+            dispatcher.submit(handler, ctx, n, [eid])
+        # The one worker didn't wait on RCON, so everything reached the command queue
+        while dispatcher.pending():
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+        assert queue.merged > 0
+        pool.go.set()
+        while journal.unfinished():
+            await asyncio.sleep(0.01)
+        await dispatcher.stop()
+        await queue.stop()
+    asyncio.run(run())
+    assert len(pool.sent) < 10
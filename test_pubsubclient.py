@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+from pubsubclient import PubSubClient
+
+# Just enough of a websockets connection: one recv() at a time, like the real one
+class FakeSocket:
+    def __init__(self):
+        self.frames  = asyncio.Queue()
+        self.sent    = []
+        self.closed  = False
+        self._recv   = False
+
+    async def send(self, frame):
+        self.sent.append(frame)
+        request = json.loads(frame)
+        if request['type'] == 'LISTEN':
+            # Nothing else may be reading the socket once it's subscribed
+            assert self.pubsub_keeper.done()
+        if request['type'] == 'LISTEN':
+            self.frames.put_nowait(json.dumps({'type': 'RESPONSE', 'nonce': request['nonce'], 'error': ''}))
+
+    async def recv(self):
+        if self._recv:
+            raise RuntimeError('cannot call recv while another coroutine is already waiting for the next message')
+        self._recv = True
+        try:
+            return await self.frames.get()
+        finally:
+            self._recv = False
+
+    async def close(self):
+        self.closed = True
+
+def makeClient():
+    requests = [{'type': 'LISTEN', 'nonce': '1234', 'data': {'topics': ['following.1234'], 'auth_token': 'token'}}]
+    return PubSubClient('ws://localhost', requests, lambda frame, response: None, pinginterval=0.01)
+
+def spare(client):
+    websocket = FakeSocket()
+    websocket.pubsub_keeper = asyncio.ensure_future(client._keepSpare(websocket))
+    return websocket
+
+def test_keeper_is_stopped_before_the_spare_is_subscribed(monkeypatch):
+    monkeypatch.setattr('pubsubclient.random.uniform', lambda a, b: 0)
+    async def run():
+        client = makeClient()
+        websocket = spare(client)
+        await asyncio.sleep(0.05)    # keeper has sent a PING and is waiting for the PONG
+        assert websocket._recv
+        await client._listen(websocket)
+        return websocket
+    websocket = asyncio.run(run())
+    assert websocket.pubsub_keeper.cancelled()
+    assert json.loads(websocket.sent[-1])['type'] == 'LISTEN'
+
+def test_close_stops_the_spare():
+    async def run():
+        client = makeClient()
+        websocket = spare(client)
+        client._spare = asyncio.ensure_future(asyncio.sleep(0, websocket))
+        await asyncio.sleep(0.05)
+        await client.close()
+        return client, websocket
+    client, websocket = asyncio.run(run())
+    assert websocket.closed
+    assert websocket.pubsub_keeper.done()
+    assert client._spare is None
@@ -0,0 +1,69 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+from rcon import RconConnection, RconError, RconPool, rcon_rtt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench'))
+from fakercon import FakeRconServer
+
+def test_round_trips_are_labelled_by_target():
+    async def run():
+        servers = [await FakeRconServer().start() for _ in range(2)]
+        for server in servers:
+            conn = RconConnection(server.host, server.port, server.password)
+            await conn.connect()
+            for _ in range(3):
+                await conn.command('list')
+            conn.close()
+        for server in servers:
+            await server.stop()
+        return servers
+    servers = asyncio.run(run())
+
+    snapshot = rcon_rtt.values()
+    for server in servers:
+        assert snapshot[f'rcon_command_seconds_count{{target="{server.host}:{server.port}"}}'] == 3
+
+def failingCommand(monkeypatch, failures):
+    command = RconConnection.command
+    async def flaky(self, cmd):
+        if failures:
+            raise failures.pop(0)
+        return await command(self, cmd)
+    monkeypatch.setattr(RconConnection, 'command', flaky)
+
+def test_socket_errors_are_retried_and_free_the_pool_slot(monkeypatch):
+    failingCommand(monkeypatch, [ConnectionResetError('reset'), asyncio.IncompleteReadError(b'', 4)])
+
+    async def run():
+        server = await FakeRconServer().start()
+        pool = RconPool(server.host, server.port, server.password, size=1, keepalive=0)
+        with pytest.raises(RconError):
+            await pool.commands(['say one'])
+        assert pool._count == 0
+        # With a leaked slot this would wait for a connection forever
+        results = await asyncio.wait_for(pool.commands(['say two']), timeout=5)
+        await pool.close()
+        await server.stop()
+        return server, results
+    server, results = asyncio.run(run())
+    assert results == [('say two', '')]
+    assert server.logins == 3
+
+def test_keepalive_survives_a_socket_error(monkeypatch):
+    async def run():
+        server = await FakeRconServer().start()
+        pool = RconPool(server.host, server.port, server.password, size=1, keepalive=0.05)
+        await pool.command('list')
+        failingCommand(monkeypatch, [BrokenPipeError('broken pipe')])
+        await asyncio.sleep(0.2)
+        alive, count = not pool._keeper.done(), pool._count
+        await pool.close()
+        await server.stop()
+        return alive, count
+    alive, count = asyncio.run(run())
+    assert alive
+    assert count == 0
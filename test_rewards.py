@@ -0,0 +1,34 @@
+import json
+import os
+
+from rewards import RewardRegistry
+
+def write(path, rewards, mtime):
+    path.write_text(json.dumps(rewards))
+    os.utime(path, (mtime, mtime))
+
+def test_longest_prefix_wins(tmp_path):
+    path = tmp_path / 'rewards.json'
+    write(path, {'Spawn': {'log': 'spawn'}, 'Spawn a creeper': {'log': 'creeper'}}, 1000)
+    registry = RewardRegistry(str(path))
+    registry.load()
+    assert registry.lookup('Spawn a creeper please')['log'] == 'creeper'
+    assert registry.lookup('Spawn a cow')['log'] == 'spawn'
+    assert registry.lookup('Sticky Feet') is None
+
+def test_reload_is_checked_at_most_every_interval(tmp_path, monkeypatch):
+    path = tmp_path / 'rewards.json'
+    write(path, {'Spawn': {'log': 'old'}}, 1000)
+    registry = RewardRegistry(str(path), interval=60)
+    registry.load()
+
+    stats = []
+    realstat = os.stat
+    monkeypatch.setattr(os, 'stat', lambda p, *args, **kwargs: stats.append(p) or realstat(p, *args, **kwargs))
+    write(path, {'Spawn': {'log': 'new'}}, 2000)
+    for _ in range(100):
+        assert registry.lookup('Spawn')['log'] == 'old'
+    assert stats == []
+
+    registry._nextstat = 0
+    assert registry.lookup('Spawn')['log'] == 'new'
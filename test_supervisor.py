@@ -0,0 +1,54 @@
+import pytest
+
+from chat import CHAT_LIMIT, CHAT_LIMIT_MOD
+from metrics import Counter, Registry
+from supervisor import WorkerMetrics, shardConfig
+
+def channels(count):
+    return [{'channel_id': str(n)} for n in range(count)]
+
+@pytest.mark.parametrize('count, processes, sizes', [
+    (10, 3, [4, 3, 3]),
+    (4, 4, [1, 1, 1, 1]),
+    (2, 5, [1, 1]),       # never an empty shard
+    (3, 0, [3]),
+])
+def test_channels_are_split_contiguously(count, processes, sizes):
+    config = {'channels': channels(count), 'mcver': '1.20.1'}
+    shards = shardConfig(config, processes)
+    assert [len(shard['channels']) for shard in shards] == sizes
+    assert sum((shard['channels'] for shard in shards), []) == config['channels']
+    assert all(shard['mcver'] == '1.20.1' for shard in shards)
+
+def test_workers_get_their_own_journal_and_chat_share():
+    config = {'channels': channels(4), 'journal': 'data/events.db', 'metricsport': 9100}
+    shards = shardConfig(config, 2)
+    assert [shard['worker'] for shard in shards] == [0, 1]
+    assert [shard['journal'] for shard in shards] == ['data/events.worker0.db', 'data/events.worker1.db']
+    assert all(shard['chatlimit'] == CHAT_LIMIT // 2 for shard in shards)
+    # Metrics are only served and logged by the supervisor
+    assert all('metricsport' not in shard and shard['metricslog'] == 0 for shard in shards)
+    # The config itself is left as it was
+    assert config == {'channels': channels(4), 'journal': 'data/events.db', 'metricsport': 9100}
+
+def test_chat_limit_is_shared_out():
+    assert [s['chatlimit'] for s in shardConfig({'channels': channels(3), 'chatmod': True}, 3)] == [CHAT_LIMIT_MOD // 3] * 3
+    assert [s['chatlimit'] for s in shardConfig({'channels': channels(3), 'chatlimit': 2}, 3)] == [1, 1, 1]
+
+def test_single_channel_config():
+    [shard] = shardConfig({'channel_id': '1234', 'player': 'Streamer'}, 4)
+    assert shard['channels'] == [{'channel_id': '1234', 'player': 'Streamer'}]
+    assert shard['journal'] == 'journal.worker0.db'
+
+def test_worker_metrics_are_labelled():
+    local = Registry()
+    Counter('supervisor_total', 'Test', registry=local).inc()
+    metrics = WorkerMetrics(local)
+    metrics.update(1, {'events_total': 3, 'rcon_seconds_count{target="a:1"}': 2})
+    metrics.update(0, {'events_total': 5})
+    assert metrics.snapshot() == {
+        'supervisor_total': 1,
+        'events_total{worker="0"}': 5,
+        'events_total{worker="1"}': 3,
+        'rcon_seconds_count{worker="1",target="a:1"}': 2,
+    }
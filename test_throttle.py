@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+import pytest
+
+import pubsub
+from journal import EventJournal, SKIPPED
+from throttle import Throttle, ALLOW, DEFER, MERGED, REFUND
+
+def admitAll(throttle, items, key = 'viewer'):
+    async def run():
+        ran = []
+        verdicts = [throttle.admit(key, item, ran.extend) for item in items]
+        await asyncio.sleep(0.15)
+        return verdicts, ran
+    return asyncio.run(run())
+
+def test_cooldown_defers_to_the_users_turn():
+    throttle = Throttle(cooldown=0.05)
+    verdicts, ran = admitAll(throttle, ['a', 'b'])
+    assert [verdict for verdict, wait in verdicts] == [ALLOW, DEFER]
+    assert 0 < verdicts[1][1] <= 0.05
+    assert ran == ['b']
+
+def test_merge_folds_into_the_waiting_run():
+    ran = []
+    throttle = Throttle(cooldown=0.05, policy='merge')
+    async def run():
+        verdicts = [throttle.admit('viewer', item, ran.append) for item in 'abcd']
+        await asyncio.sleep(0.15)
+        return verdicts
+    verdicts = asyncio.run(run())
+    assert [verdict for verdict, wait in verdicts] == [ALLOW, DEFER, MERGED, MERGED]
+    assert ran == [['b', 'c', 'd']]
+
+def test_refund_and_maxdefer():
+    verdicts, ran = admitAll(Throttle(cooldown=10, policy='refund'), ['a', 'b'])
+    assert [verdict for verdict, wait in verdicts] == [ALLOW, REFUND]
+    verdicts, ran = admitAll(Throttle(cooldown=10, maxdefer=5), ['a', 'b'])
+    assert [verdict for verdict, wait in verdicts] == [ALLOW, REFUND]
+    assert ran == []
+
+def test_quota_per_window():
+    throttle = Throttle(quota=2, window=10, policy='refund')
+    verdicts, ran = admitAll(throttle, ['a', 'b', 'c'])
+    assert [verdict for verdict, wait in verdicts] == [ALLOW, ALLOW, REFUND]
+    assert verdicts[2][1] == pytest.approx(10, abs=0.5)
+
+def test_users_are_separate_and_expire():
+    throttle = Throttle(cooldown=0.05, policy='refund')
+    async def run():
+        verdicts = [throttle.admit(key, None, None)[0] for key in ('a', 'b', 'a')]
+        await asyncio.sleep(0.1)
+        verdicts.append(throttle.admit('c', None, None)[0])
+        return verdicts
+    assert asyncio.run(run()) == [ALLOW, ALLOW, REFUND, ALLOW]
+    # a and b had run longer than the cooldown ago and are forgotten
+    assert len(throttle) == 1
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        Throttle(policy='drop')
+
+class Channel:
+    channel_id = '1234'
+    chat       = 'channel'
+    client_id  = None
+
+    def __init__(self, throttles):
+        self.throttles = throttles
+
+class Dispatcher:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, handler, ctx, event, eids, key = None):
+        self.submitted.extend(eids)
+
+class Chat:
+    def __init__(self):
+        self.sent = []
+
+    def put(self, channel, msg):
+        self.sent.append((channel, msg))
+
+def cheer(msgid, user, bits):
+    return json.dumps({'message_id': msgid, 'data': {'context': 'cheer', 'user_name': user, 'user_id': user + '-id',
+                                                     'bits_used': bits, 'chat_message': '', 'time': None}})
+
+def test_startup_replay_keeps_cooldowns(tmp_path, monkeypatch):
+    journal = EventJournal(str(tmp_path / 'journal.db'))
+    topic = 'channel-bits-events-v2'
+    done = journal.record('m1', '1234', topic, 'cheer', 'viewer', cheer('m1', 'viewer', 100))
+    journal.done(done)
+    # Deferred when the bot stopped, and another user's that never ran
+    deferred = journal.record('m2', '1234', topic, 'cheer', 'viewer', cheer('m2', 'viewer', 100))
+    other = journal.record('m3', '1234', topic, 'cheer', 'other', cheer('m3', 'other', 100))
+
+    ctx = Channel({'cheer': Throttle(cooldown=60, policy='refund')})
+    dispatcher = Dispatcher()
+    monkeypatch.setattr(pubsub, 'journal', journal)
+    monkeypatch.setattr(pubsub, 'channels', [ctx])
+    monkeypatch.setattr(pubsub, 'channelsById', {ctx.channel_id: ctx})
+    monkeypatch.setattr(pubsub, 'dispatcher', dispatcher)
+    monkeypatch.setattr(pubsub, 'chatqueue', Chat())
+
+    async def run():
+        entries = journal.unfinished()
+        pubsub.seedThrottles()
+        for entry in entries:
+            pubsub.replayEvent(entry, throttle=True)
+    asyncio.run(run())
+
+    assert dispatcher.submitted == [other]
+    assert journal.latest('1234', 'viewer').state == SKIPPED
+    (channel, msg), = pubsub.chatqueue.sent
+    assert channel == 'channel' and msg.startswith('@viewer Cheer rewards are on cooldown')
@@ -0,0 +1,116 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+# Throttle verdicts
+ALLOW  = 'allow'     # run it now
+DEFER  = 'defer'     # will be run later by the throttle
+MERGED = 'merged'    # folded into a deferred run that is already waiting
+REFUND = 'refund'    # don't run it, tell the viewer (and give back what can be given back)
+
+POLICIES = ('defer', 'merge', 'refund')
+
+class _Slot:
+    __slots__ = ('times', 'pending')
+
+    def __init__(self, quota):
+        self.times   = deque(maxlen=quota)    # when the user's last runs were (or are booked)
+        self.pending = None                    # items waiting for a merged run
+
+# Per-user cooldown and quota for one kind of event (eg. cheers, or one channel points reward)
+#
+# A user may run it once every cooldown seconds and at most quota times per window seconds.
+# Each user has a ring buffer of their last quota run times, so checking and booking a
+# run is constant time, and users are kept in an LRU ordered dict that forgets them once
+# their newest run is older than both the cooldown and the window. An event that isn't
+# allowed yet is handled by the policy:
+#   defer:  run when the user's turn comes (each event booked its own turn), up to maxdefer
+#           seconds ahead, further ones are refunded
+#   merge:  like defer, but everything arriving while a deferred run is waiting is folded
+#           into it, so one run covers them all
+#   refund: not run at all
+class Throttle:
+    def __init__(self, cooldown = 0, quota = 0, window = 60, policy = 'defer', maxdefer = 300, message = None):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown throttle policy: {policy}')
+        self.cooldown = cooldown
+        self.quota    = quota
+        self.window   = window if quota else 0
+        self.policy   = policy
+        self.maxdefer = maxdefer
+        self.message  = message
+        self.ttl      = max(cooldown, self.window)
+        self._slots   = OrderedDict()    # user key -> _Slot
+
+    def __len__(self):
+        return len(self._slots)
+
+    # Seconds until the user may run it again (0: now)
+    def wait(self, key, now = None):
+        slot = self._slots.get(key)
+        if slot is None or not slot.times:
+            return 0
+        now = time.monotonic() if now is None else now
+        wait = slot.times[-1] + self.cooldown - now
+        if self.quota and len(slot.times) == self.quota:
+            wait = max(wait, slot.times[0] + self.window - now)
+        return max(0, wait)
+
+    def _book(self, key, at):
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _Slot(self.quota or 1)
+        else:
+            self._slots.move_to_end(key)
+        slot.times.append(at)
+        return slot
+
+    # Book a run that has already happened (at is a time.monotonic() time, possibly before
+    # this process started), so a restart doesn't reset the user's cooldown/quota
+    def seed(self, key, at):
+        self._expire(time.monotonic())
+        self._book(key, at)
+
+    def _expire(self, now):
+        while self._slots:
+            key, slot = next(iter(self._slots.items()))
+            if slot.pending is not None or (slot.times and slot.times[-1] + self.ttl > now):
+                break
+            del self._slots[key]
+
+    # Decide what to do with an item from the user key. Deferred items are passed to
+    # run(items) (a list, several for a merged run) when their turn comes.
+    # Returns (verdict, seconds until the user's turn).
+    def admit(self, key, item, run):
+        now = time.monotonic()
+        self._expire(now)
+        slot = self._slots.get(key)
+        if slot is not None and slot.pending is not None:
+            slot.pending.append(item)
+            return MERGED, max(0, slot.times[-1] - now)
+
+        wait = self.wait(key, now)
+        if wait <= 0:
+            self._book(key, now)
+            return ALLOW, 0
+        if self.policy == 'refund' or wait > self.maxdefer:
+            return REFUND, wait
+
+        slot = self._book(key, now + wait)
+        if self.policy == 'merge':
+            slot.pending = [item]
+            asyncio.get_running_loop().call_later(wait, self._runMerged, key, slot, run)
+        else:
+            asyncio.get_running_loop().call_later(wait, run, [item])
+        return DEFER, wait
+
+    def _runMerged(self, key, slot, run):
+        items, slot.pending = slot.pending, None
+        run(items)
+
+# Throttles per scope from a channel's "throttle" config, eg.
+#   {"cheer": {"cooldown": 10, "policy": "merge"},
+#    "points:spawn something bad": {"cooldown": 60, "quota": 3, "window": 600, "policy": "refund"}}
+# Scopes are event kinds (cheer, points, ...) or 'points:<reward title>' for one reward.
+def loadThrottles(spec):
+    return {scope.lower(): Throttle(**settings) for scope, settings in (spec or {}).items()}
@@ -0,0 +1,35 @@
+# Twitch event transports
+#
+# A transport delivers the events of one shard of channels (see shardChannels) to pubsub.py.
+# Whatever the wire protocol, every event comes out as
+#
+#   onEvent(channel_id, prefix, raw, message)
+#
+# prefix is the PubSub topic prefix the event belongs to (the keys of pubsub.topicHandlers),
+# raw the event payload in the PubSub message format as JSON text (logged and journaled, so
+# replays and ?redo work whichever transport received the event) and message the same
+# payload already decoded, or None to have it decoded only if a handler needs it.
+# Handlers never know which transport is in use.
+#
+# The "transport" config key picks the implementation:
+#   pubsub:   PubSubTransport (pubsubclient.py), one LISTEN per channel, 50 topics a socket
+#   eventsub: EventSubTransport (eventsub.py), EventSub WebSocket subscriptions made over
+#             Helix, up to 300 a socket so far fewer sockets for many channels
+class Transport:
+    # Most topics/subscriptions one socket can carry
+    limit = 50
+
+    def __init__(self, shard, prefixes, onEvent, config):
+        self.shard    = shard
+        self.prefixes = prefixes
+        self.onEvent  = onEvent
+        self.config   = config
+        self.name     = f'{type(self).__name__} (' + ', '.join(ctx.chat for ctx in shard) + ')'
+
+    # Topics/subscriptions each channel needs on the socket for the given prefixes
+    @classmethod
+    def topics(cls, prefixes):
+        return len(prefixes)
+
+    async def run(self):
+        raise NotImplementedError